@@ -1,5 +1,9 @@
 import pycovid19usAltair
 import pycovid19globalAltair
+import pycovid19endpoint
+import pycovid19metrics
+import pycovid19profile
+import pycovid19refresh
 import panel as pn
 
 us_app = pycovid19usAltair.us_app
@@ -7,4 +11,15 @@ global_app = pycovid19globalAltair.global_app
 
 #us_app.show(host='localhost', port=8889, websocket_origin='localhost:8889', open=False)
 
-pn.serve({'By_Country': global_app, 'US_Only': us_app}, port=8890, websocket_origin='localhost:8890', show=False)
+# Every dashboard is a factory called for every session, so that sessions do not share widgets
+apps = {'By_Country': global_app, 'US_Only': us_app}
+
+# Served by `python altair_app.py`, or by several worker processes with `python launcher.py altair_app.py`
+if __name__ == '__main__':
+    # Keep the data up to date in the background, sessions never wait on a download
+    pycovid19refresh.start()
+
+    # The charts' data is served next to the apps, at content-hashed URLs the browser caches, the
+    # process' metrics at /metrics and, in profiling mode, its slowest profiles at /admin/profiles
+    pn.serve(apps, port=8890, websocket_origin='localhost:8890', show=False,
+             extra_patterns=pycovid19endpoint.routes() + pycovid19metrics.routes() + pycovid19profile.routes())
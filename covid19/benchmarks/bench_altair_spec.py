@@ -0,0 +1,86 @@
+"""Vega-Lite spec size of the layered Altair line chart, per layer data against one top-level dataset
+
+Usage:
+    python bench_altair_spec.py
+
+For 1, 10 and 50 selected states, builds the line + legend points + tooltips chart of
+Covid19ViewerUS.plotAltairLineChart the way it used to be built (every layer with its own copy of
+the data, filtered twice) and the way it is built now (one top-level dataset all the layers
+reference), then reports the size of the serialized spec and the time taken to produce it.  Both
+are measured with Altair consolidating identical datasets (its default) and without it.
+"""
+import json
+import os
+import sys
+import time
+import altair as alt
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'parameterized_classes'))
+from altair_covid19_viewer import Covid19ViewerUS
+import pycovid19cube
+
+REPEAT = 3
+SELECTED = (1, 10, 50)
+
+
+def per_layer(viewer: Covid19ViewerUS) -> alt.LayerChart:
+    """ The chart plotAltairLineChart built before the layers shared one dataset """
+
+    iso_date = viewer.covid19_date.strftime('%Y-%m-%d')
+    alt_chart = alt.Chart(viewer.dfByState()[:iso_date]
+                 .query("State_Province in(@viewer.state_province)")
+                 .reset_index()
+                 .rename(columns={'index': 'Date'})
+                ).mark_line().encode(
+                 x=alt.X(title='Date', field='Date', type='temporal'),
+                 y=alt.Y(title='# of ' + viewer.confirmed_deaths, field='Qty_Confirmed',
+                         type='quantitative', scale=alt.Scale(type=viewer.ylog)
+                        ),
+                 color=alt.Color(field='State_Province', type='nominal', legend=alt.Legend(title="State/Province")),
+                 tooltip=[alt.Tooltip(field='State_Province', type='nominal'),
+                          alt.Tooltip(field='Qty_Confirmed', type='quantitative'),
+                          alt.Tooltip(field='Date', type='temporal')
+                         ]
+                )
+    points = alt.Chart(viewer.dfByState()[:iso_date]
+              .query("State_Province in(@viewer.state_province)")
+              .reset_index()
+              .rename(columns={'index': 'Date'})
+             ).mark_circle(size=0).encode(color='State_Province')
+    tooltips = alt_chart.mark_point(size=100, opacity=0, tooltip=alt.TooltipContent("data"))
+    return (alt_chart + points + tooltips).properties(width=700, height=400)
+
+
+def top_level(viewer: Covid19ViewerUS) -> alt.LayerChart:
+    """ The chart plotAltairLineChart builds, from scratch instead of from its cached stages """
+
+    long_index = pycovid19cube.get_cube('US', viewer.confirmed_deaths).long_index()
+    return viewer.renderAltairLineChart(viewer.filterByState(long_index))
+
+
+def measure(build, viewer: Covid19ViewerUS):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        spec = build(viewer).to_dict()
+        text = json.dumps(spec)
+        timings.append(time.perf_counter() - start)
+    # Copies of the data embedded in the spec, consolidated datasets or inline values
+    copies = len(spec.get('datasets', {})) + text.count('"values"')
+    return len(text), copies, min(timings)
+
+
+if __name__ == '__main__':
+    # 50 states of daily rows are well over Altair's default limit of 5,000 rows
+    alt.data_transformers.disable_max_rows()
+    viewer = Covid19ViewerUS()
+    entities = list(pycovid19cube.get_cube('US', viewer.confirmed_deaths).entities)
+
+    print(f'{"states":>6s} {"consolidated":>12s} {"chart":>10s} {"spec KB":>9s} {"copies":>7s} {"build ms":>9s}')
+    for consolidate in (True, False):
+        alt.data_transformers.consolidate_datasets = consolidate
+        for selected in SELECTED:
+            viewer.state_province = entities[:selected]
+            for name, build in (('per layer', per_layer), ('top-level', top_level)):
+                size, copies, timing = measure(build, viewer)
+                print(f'{selected:6d} {str(consolidate):>12s} {name:>10s} {size / 1024:9.1f} {copies:7d} {timing * 1000:9.1f}')
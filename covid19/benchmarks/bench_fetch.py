@@ -0,0 +1,100 @@
+"""Fetching the five upstream files one after another against all at once, from a local stand-in
+
+Usage:
+    python bench_fetch.py
+
+Serves stand-ins of the four JHU CSVs and the county GeoJSON from a local HTTP server that answers
+each file after a latency of its own, fails the first request for the global deaths with a 503 and
+lets the first request for the GeoJSON hang past the timeout.  Then times pycovid19cache.fetch_all:
+    sequential  one connection, a cold cache: the sum of every file, retries included
+    parallel    CONNECTIONS connections, a cold cache: the slowest file
+    revalidate  CONNECTIONS connections, a warm cache: every file answers 304 Not Modified, after
+                the same failures
+and prints the breakdown by file of each run.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import collections
+import os
+import sys
+import tempfile
+import threading
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import pycovid19cache
+
+# File name: (latency in seconds, size in bytes)
+FILES = {'time_series_covid19_confirmed_US.csv': (1.2, 4_000_000),
+         'time_series_covid19_deaths_US.csv': (1.0, 4_000_000),
+         'time_series_covid19_confirmed_global.csv': (0.4, 400_000),
+         'time_series_covid19_deaths_global.csv': (0.4, 400_000),
+         'geojson-counties-fips.json': (0.8, 3_000_000)
+        }
+FAIL = 'time_series_covid19_deaths_global.csv'
+HANG = 'geojson-counties-fips.json'
+TIMEOUT = 1.5
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """ Answers every file after its latency, with an ETag, failing the first request of FAIL and HANG """
+
+    requests = collections.Counter()
+
+    def do_GET(self):
+        name = self.path.lstrip('/')
+        if name not in FILES:
+            self.send_error(404)
+            return
+        latency, size = FILES[name]
+        self.requests[name] += 1
+        first = self.requests[name] == 1
+        if name == HANG and first:
+            time.sleep(TIMEOUT + 0.5)
+        time.sleep(latency)
+        if name == FAIL and first:
+            self.send_error(503)
+            return
+        etag = f'"{name}-{size}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        try:
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            self.wfile.write(b'0' * size)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the hanging request
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def run(name: str, urls: list, connections: int) -> None:
+    StandIn.requests.clear()
+    start = time.perf_counter()
+    reports = pycovid19cache.fetch_all(urls, max_age=0, connections=connections)
+    print(f'{name}: {time.perf_counter() - start:.2f} s with {connections} connection(s)')
+    for report in reports.values():
+        print('   ', report)
+
+
+if __name__ == '__main__':
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [f'http://127.0.0.1:{server.server_port}/{name}' for name in FILES]
+    pycovid19cache.TIMEOUT = TIMEOUT
+    print(f'Latency of the slowest file {max(latency for latency, _ in FILES.values()):.1f} s, '
+          f'of all files {sum(latency for latency, _ in FILES.values()):.1f} s, timeout {TIMEOUT} s, '
+          f'{pycovid19cache.RETRIES} retries after {pycovid19cache.BACKOFF} s, then twice as long')
+
+    with tempfile.TemporaryDirectory() as cold:
+        pycovid19cache.CACHE_DIR = cold
+        run('sequential', urls, 1)
+    with tempfile.TemporaryDirectory() as cold:
+        pycovid19cache.CACHE_DIR = cold
+        run('parallel', urls, pycovid19cache.CONNECTIONS)
+        run('revalidate', urls, pycovid19cache.CONNECTIONS)
+    server.shutdown()
@@ -0,0 +1,61 @@
+"""Payload size and render time of the county choropleth at every simplification level
+
+Usage:
+    python bench_geometry.py [state]
+
+For the given state (default Ohio) and each of pycovid19geo.TOLERANCES, reports the size of the
+state's county GeoJSON, the size of the Plotly figure sent to the browser and the time taken to
+build and serialize that figure.  The level the apps pick for the state is marked with a *.
+"""
+import json
+import os
+import sys
+import time
+import plotly.express as px
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import pycovid19geo
+import pycovid19store
+
+REPEAT = 5
+WIDTH, HEIGHT = 1400, 700
+
+
+def render(df, geo_data: dict, center: dict, zoom: float) -> str:
+    """ The choropleth built by the apps, serialized as Plotly.js receives it """
+
+    fig = px.choropleth_mapbox(df, geojson=geo_data, locations='FIPS', color='Confirmed_Cases',
+                               mapbox_style="carto-positron", zoom=zoom, center=center, opacity=0.5,
+                               hover_name='County', width=WIDTH, height=HEIGHT
+                              )
+    return fig.to_json()
+
+
+if __name__ == '__main__':
+    state = sys.argv[1] if len(sys.argv) > 1 else 'Ohio'
+    df = pycovid19store.get_dataset('US', 'Confirmed Cases')
+    df = df.loc[df['Province_State'] == state, ['FIPS', 'Admin2', df.columns[-1]]]
+    df = df.rename(columns={df.columns[2]: 'Confirmed_Cases', 'Admin2': 'County'})
+
+    _, center, zoom = pycovid19geo.state_map(state, WIDTH, HEIGHT)
+    chosen = pycovid19geo.tolerance_for_zoom(zoom)
+    print(f'{state}: {len(df)} counties, zoom {zoom}')
+    print(f'{"tolerance":>10s} {"vertices":>9s} {"GeoJSON KB":>11s} {"figure KB":>10s} {"render ms":>10s}')
+
+    for tolerance in pycovid19geo.TOLERANCES:
+        start = time.perf_counter()
+        pycovid19geo.geometry_path(tolerance)
+        prepare = time.perf_counter() - start
+
+        geo_data = pycovid19geo.state_geojson(state, tolerance)
+        vertices = sum(1 for feature in geo_data['features']
+                       for _ in pycovid19geo._positions(feature['geometry']['coordinates']))
+        timings = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            figure = render(df, geo_data, center, zoom)
+            timings.append(time.perf_counter() - start)
+
+        print(f'{tolerance:10g} {vertices:9d} {len(json.dumps(geo_data)) / 1024:11.1f} '
+              f'{len(figure) / 1024:10.1f} {min(timings) * 1000:10.1f}'
+              f'{"  *" if tolerance == chosen else ""}'
+              f'{f"   (simplified in {prepare:.1f} s)" if prepare > 0.5 else ""}')
@@ -0,0 +1,68 @@
+"""Timings of the vectorized ingest normalizer against the per-row parsing it replaced
+
+Usage:
+    python bench_ingest.py [path/to/time_series_covid19_confirmed_US.csv]
+
+Without an argument the US county file is taken from the data cache (downloading it if needed).
+"""
+from datetime import datetime
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+import pyarrow.parquet as pq
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pycovid19sources import source_url
+import pycovid19cache
+import pycovid19ingest
+
+REPEAT = 5
+
+
+def per_row(path: str) -> pd.DataFrame:
+    """ The parsing done by getData before the ingest module existed """
+
+    df = pd.read_csv(path, converters={'FIPS': lambda x: int(float(x)) if x != '' else x}).query("FIPS != ''")
+    df['FIPS'] = df['FIPS'].astype('str').str.zfill(5)
+    if 'Population' in df.columns:
+        df.drop(columns='Population', inplace=True)
+    try:
+        dates = [datetime.strptime(day, '%m/%d/%y') for day in df.columns[11:]]
+    except ValueError:
+        dates = [datetime.strptime(day, '%m/%d/%Y') for day in df.columns[11:]]
+    return df
+
+
+def vectorized(path: str) -> pd.DataFrame:
+    table = pycovid19ingest.read_normalized(path, 'US')
+    dates = pycovid19ingest.parse_dates(pycovid19ingest.date_columns(table.column_names))
+    return table.to_pandas()
+
+
+def best_of(function, path: str) -> float:
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(path)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else pycovid19cache.fetch(source_url('US', 'Confirmed Cases'))
+    df = vectorized(path)
+    print(f'{os.path.basename(path)}: {os.path.getsize(path) / 2**20:.1f} MB, '
+          f'{len(df)} counties x {len(pycovid19ingest.date_columns(df.columns))} days')
+
+    baseline = best_of(per_row, path)
+    print(f'{"per-row converters + strptime":32s} {baseline:8.3f} s')
+    new = best_of(vectorized, path)
+    print(f'{"vectorized normalizer":32s} {new:8.3f} s   ({baseline / new:.1f}x)')
+
+    # What every later load costs once the normalized table is written as a snapshot
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, 'snapshot.parquet')
+        pq.write_table(pycovid19ingest.read_normalized(path, 'US'), snapshot, compression='zstd')
+        load = best_of(lambda p: pq.read_table(p, memory_map=True).to_pandas(), snapshot)
+    print(f'{"snapshot load":32s} {load:8.3f} s   ({baseline / load:.1f}x)')
@@ -0,0 +1,66 @@
+"""Filtering the long-format counts for a chart, DataFrame.query against the entity-grouped index
+
+Usage:
+    python bench_long_format.py
+
+For both regions and 1, 10 and 50 selected states/countries (or all of them if fewer), times how
+long it takes to get the chart data of the selection up to 30 days before the latest date:
+    query  the melted frame sliced by date, then filtered with DataFrame.query, as the charts used to
+    index  LongIndex.select, a searchsorted on the dates and one slice per selected entity
+and checks that both return the same rows.
+"""
+import os
+import sys
+import time
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pycovid19ingest import ENTITY_COLUMNS
+import pycovid19cube
+
+REPEAT = 20
+SELECTED = (1, 10, 50)
+
+
+def query(df_long: pd.DataFrame, entities: list, end: pd.Timestamp) -> pd.DataFrame:
+    """ The chart data as it used to be filtered """
+
+    return (df_long[:end.strftime('%Y-%m-%d')]
+            .query("Entity in(@entities)")
+            .reset_index()
+            .rename(columns={'index': 'Date'})
+           )
+
+
+def index(long_index: pycovid19cube.LongIndex, entities: list, end: pd.Timestamp) -> pd.DataFrame:
+    return long_index.select(entities, end=end)
+
+
+def measure(filter_, *args) -> tuple:
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = filter_(*args)
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def same_rows(a: pd.DataFrame, b: pd.DataFrame) -> bool:
+    columns = ['Entity', 'Date']
+    a = a.sort_values(columns).reset_index(drop=True)
+    b = b.sort_values(columns).reset_index(drop=True)
+    return a[columns + ['Qty']].equals(b[columns + ['Qty']])
+
+
+if __name__ == '__main__':
+    print(f'{"region":>7s} {"selected":>8s} {"rows":>7s} {"query ms":>9s} {"index ms":>9s} {"speedup":>8s} {"same":>5s}')
+    for region in ENTITY_COLUMNS:
+        cube = pycovid19cube.get_cube(region, 'Confirmed Cases')
+        df_long = cube.long_frame()
+        long_index = cube.long_index()
+        end = cube.dates[-31]
+        for selected in SELECTED:
+            entities = list(cube.entities[:selected])
+            expected, query_time = measure(query, df_long, entities, end)
+            result, index_time = measure(index, long_index, entities, end)
+            print(f'{region:>7s} {len(entities):8d} {len(result):7d} {query_time * 1000:9.2f} '
+                  f'{index_time * 1000:9.2f} {query_time / index_time:7.1f}x {str(same_rows(expected, result)):>5s}')
@@ -0,0 +1,323 @@
+"""Latency of the served apps under N concurrent Bokeh sessions replaying widget changes, offline
+
+Usage:
+    python bench_sessions.py [--script main_app.py] [--app US_Only] [--sessions 1 4 16 32] [--actions N]
+                             [--think SECONDS] [--workers N] [--counties N] [--days N]
+
+Writes synthetic JHU files (see synthetic.py), serves them from a local stand-in of GitHub and, for each
+number of sessions, starts `launcher.py script` against the stand-in.  Then opens that many sessions the
+way a browser does: loads the page of app, connects its websocket with the page's session token, pulls
+the document and announces it ready, which renders the deferred charts.  Each session then replays
+--actions random widget changes, --think seconds apart on average: pick one to three states (or
+countries), toggle Confirmed Cases/Deaths, move the date within the last 90 days, switch the y scale.
+Every change is a PATCH-DOC message as BokehJS sends it.  Reports:
+    load      time from announcing the document ready until its deferred charts are shown, for the
+              sessions whose document came without the charts
+    update    time from sending a change until a chart is re-rendered and none is loading any more
+              (p50, p95, p99)
+    CPU       CPU time of the server's processes over the run, in % of one core
+    RSS       peak resident memory of the server's processes, sampled every SAMPLE seconds
+Every session of main_app.py's apps has widgets and charts of its own, built by the app's factory, so a
+session only waits for the charts of its own changes, and for a core shared with the other sessions.
+"""
+from datetime import date, timedelta
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Set
+import argparse
+import asyncio
+import functools
+import json
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import tornado.httpclient
+import tornado.websocket
+from bokeh.protocol import Protocol
+from bokeh.protocol.receiver import Receiver
+import synthetic
+from bench_workers import wait_ready
+
+LAUNCHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'launcher.py')
+# Seconds a chart may take to be shown before the change counts as timed out
+UPDATE_TIMEOUT = 120
+# Seconds between two samples of the server's memory
+SAMPLE = 0.5
+# Titles of the widgets a session changes
+DATE, ENTITIES, MEASURE, SCALE = 'Date:', ('State:', 'Country:'), 'Confirmed Cases or Deaths:', 'log-y?'
+
+
+class StandIn(SimpleHTTPRequestHandler):
+    """ Serves the synthetic files as GitHub would """
+
+    def log_message(self, *args):
+        pass
+
+
+def models(obj: Any, found: Dict[str, dict]) -> Dict[str, dict]:
+    """ Every model of a document as serialized by Bokeh, by id """
+
+    if isinstance(obj, dict):
+        if obj.get('type') == 'object' and 'id' in obj and 'name' in obj:
+            found[obj['id']] = obj
+        for value in obj.values():
+            models(value, found)
+    elif isinstance(obj, list):
+        for value in obj:
+            models(value, found)
+    return found
+
+
+class Session:
+    """ A browser's session of an app, as seen through its websocket """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.receiver = Receiver(Protocol())
+        self.msgid = 0
+        # Widget title: model id, and the widgets' current values, by model id
+        self.widgets: Dict[str, str] = {}
+        self.values: Dict[str, Any] = {}
+        self.options: Dict[str, list] = {}
+        # The app's own panes, those showing Panel's loading indicator, and those re-rendered since the last
+        # change.  Models of a chart can be replaced while loading, only the panes holding them are followed
+        self.panes: Set[str] = set()
+        self.loading: Set[str] = set()
+        self.changed: Set[str] = set()
+        self.updated = asyncio.Event()
+
+    async def connect(self) -> None:
+        client = tornado.httpclient.AsyncHTTPClient()
+        response = await client.fetch(self.url, request_timeout=UPDATE_TIMEOUT)
+        token = re.search(r'"token":\s*"([^"]+)"', response.body.decode()).group(1)
+        # The balancer's cookie keeps the websocket on the worker that created the session
+        cookie = response.headers.get('Set-Cookie', '').split(';')[0]
+        request = tornado.httpclient.HTTPRequest(self.url.replace('http', 'ws', 1) + '/ws',
+                                                 headers={'Cookie': cookie} if cookie else None)
+        self.websocket = await tornado.websocket.websocket_connect(request, subprotocols=['bokeh', token])
+        await self.receive()
+        self.send('PULL-DOC-REQ', {})
+        reply = await self.receive()
+        for id, model in models(reply.content, {}).items():
+            self.panes.add(id)
+            attributes = model.get('attributes', {})
+            # Deferred charts show the loading indicator until the document is announced ready
+            if 'pn-loading' in attributes.get('css_classes', []):
+                self.loading.add(id)
+            if 'title' in attributes and 'value' in attributes:
+                self.widgets[attributes['title']] = id
+                self.values[id] = attributes['value']
+                self.options[id] = attributes.get('options', [])
+        # A refresh of the data, or a late chart of a change, can arrive between two of this session's changes
+        self.listener = asyncio.ensure_future(self.listen())
+
+    def send(self, msgtype: str, content: dict) -> None:
+        self.msgid += 1
+        self.websocket.write_message(json.dumps({'msgid': str(self.msgid), 'msgtype': msgtype}))
+        self.websocket.write_message('{}')
+        self.websocket.write_message(json.dumps(content))
+
+    async def receive(self):
+        while True:
+            fragment = await self.websocket.read_message()
+            if fragment is None:
+                raise ConnectionError('The server closed the websocket')
+            message = await self.receiver.consume(fragment)
+            if message is not None:
+                return message
+
+    async def listen(self) -> None:
+        while True:
+            self.apply(await self.receive())
+            self.updated.set()
+
+    def apply(self, message) -> None:
+        if message.msgtype != 'PATCH-DOC':
+            return
+        for event in message.content.get('events', []):
+            if event.get('kind') != 'ModelChanged':
+                continue
+            id, attr, new = event['model']['id'], event['attr'], event['new']
+            if attr == 'css_classes' and id in self.panes:
+                if 'pn-loading' in new:
+                    self.loading.add(id)
+                else:
+                    self.loading.discard(id)
+            elif attr == 'children':
+                self.changed.add(id)
+            elif attr == 'value' and id in self.values:
+                self.values[id] = new
+
+    async def change(self, events: List[dict]) -> float:
+        """ Seconds from sending the events until a chart is re-rendered and none is loading any more """
+
+        self.changed.clear()
+        start = time.perf_counter()
+        self.send('PATCH-DOC', {'events': events})
+        deadline = start + UPDATE_TIMEOUT
+        while not self.changed or self.loading:
+            if self.listener.done():
+                # The websocket was closed
+                self.listener.result()
+            self.updated.clear()
+            await asyncio.wait_for(self.updated.wait(), deadline - time.perf_counter())
+        return time.perf_counter() - start
+
+    def ready(self) -> List[dict]:
+        """ The event BokehJS sends once the document is rendered, which loads the deferred charts """
+
+        return [{'kind': 'MessageSent', 'msg_type': 'bokeh_event',
+                 'msg_data': {'type': 'event', 'name': 'document_ready', 'values': {'type': 'map', 'entries': []}}}]
+
+    def action(self, rng: random.Random) -> List[dict]:
+        """ A random widget change among those of a user: entities, measure, date or scale """
+
+        def value(title: str, new: Any) -> List[dict]:
+            return [{'kind': 'ModelChanged', 'model': {'id': self.widgets[title]}, 'attr': 'value', 'new': new}]
+
+        entities = next(title for title in ENTITIES if title in self.widgets)
+        while True:
+            kind = rng.choice(['entities', 'measure', 'date', 'scale'])
+            if kind == 'entities':
+                options = [option[0] if isinstance(option, list) else option
+                           for option in self.options[self.widgets[entities]]]
+                new = rng.sample(options, min(len(options), rng.randint(1, 3)))
+                title = entities
+            elif kind == 'measure':
+                title, new = MEASURE, rng.choice(['Confirmed Cases', 'Deaths'])
+            elif kind == 'date':
+                title, new = DATE, (date.today() - timedelta(days=rng.randint(1, 90))).isoformat()
+            else:
+                title, new = SCALE, rng.choice(['True', 'False'])
+            # A value the widget already has would not change anything
+            if new != self.values[self.widgets[title]]:
+                self.values[self.widgets[title]] = new
+                return value(title, new)
+
+
+def processes(pid: int) -> List[int]:
+    """ A process and its descendants, e.g. the launcher and its workers """
+
+    found = [pid]
+    for task in os.listdir(f'/proc/{pid}/task'):
+        with open(f'/proc/{pid}/task/{task}/children') as f:
+            for child in f.read().split():
+                found += processes(int(child))
+    return found
+
+
+def usage(pid: int) -> tuple:
+    """ CPU seconds and resident MB of a process tree """
+
+    cpu, rss = 0.0, 0.0
+    for process in processes(pid):
+        try:
+            with open(f'/proc/{process}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+            with open(f'/proc/{process}/status') as f:
+                rss += next(int(line.split()[1]) for line in f if line.startswith('VmRSS')) / 1024
+        except (FileNotFoundError, ProcessLookupError, StopIteration):
+            # Gone in between
+            pass
+    return cpu, rss
+
+
+async def user(url: str, actions: int, think: float, seed: int, results: Dict[str, list]) -> None:
+    rng = random.Random(seed)
+    session = Session(url)
+    try:
+        await session.connect()
+        if session.loading:
+            results['load'].append(await session.change(session.ready()))
+        else:
+            # The shared charts were rendered by an earlier session and came with the document
+            session.send('PATCH-DOC', {'events': session.ready()})
+        for _ in range(actions):
+            await asyncio.sleep(rng.expovariate(1 / think))
+            results['update'].append(await session.change(session.action(rng)))
+    except (asyncio.TimeoutError, ConnectionError, tornado.websocket.WebSocketClosedError) as e:
+        results['errors'].append(repr(e))
+    finally:
+        if getattr(session, 'listener', None):
+            session.listener.cancel()
+        if getattr(session, 'websocket', None):
+            session.websocket.close()
+
+
+async def load(url: str, server: int, sessions: int, actions: int, think: float) -> dict:
+    results: Dict[str, list] = {'load': [], 'update': [], 'errors': []}
+    peak = 0.0
+
+    async def sample() -> None:
+        nonlocal peak
+        while True:
+            peak = max(peak, usage(server)[1])
+            await asyncio.sleep(SAMPLE)
+
+    await wait_ready(url)
+    sampler = asyncio.ensure_future(sample())
+    cpu, start = usage(server)[0], time.perf_counter()
+    await asyncio.gather(*[user(url, actions, think, seed, results) for seed in range(sessions)])
+    results['cpu'] = (usage(server)[0] - cpu) / (time.perf_counter() - start) * 100
+    sampler.cancel()
+    results['rss'] = peak
+    return results
+
+
+def percentiles(values: list) -> str:
+    if not values:
+        return f'{"-":>7s} {"-":>7s} {"-":>7s}'
+    return ' '.join(f'{np.percentile(values, q) * 1000:7.0f}' for q in (50, 95, 99))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load the served apps with concurrent Bokeh sessions, offline')
+    parser.add_argument('--script', default='main_app.py', help='entry script served (default main_app.py)')
+    parser.add_argument('--app', default='US_Only', help='app of the script (default US_Only)')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 4, 16, 32], help='concurrent sessions of each run')
+    parser.add_argument('--actions', type=int, default=10, help='widget changes of each session (default 10)')
+    parser.add_argument('--think', type=float, default=1.0, help='mean seconds between two changes (default 1)')
+    parser.add_argument('--workers', type=int, default=1, help='server processes (default 1)')
+    parser.add_argument('--counties', type=int, default=3000, help='US counties of the data (default 3000)')
+    parser.add_argument('--days', type=int, default=400, help='days of the data (default 400)')
+    arguments = parser.parse_args()
+
+    workspace = tempfile.TemporaryDirectory()
+    data = os.path.join(workspace.name, 'data')
+    synthetic.write_dataset(data, arguments.counties, arguments.days)
+    standin = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(StandIn, directory=data))
+    threading.Thread(target=standin.serve_forever, daemon=True).start()
+    environment = dict(os.environ,
+                       COVID19_JHU_BASE_URL=f'http://127.0.0.1:{standin.server_port}/',
+                       COVID19_GEOJSON_URL=f'http://127.0.0.1:{standin.server_port}/geojson-counties-fips.json',
+                       COVID19_CACHE_DIR=os.path.join(workspace.name, 'cache'))
+
+    print(f'{os.cpu_count()} CPUs, {arguments.workers} worker(s), {arguments.counties:,} counties x {arguments.days} days, '
+          f'{arguments.actions} changes per session, {arguments.think} s apart on average')
+    print(f'{"sessions":>8s} {"load p50":>8s} {"update p50":>10s} {"p95":>7s} {"p99":>7s} {"CPU %":>6s} {"RSS MB":>7s} '
+          f'{"errors":>6s}')
+    for i, sessions in enumerate(arguments.sessions):
+        port = 8950 + 10 * i
+        launcher = subprocess.Popen([sys.executable, LAUNCHER, arguments.script, '--workers', str(arguments.workers),
+                                     '--port', str(port)],
+                                    cwd=os.path.dirname(LAUNCHER), env=environment,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            tornado.httpclient.AsyncHTTPClient.configure(None, max_clients=max(10, sessions))
+            results = asyncio.run(load(f'http://localhost:{port}/{arguments.app}', launcher.pid, sessions,
+                                       arguments.actions, arguments.think))
+        finally:
+            launcher.send_signal(signal.SIGTERM)
+            launcher.wait()
+        load_p50 = f'{np.percentile(results["load"], 50) * 1000:8.0f}' if results['load'] else f'{"-":>8s}'
+        print(f'{sessions:8d} {load_p50} {percentiles(results["update"]):>26s} {results["cpu"]:6.0f} '
+              f'{results["rss"]:7.0f} {len(results["errors"]):6d}', flush=True)
+    standin.shutdown()
+    workspace.cleanup()
@@ -0,0 +1,97 @@
+"""Resident memory of 1, 2, 4 and 8 server processes, each with its own copy of the data or
+attached to the shared block, see pycovid19shared
+
+Usage:
+    python bench_shared.py
+
+Refreshes the data once, which publishes it, then for each number of processes starts them all
+and, once every one holds the data and has read all of its arrays, reads their memory from
+/proc/<pid>/smaps_rollup (Linux only):
+    none     no data, the memory of the imports alone
+    private  every process builds the store entries itself, as each process did before
+    shared   every process attaches the published block
+PSS (proportional set size) splits each shared page between the processes mapping it, so the PSS
+of all processes added up is the memory they use together.  The processes import the same modules
+as a server process, whose memory is part of every figure.
+"""
+import os
+import pickle
+import subprocess
+import sys
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import pycovid19refresh
+import pycovid19shared
+
+PROCESSES = (1, 2, 4, 8)
+
+
+def load(mode: str) -> dict:
+    """ The store entries of a process """
+
+    if mode == 'none':
+        return {}
+    if mode == 'private':
+        return pycovid19refresh.rebuild()
+    return pycovid19shared.attach()[1]
+
+
+def touch(entries: dict) -> int:
+    """ Reads every array, as the sessions of a process eventually do """
+
+    total = 0
+
+    def read(buffer: pickle.PickleBuffer) -> None:
+        nonlocal total
+        total += int(np.frombuffer(buffer.raw(), dtype='uint8').sum())
+
+    # Pickling hands over the buffer of every array, wherever it sits in the entries
+    pickle.dumps(entries, protocol=5, buffer_callback=read)
+    return total
+
+
+def memory(pid: int) -> dict:
+    """ RSS, PSS and private (USS) memory of a process in MB """
+
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                values[name] = int(value.split()[0]) / 1024
+    return {'rss': values['Rss'], 'pss': values['Pss'],
+            'uss': values['Private_Clean'] + values['Private_Dirty']
+           }
+
+
+def run(mode: str, count: int) -> list:
+    children = [subprocess.Popen([sys.executable, __file__, mode], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL, text=True)
+                for _ in range(count)
+               ]
+    try:
+        # Every process says when it holds the data, then waits for its stdin to close
+        for child in children:
+            child.stdout.readline()
+        return [memory(child.pid) for child in children]
+    finally:
+        for child in children:
+            child.stdin.close()
+            child.wait()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        touch(load(sys.argv[1]))
+        print('ready', flush=True)
+        sys.stdin.read()
+        sys.exit(0)
+
+    pycovid19refresh.refresh()
+    print(f'Block of {os.path.getsize(pycovid19shared._path(pycovid19shared.current())) / 2**20:.1f} MB')
+    print(f'{"mode":8s} {"processes":>9s} {"total PSS MB":>12s} {"RSS MB":>7s} {"USS MB":>7s}  (per process)')
+    for mode in ('none', 'private', 'shared'):
+        for count in PROCESSES:
+            memories = run(mode, count)
+            print(f'{mode:8s} {count:9d} {sum(m["pss"] for m in memories):12.0f} '
+                  f'{np.mean([m["rss"] for m in memories]):7.0f} {np.mean([m["uss"] for m in memories]):7.0f}')
@@ -0,0 +1,173 @@
+"""Wall time, peak memory and payload of every view, on synthetic data at a chosen scale, offline
+
+Usage:
+    python bench_views.py [--counties N] [--days N] [--repeat N] [--data DIRECTORY]
+
+Writes synthetic JHU files of the given scale (see synthetic.py, e.g. --counties 3000 --days 1000
+up to --counties 30000 --days 5000), or uses those already in --data, and points the apps at them
+through file:// URLs with a temporary cache, so nothing is downloaded.  Then:
+    refresh  times the cold refresh that ingests the files and builds everything derived from them,
+             then measures rebuild, the part building the datasets, cubes and geometry in memory
+    views    calls every view of the apps and of the parameterized viewers with one state/country
+             and with ten of them, up to yesterday, the last day of the data
+For each, prints:
+    first    wall time of the first call
+    median   median wall time of the following --repeat calls, which find the data already loaded
+             and, for the viewers, the pipeline stages already computed and the output already
+             rendered (see pycovid19render)
+    peak     peak memory allocated during a first call, traced by tracemalloc in a call of its own
+    payload  size of the document the browser receives for the result (Bokeh JSON), or the memory
+             of the dataframe for dfByState, which feeds the chart rather than being shown
+"""
+from datetime import date, timedelta
+from typing import Any, Callable, List, Optional
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir))
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'parameterized_classes'))
+import synthetic
+
+
+def call(view: Callable[[], Any]) -> Any:
+    """ The result of a view, the async ones awaited """
+
+    result = view()
+    return asyncio.run(result) if inspect.isawaitable(result) else result
+
+
+def payload(result: Any) -> Optional[int]:
+    """ Bytes of the document the browser receives for a view's result, of the data for a dataframe """
+
+    import pandas as pd
+    import panel as pn
+    from bokeh.document import Document
+
+    if result is None:
+        return None
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(index=True, deep=True).sum())
+    doc = Document()
+    doc.add_root(pn.panel(result).get_root(doc))
+    return len(json.dumps(doc.to_json(), default=str))
+
+
+def measure(name: str, make_view: Callable[[], Callable[[], Any]], repeat: int, shown: bool = True) -> None:
+    """ Prints the timings, peak memory and payload of a view, make_view returning a new one, whose
+        first call computes whatever is cached per view, e.g. the stages of a viewer's pipeline
+    """
+
+    view = make_view()
+    start = time.perf_counter()
+    result = call(view)
+    first = time.perf_counter() - start
+
+    timings: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call(view)
+        timings.append(time.perf_counter() - start)
+
+    # Traced apart, as tracing slows the call down
+    view = make_view()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    call(view)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    size = payload(result) if shown else None
+    print(f'{name:66s} {first * 1000:9.0f} ' + (f'{statistics.median(timings) * 1000:9.0f} ' if timings else f'{"-":>9s} ')
+          + f'{peak / 2**20:8.1f} ' + (f'{size / 1024:10.0f}' if size is not None else f'{"-":>10s}'), flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time every view on synthetic data, offline')
+    parser.add_argument('--counties', type=int, default=3000, help='US counties (default 3000)')
+    parser.add_argument('--days', type=int, default=1000, help='days (default 1000)')
+    parser.add_argument('--repeat', type=int, default=5, help='calls timed after the first one (default 5)')
+    parser.add_argument('--data', help='directory of synthetic files to use instead of writing new ones')
+    arguments = parser.parse_args()
+    warnings.filterwarnings('ignore')
+
+    workspace = tempfile.TemporaryDirectory()
+    data: str = arguments.data or os.path.join(workspace.name, 'data')
+    if not arguments.data:
+        start = time.perf_counter()
+        synthetic.write_dataset(data, arguments.counties, arguments.days)
+        print(f'Wrote {arguments.counties:,} counties x {arguments.days:,} days in {time.perf_counter() - start:.1f} s')
+
+    # Read before the apps' modules are imported.  Every entry must stay in the store, whatever its size
+    os.environ.update({'COVID19_JHU_BASE_URL': 'file://' + os.path.abspath(data) + '/',
+                       'COVID19_GEOJSON_URL': 'file://' + os.path.abspath(os.path.join(data, 'geojson-counties-fips.json')),
+                       'COVID19_CACHE_DIR': os.path.join(workspace.name, 'cache'),
+                       'COVID19_STORE_MAX_MB': str(2**20)
+                      })
+    import pycovid19refresh
+    import pycovid19global
+    import pycovid19ingest
+    import pycovid19globalAltair
+    import pycovid19us
+    import pycovid19usAltair
+    import altair_covid19_viewer
+    import pycovid19render
+    logging.getLogger('param').setLevel(logging.ERROR)
+
+    start = time.perf_counter()
+    pycovid19refresh.refresh()
+    print(f'Cold refresh, ingest and publication of the shared block included, in {time.perf_counter() - start:.1f} s')
+    print(f'{"":66s} {"first ms":>9s} {"median ms":>9s} {"peak MB":>8s} {"payload KB":>10s}')
+    measure('pycovid19refresh.rebuild', lambda: pycovid19refresh.rebuild, 1, shown=False)
+
+    end: date = date.today() - timedelta(days=1)
+    states: List[str] = synthetic.STATES[:10]
+    countries: List[str] = pycovid19ingest.read_entities('Global')[:10]
+    for selection in (['Ohio'], states):
+        label = f'{len(selection)} state(s)'
+
+        def viewer(method: str) -> Callable[[], Any]:
+            # A new viewer renders its first output rather than find it rendered by the previous one
+            pycovid19render.renders.invalidate()
+            # The viewers offer the states and countries of the data once built
+            viewer = altair_covid19_viewer.Covid19ViewerUS(covid19_date=end)
+            viewer.state_province = selection
+            return getattr(viewer, method)
+
+        for method in ('dfByState', 'plotAltairLineChart', 'hvtableByState', 'hvtableByCounties', 'plotlyChoropleth'):
+            measure(f'Covid19ViewerUS.{method}, {label}', lambda: viewer(method), arguments.repeat)
+        measure(f'pycovid19us.covid19TimeSeriesByState, {label}',
+                lambda: lambda: pycovid19us.covid19TimeSeriesByState(end, selection, 'Confirmed Cases', False),
+                arguments.repeat)
+        measure(f'pycovid19usAltair.covid19TimeSeriesByState, {label}',
+                lambda: lambda: pycovid19usAltair.covid19TimeSeriesByState(end, selection, 'Confirmed Cases', 'linear'),
+                arguments.repeat)
+    for selection in (['US'], countries):
+        label = f'{len(selection)} country(ies)'
+
+        def viewer(method: str) -> Callable[[], Any]:
+            pycovid19render.renders.invalidate()
+            viewer = altair_covid19_viewer.Covid19ViewerGlobal(covid19_date=end)
+            viewer.country = selection
+            return getattr(viewer, method)
+
+        for method in ('plotAltairLineChart', 'hvtableByDate'):
+            measure(f'Covid19ViewerGlobal.{method}, {label}', lambda: viewer(method), arguments.repeat)
+        measure(f'pycovid19global.covid19TimeSeriesByCountry, {label}',
+                lambda: lambda: pycovid19global.covid19TimeSeriesByCountry(end, 'Confirmed Cases', selection, False),
+                arguments.repeat)
+        measure(f'pycovid19globalAltair.covid19TimeSeriesByCountry, {label}',
+                lambda: lambda: pycovid19globalAltair.covid19TimeSeriesByCountry(end, 'Confirmed Cases', selection,
+                                                                                 'linear'),
+                arguments.repeat)
+    workspace.cleanup()
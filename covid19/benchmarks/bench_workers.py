@@ -0,0 +1,79 @@
+"""Throughput of the apps served by 1, 2, 4 and 8 worker processes, see launcher.py
+
+Usage:
+    python bench_workers.py [script] [app]
+
+For each number of workers, starts `launcher.py script` (default main_app.py) and, once it answers,
+runs a fixed load profile against it: CLIENTS clients, each with its own cookies, loading the page of
+app (default US_Only) one after the other for DURATION seconds.  Every page load creates a Bokeh
+session, i.e. builds the app's document.  Reports the pages served per second and the latency
+percentiles of the page loads.
+"""
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+import numpy as np
+import tornado.httpclient
+
+WORKERS = (1, 2, 4, 8)
+CLIENTS = 16
+DURATION = 20
+STARTUP_TIMEOUT = 300
+LAUNCHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'launcher.py')
+
+
+async def wait_ready(url: str) -> None:
+    client = tornado.httpclient.AsyncHTTPClient()
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            response = await client.fetch(url, raise_error=False, request_timeout=30)
+            if response.code == 200:
+                return
+        except OSError:
+            # Not listening yet
+            pass
+        await asyncio.sleep(1)
+    raise TimeoutError(f'{url} did not answer within {STARTUP_TIMEOUT} s')
+
+
+async def client_loop(url: str, until: float, latencies: list) -> None:
+    client = tornado.httpclient.AsyncHTTPClient()
+    cookie = None
+    while time.monotonic() < until:
+        start = time.perf_counter()
+        response = await client.fetch(url, headers={'Cookie': cookie} if cookie else None,
+                                      raise_error=False, request_timeout=120)
+        if response.code == 200:
+            latencies.append(time.perf_counter() - start)
+            cookie = cookie or response.headers.get('Set-Cookie', '').split(';')[0] or None
+
+
+async def load(url: str) -> list:
+    tornado.httpclient.AsyncHTTPClient.configure(None, max_clients=CLIENTS)
+    await wait_ready(url)
+    latencies = []
+    until = time.monotonic() + DURATION
+    await asyncio.gather(*[client_loop(url, until, latencies) for _ in range(CLIENTS)])
+    return latencies
+
+
+if __name__ == '__main__':
+    script = sys.argv[1] if len(sys.argv) > 1 else 'main_app.py'
+    app = sys.argv[2] if len(sys.argv) > 2 else 'US_Only'
+    print(f'{os.cpu_count()} CPUs, {CLIENTS} clients for {DURATION} s each run')
+    print(f'{"workers":>7s} {"pages/s":>8s} {"p50 ms":>8s} {"p95 ms":>8s}')
+    for i, workers in enumerate(WORKERS):
+        port = 8900 + 10 * i
+        launcher = subprocess.Popen([sys.executable, LAUNCHER, script, '--workers', str(workers), '--port', str(port)],
+                                    cwd=os.path.dirname(LAUNCHER), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            latencies = asyncio.run(load(f'http://localhost:{port}/{app}'))
+        finally:
+            launcher.send_signal(signal.SIGTERM)
+            launcher.wait()
+        print(f'{workers:7d} {len(latencies) / DURATION:8.1f} {np.percentile(latencies, 50) * 1000:8.0f} '
+              f'{np.percentile(latencies, 95) * 1000:8.0f}')
@@ -0,0 +1,163 @@
+"""Synthetic data in the exact schemas of the JHU time series and of Plotly's county GeoJSON
+
+Usage:
+    python synthetic.py DIRECTORY [--counties N] [--days N] [--countries N] [--seed N]
+
+Writes the four JHU CSVs (time_series_covid19_{confirmed,deaths}_{US,global}.csv) and
+geojson-counties-fips.json to DIRECTORY, e.g. to be served by `python -m http.server` as a stand-in
+for GitHub, or read through file:// URLs (see bench_views.py):
+    US      the JHU columns (UID, iso2, iso3, code3, FIPS, Admin2, Province_State, Country_Region,
+            Lat, Long_, Combined_Key, plus Population for the deaths) and one column per day in
+            JHU's m/d/yy format.  The counties are spread over the 50 states, DC and Puerto Rico;
+            every state also has an "Unassigned" row without a location, as in the JHU files, and
+            the two cruise ships have a row each
+    global  Province/State, Country/Region, Lat, Long and the days, a few countries split into
+            provinces as in the JHU files
+    GeoJSON one square per county, identified by its FIPS code, its edges made of several points
+            so that the geometry simplification has work to do
+The counts are cumulative sums of Poisson draws, the last day is yesterday.  The rows are written
+in chunks, so that the largest scales (e.g. 30,000 counties x 5,000 days) do not have to fit in
+memory at once.
+"""
+from datetime import date, timedelta
+from typing import List
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+STATES: List[str] = ['Alabama', 'Alaska', 'Arizona', 'Arkansas', 'California', 'Colorado', 'Connecticut', 'Delaware',
+                     'District of Columbia', 'Florida', 'Georgia', 'Hawaii', 'Idaho', 'Illinois', 'Indiana', 'Iowa',
+                     'Kansas', 'Kentucky', 'Louisiana', 'Maine', 'Maryland', 'Massachusetts', 'Michigan', 'Minnesota',
+                     'Mississippi', 'Missouri', 'Montana', 'Nebraska', 'Nevada', 'New Hampshire', 'New Jersey',
+                     'New Mexico', 'New York', 'North Carolina', 'North Dakota', 'Ohio', 'Oklahoma', 'Oregon',
+                     'Pennsylvania', 'Puerto Rico', 'Rhode Island', 'South Carolina', 'South Dakota', 'Tennessee',
+                     'Texas', 'Utah', 'Vermont', 'Virginia', 'Washington', 'West Virginia', 'Wisconsin', 'Wyoming'
+                    ]
+CRUISE_SHIPS: List[str] = ['Diamond Princess', 'Grand Princess']
+# Countries whose counts JHU report by province
+PROVINCES = {'Australia': 8, 'Canada': 13, 'China': 33, 'United Kingdom': 12}
+# Rows of counts generated and written at once
+CHUNK = 2000
+# Points per edge of a county square
+EDGE_POINTS = 8
+
+
+def date_headers(days: int) -> List[str]:
+    """Function that returns the JHU headers of the days ending yesterday, e.g. 1/22/20"""
+
+    dates = pd.date_range(end=date.today() - timedelta(days=1), periods=days)
+    return [f'{d.month}/{d.day}/{d.year % 100}' for d in dates]
+
+
+def us_rows(counties: int) -> pd.DataFrame:
+    """Function that returns the metadata columns of the US rows, counties spread over the states"""
+
+    per_state: int = -(-counties // len(STATES))
+    if per_state > 998:
+        raise ValueError(f'{counties} counties do not fit in 3 digit county FIPS codes over {len(STATES)} states')
+
+    rows = []
+    for i in range(counties):
+        state, county = divmod(i, per_state)
+        fips: int = (state + 1) * 1000 + county + 1
+        rows.append((84000000 + fips, 'US', 'USA', 840, float(fips), f'County {county + 1}', STATES[state],
+                     30 + state * 0.4 + county * 0.001, -120 + county * 0.01))
+    for state, name in enumerate(STATES):
+        # JHU's counts not yet assigned to a county, without a location
+        rows.append((84090000 + state + 1, 'US', 'USA', 840, float(90000 + state + 1), 'Unassigned', name, 0.0, 0.0))
+    for ship, name in enumerate(CRUISE_SHIPS):
+        rows.append((84088888 + ship, 'US', 'USA', 840, np.nan, '', name, 0.0, 0.0))
+
+    df = pd.DataFrame(rows, columns=['UID', 'iso2', 'iso3', 'code3', 'FIPS', 'Admin2', 'Province_State',
+                                     'Lat', 'Long_'])
+    df.insert(7, 'Country_Region', 'US')
+    df['Combined_Key'] = (df['Admin2'] + ', ').where(df['Admin2'] != '', '') + df['Province_State'] + ', US'
+    return df
+
+
+def global_rows(countries: int) -> pd.DataFrame:
+    """Function that returns the metadata columns of the global rows, US included"""
+
+    names: List[str] = ['US'] + list(PROVINCES) + [f'Country {i + 1}' for i in range(max(0, countries - 1 - len(PROVINCES)))]
+    rows = []
+    for i, name in enumerate(names):
+        for province in ([f'Province {j + 1}' for j in range(PROVINCES[name])] if name in PROVINCES else ['']):
+            rows.append((province, name, -40 + i % 80, -170 + i % 340))
+    return pd.DataFrame(rows, columns=['Province/State', 'Country/Region', 'Lat', 'Long'])
+
+
+def write_counts(path: str, meta: pd.DataFrame, headers: List[str], scale: float, rng: np.random.Generator) -> None:
+    """Function that writes the metadata rows followed by their cumulative daily counts, in chunks"""
+
+    with open(path, 'w', newline='') as f:
+        for start in range(0, len(meta), CHUNK):
+            rows: pd.DataFrame = meta.iloc[start:start + CHUNK].reset_index(drop=True)
+            # Each row grows at its own pace
+            rates: np.ndarray = rng.gamma(1.0, scale, size=(len(rows), 1))
+            counts: np.ndarray = np.cumsum(rng.poisson(rates, size=(len(rows), len(headers))), axis=1, dtype='int64')
+            pd.concat([rows, pd.DataFrame(counts, columns=headers)], axis=1).to_csv(f, header=start == 0, index=False)
+
+
+def write_geojson(path: str, meta: pd.DataFrame) -> None:
+    """Function that writes a square of every county with a location, identified by its 5 digit FIPS code"""
+
+    steps: np.ndarray = np.linspace(0, 1, EDGE_POINTS, endpoint=False)
+    with open(path, 'w') as f:
+        f.write('{"type": "FeatureCollection", "features": [')
+        counties: pd.DataFrame = meta[meta['Lat'] != 0]
+        for i, (fips, lat, lon) in enumerate(zip(counties['FIPS'].astype(int), counties['Lat'], counties['Long_'])):
+            x0, y0, size = round(lon, 3), round(lat, 3), 0.01
+            corners = [(x0, y0), (x0 + size, y0), (x0 + size, y0 + size), (x0, y0 + size), (x0, y0)]
+            ring = [[round(a[0] + (b[0] - a[0]) * s, 5), round(a[1] + (b[1] - a[1]) * s, 5)]
+                    for a, b in zip(corners[:-1], corners[1:]) for s in steps
+                   ]
+            feature = {'type': 'Feature', 'id': f'{fips:05d}', 'properties': {'STATE': f'{fips // 1000:02d}'},
+                       'geometry': {'type': 'Polygon', 'coordinates': [ring + [ring[0]]]}
+                      }
+            f.write((', ' if i else '') + json.dumps(feature))
+        f.write(']}')
+
+
+def write_dataset(directory: str, counties: int = 3000, days: int = 1000, countries: int = 190, seed: int = 0) -> None:
+    """Function that writes the synthetic JHU CSVs and county GeoJSON, see the module docstring
+    Parameters
+    ----------
+    directory : str
+        Where to write the files, created if need be
+    counties : int
+        Number of US counties, spread over the states (default=3000)
+    days : int
+        Number of daily columns (default=1000)
+    countries : int
+        Number of countries of the global files, a few of them split into provinces (default=190)
+    seed : int
+        Seed of the random counts (default=0)
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    headers: List[str] = date_headers(days)
+
+    us: pd.DataFrame = us_rows(counties)
+    write_counts(os.path.join(directory, 'time_series_covid19_confirmed_US.csv'), us, headers, 20, rng)
+    deaths: pd.DataFrame = us.assign(Population=rng.integers(1_000, 1_000_000, len(us)))
+    write_counts(os.path.join(directory, 'time_series_covid19_deaths_US.csv'), deaths, headers, 0.3, rng)
+
+    countries_: pd.DataFrame = global_rows(countries)
+    write_counts(os.path.join(directory, 'time_series_covid19_confirmed_global.csv'), countries_, headers, 2000, rng)
+    write_counts(os.path.join(directory, 'time_series_covid19_deaths_global.csv'), countries_, headers, 30, rng)
+
+    write_geojson(os.path.join(directory, 'geojson-counties-fips.json'), us)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic JHU time series and county GeoJSON')
+    parser.add_argument('directory', help='where to write the files')
+    parser.add_argument('--counties', type=int, default=3000, help='US counties (default 3000)')
+    parser.add_argument('--days', type=int, default=1000, help='days (default 1000)')
+    parser.add_argument('--countries', type=int, default=190, help='countries of the global files (default 190)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random counts (default 0)')
+    arguments = parser.parse_args()
+    write_dataset(arguments.directory, arguments.counties, arguments.days, arguments.countries, arguments.seed)
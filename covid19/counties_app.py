@@ -0,0 +1,17 @@
+import pycovid19counties
+import pycovid19metrics
+import pycovid19profile
+import pycovid19refresh
+import panel as pn
+
+# Every session gets its own zoom/pan and pointer streams, so the explorer is served as a factory
+apps = {'US_Counties': pycovid19counties.counties_app}
+
+# Served by `python counties_app.py`, or by several worker processes with `python launcher.py counties_app.py`
+if __name__ == '__main__':
+    # Keep the data up to date in the background, sessions never wait on a download
+    pycovid19refresh.start()
+
+    # The process' metrics are served at /metrics and, in profiling mode, its slowest profiles at /admin/profiles
+    pn.serve(apps, port=8891, websocket_origin='localhost:8891', show=False,
+             extra_patterns=pycovid19metrics.routes() + pycovid19profile.routes())
@@ -0,0 +1,260 @@
+"""Serves the apps of an entry script from several worker processes
+
+Usage:
+    python launcher.py [script] [--workers N] [--port PORT] [--host HOST] [--profile]
+
+e.g. `python launcher.py altair_app.py --workers 4`.  Served by a single process, one slow pandas
+callback stalls every session.  The launcher instead:
+    1. refreshes the data and builds everything derived from it (see pycovid19refresh), then loads
+       the apps of the script (its `apps` dictionary) without serving them
+    2. forks the workers, which inherit all of that: no worker downloads, ingests or aggregates
+       anything before serving its first session
+    3. serves every worker on its own local port, PORT + 1 + i, and balances the sessions over them
+       from PORT, proxying both HTTP and websockets
+
+A Bokeh session only exists in the worker that created it, so the page and its websocket must reach
+the same worker.  A client is assigned the worker with the fewest open websockets on its first
+request and keeps it through a cookie, which browsers send with the websocket handshake too.
+With --workers 1 the apps are served directly from PORT, as by the script itself.
+
+The launcher's own process runs the one refresh scheduler: it alone revalidates the upstream files and
+builds and publishes a new version of the data (see pycovid19refresh).  The workers only follow it,
+checking the version counter of the shared directory every few seconds and attaching a new version,
+so every worker serves the same read-only memory (see pycovid19shared) and refreshes its sessions.
+Each worker also serves its own metrics (see pycovid19metrics): scrape them at http://127.0.0.1:PORT+1+i/metrics,
+the balancer would answer those of whichever worker a scrape is sent to.  Likewise, with --profile every
+worker profiles its sessions' interactions and serves its slowest at /admin/profiles (see pycovid19profile).
+
+Settings (environment variables):
+    COVID19_WORKERS  default number of worker processes (default 1)
+"""
+from typing import TypeVar, Dict, List, Optional
+import argparse
+import logging
+import os
+import runpy
+import signal
+import sys
+import panel as pn
+import tornado.httpclient
+import tornado.ioloop
+import tornado.web
+import tornado.websocket
+from tornado.httputil import HTTPHeaders
+import pycovid19endpoint
+import pycovid19metrics
+import pycovid19profile
+import pycovid19refresh
+# These are related to optional type annotations
+Panel = TypeVar('pn.layout.Column')
+
+logger = logging.getLogger(__name__)
+
+WORKERS: int = int(os.environ.get('COVID19_WORKERS', 1))
+# Cookie naming the worker a client's sessions live in
+COOKIE = 'covid19_worker'
+# Bokeh documents can be large, as for Bokeh's own server
+MAX_MESSAGE_SIZE = 20 * 2**20
+# Headers of a single connection, never forwarded.  Content-Length is set again by the proxy
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailer',
+              'transfer-encoding', 'upgrade', 'content-length'}
+
+
+class Balancer:
+    """ Assigns clients to workers and counts the websockets open to every worker """
+
+    def __init__(self, ports: List[int]):
+        self.ports = ports
+        self.websockets: List[int] = [0] * len(ports)
+        self.assigned: List[int] = [0] * len(ports)
+
+    def worker(self, handler: tornado.web.RequestHandler, remember: bool = True) -> int:
+        """Function that returns the worker of the client of a request, assigning one if it has none,
+        and, if remember is set, sets the cookie of the worker assigned on the response"""
+
+        cookie: Optional[str] = handler.get_cookie(COOKIE)
+        if cookie is not None and cookie.isdigit() and int(cookie) < len(self.ports):
+            return int(cookie)
+        worker: int = min(range(len(self.ports)), key=lambda i: (self.websockets[i], self.assigned[i]))
+        self.assigned[worker] += 1
+        if remember:
+            handler.set_cookie(COOKIE, str(worker), httponly=True)
+        return worker
+
+
+class ProxyHandler(tornado.web.RequestHandler):
+    """ Forwards a request to the client's worker """
+
+    SUPPORTED_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+    async def forward(self) -> None:
+        balancer: Balancer = self.settings['balancer']
+        port: int = balancer.ports[balancer.worker(self)]
+        headers = HTTPHeaders({name: value for name, value in self.request.headers.get_all()
+                               if name.lower() not in HOP_BY_HOP
+                              })
+        headers['X-Forwarded-For'] = self.request.remote_ip
+        response = await tornado.httpclient.AsyncHTTPClient().fetch(
+                    f'http://127.0.0.1:{port}{self.request.uri}', method=self.request.method, headers=headers,
+                    body=self.request.body if self.request.method in ('POST', 'PUT', 'PATCH') else None,
+                    follow_redirects=False, decompress_response=False, raise_error=False, request_timeout=300
+                   )
+        if response.code == 599:
+            logger.error('Worker on port %d did not answer: %s', port, response.error)
+            raise tornado.web.HTTPError(502)
+
+        self.set_status(response.code, response.reason)
+        # Tornado's default headers, e.g. Content-Type or Date, are replaced by the worker's
+        for name in set(response.headers):
+            self.clear_header(name)
+        for name, value in response.headers.get_all():
+            if name.lower() not in HOP_BY_HOP:
+                self.add_header(name, value)
+        if response.body and self.request.method != 'HEAD':
+            self.write(response.body)
+
+    get = head = post = put = patch = delete = options = forward
+
+
+class WebSocketProxyHandler(tornado.websocket.WebSocketHandler):
+    """ Relays the messages of a websocket between the client and its worker """
+
+    upstream: Optional[tornado.websocket.WebSocketClientConnection] = None
+    subprotocols: List[str] = []
+
+    def check_origin(self, origin: str) -> bool:
+        # The worker checks the origin, which is forwarded to it
+        return True
+
+    def select_subprotocol(self, subprotocols: List[str]) -> Optional[str]:
+        # Bokeh passes its session token as the second subprotocol
+        self.subprotocols = subprotocols
+        return subprotocols[0] if subprotocols else None
+
+    async def open(self, *args) -> None:
+        balancer: Balancer = self.settings['balancer']
+        # Without a cookie, e.g. from a script rather than a browser, the websocket is its own session
+        self.worker: int = balancer.worker(self, remember=False)
+        headers = {name: value for name, value in self.request.headers.get_all()
+                   if name.lower() in ('host', 'origin', 'cookie', 'user-agent')
+                  }
+        request = tornado.httpclient.HTTPRequest(f'ws://127.0.0.1:{balancer.ports[self.worker]}{self.request.uri}',
+                                                 headers=headers)
+        try:
+            self.upstream = await tornado.websocket.websocket_connect(request, on_message_callback=self.relay,
+                                                                      subprotocols=self.subprotocols or None,
+                                                                      max_message_size=MAX_MESSAGE_SIZE)
+        except Exception:
+            logger.exception('Could not open a websocket to worker %d', self.worker)
+            self.close(1011)
+            return
+        balancer.websockets[self.worker] += 1
+
+    def relay(self, message) -> None:
+        if message is None:
+            # The worker closed the websocket
+            self.close()
+        elif self.ws_connection is not None:
+            self.write_message(message, binary=isinstance(message, bytes))
+
+    def on_message(self, message) -> None:
+        if self.upstream is not None:
+            self.upstream.write_message(message, binary=isinstance(message, bytes))
+
+    def on_close(self) -> None:
+        if self.upstream is not None:
+            self.upstream.close()
+            self.upstream = None
+            self.settings['balancer'].websockets[self.worker] -= 1
+
+
+def load_apps(script: str) -> Dict[str, Panel]:
+    """Function that returns the apps of an entry script, e.g. main_app.py, without serving them"""
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    return runpy.run_path(script, run_name='__covid19_worker__')['apps']
+
+
+def serve_worker(apps: Dict[str, Panel], port: int, origins: List[str], address: Optional[str] = None,
+                 follower: bool = False) -> None:
+    """Function that serves apps from the current process until it is stopped, refreshing the data
+    itself unless follower is set, in which case it attaches the versions another process publishes"""
+
+    # Keep the data up to date in the background, sessions never wait on a download
+    pycovid19refresh.start(follower=follower)
+    # The charts' data is served next to the apps, at content-hashed URLs the browser caches, the
+    # worker's metrics at /metrics and, in profiling mode, its slowest profiles at /admin/profiles
+    pn.serve(apps, port=port, address=address, websocket_origin=origins, show=False,
+             extra_patterns=pycovid19endpoint.routes() + pycovid19metrics.routes() + pycovid19profile.routes())
+
+
+def launch(script: str, workers: int = WORKERS, port: int = 8890, host: str = 'localhost') -> None:
+    """Function that serves the apps of an entry script from workers processes, see the module docstring
+    Parameters
+    ----------
+    script : str
+        Path of an entry script defining an `apps` dictionary, e.g. main_app.py
+    workers : int
+        Number of worker processes (default=WORKERS)
+    port : int
+        Port the apps are served from, the workers listen on the following ones (default=8890)
+    host : str
+        Host name the browsers use to reach the apps (default='localhost')
+    """
+
+    if workers < 1:
+        raise ValueError(f'At least one worker is needed, not {workers}')
+
+    # Loaded once here, before forking, so that every worker starts with the data
+    pycovid19refresh.refresh()
+    apps: Dict[str, Panel] = load_apps(script)
+    origins: List[str] = [f'{host}:{port}', f'localhost:{port}']
+    if workers == 1:
+        serve_worker(apps, port, origins)
+        return
+
+    ports: List[int] = [port + 1 + i for i in range(workers)]
+    pids: List[int] = []
+    for worker_port in ports:
+        pid: int = os.fork()
+        if pid == 0:
+            try:
+                serve_worker(apps, worker_port, origins, address='127.0.0.1', follower=True)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    logger.info('Started %d workers on ports %s', workers, ports)
+    # Started once the workers are forked, which only inherit the thread that forks them
+    pycovid19refresh.start()
+
+    def stop(signum, frame) -> None:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    balancer = Balancer(ports)
+    application = tornado.web.Application([(r'.*/ws', WebSocketProxyHandler), (r'.*', ProxyHandler)],
+                                          balancer=balancer, websocket_max_message_size=MAX_MESSAGE_SIZE)
+    application.listen(port, max_body_size=MAX_MESSAGE_SIZE)
+    print(f'Balancing {workers} workers at http://{host}:{port}', flush=True)
+    tornado.ioloop.IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Serve the apps of an entry script from several worker processes')
+    parser.add_argument('script', nargs='?', default='main_app.py', help='entry script defining apps (default main_app.py)')
+    parser.add_argument('--workers', type=int, default=WORKERS, help=f'worker processes (default {WORKERS})')
+    parser.add_argument('--port', type=int, default=8890, help='port the apps are served from (default 8890)')
+    parser.add_argument('--host', default='localhost', help='host name the browsers use (default localhost)')
+    parser.add_argument('--profile', action='store_true', help='profile every interaction, see pycovid19profile')
+    arguments = parser.parse_args()
+    if arguments.profile:
+        pycovid19profile.enable()
+    launch(arguments.script, arguments.workers, arguments.port, arguments.host)
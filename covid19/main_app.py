@@ -1,5 +1,9 @@
 import pycovid19global
+import pycovid19metrics
+import pycovid19profile
+import pycovid19refresh
 import pycovid19us
+import pycovid19usStream
 import panel as pn
 
 global_app = pycovid19global.global_app
@@ -8,4 +12,14 @@ us_app = pycovid19us.us_app
 # myapp.show(host='localhost', port=8889, websocket_origin='localhost:8889', open=False)
 # us_app.show(host='localhost', port=8889, websocket_origin='localhost:8889', open=False)
 
-pn.serve({'By_Country': global_app, 'US_Only': us_app}, port=8890, websocket_origin='localhost:8890', show=False)
\ No newline at end of file
+# Every dashboard is a factory called for every session, so that sessions do not share widgets
+apps = {'By_Country': global_app, 'US_Only': us_app, 'US_Streaming': pycovid19usStream.us_stream_app}
+
+# Served by `python main_app.py`, or by several worker processes with `python launcher.py main_app.py`
+if __name__ == '__main__':
+    # Keep the data up to date in the background, sessions never wait on a download
+    pycovid19refresh.start()
+
+    # The process' metrics are served at /metrics and, in profiling mode, its slowest profiles at /admin/profiles
+    pn.serve(apps, port=8890, websocket_origin='localhost:8890', show=False,
+             extra_patterns=pycovid19metrics.routes() + pycovid19profile.routes())
\ No newline at end of file
@@ -1,19 +1,36 @@
 from altair_covid19_viewer import Covid19ViewerUS
 import panel as pn
+import pycovid19async
+import pycovid19endpoint
+import pycovid19metrics
+import pycovid19profile
+import pycovid19refresh
 
 #us_app.show(host='localhost', port=8889, websocket_origin='localhost:8889', open=False)
 
 #pn.serve({'By_Country': global_app, 'US_Only': us_app}, port=8890, websocket_origin='localhost:8890', show=False)
 
-app = Covid19ViewerUS(name='COVID-19 US Only')
 
-panel_app = pn.Row(pn.Column(pn.Param(app.param.state_province, height=100, widgets={'state_province': pn.widgets.MultiChoice}),
-                             pn.Param(app.param.covid19_date, widgets={'covid19_date': pn.widgets.DatePicker}),
-                             pn.Param(app.param.confirmed_deaths),
-                             pn.Param(app.param.ylog)
-                            ),
-                            app.plotAltairLineChart,
-                            height=500
-                  )
+def panel_app():
+    """Function that returns the dashboard of a new session, with a viewer of its own, so that the
+    session's selection is its own and refreshes are shown on its document's thread"""
 
-panel_app.show(host='localhost', port=8889, websocket_origin='localhost:8889', open=False)
\ No newline at end of file
+    app = Covid19ViewerUS(name='COVID-19 US Only')
+    return pn.Row(pn.Column(pn.Param(app.param.state_province, height=100, widgets={'state_province': pn.widgets.MultiChoice}),
+                            pn.Param(app.param.covid19_date, widgets={'covid19_date': pn.widgets.DatePicker}),
+                            pn.Param(app.param.confirmed_deaths),
+                            pn.Param(app.param.ylog),
+                            pn.Param(app.param.measure)
+                           ),
+                  # Rendered once the page has loaded, not when the session is created
+                  pycovid19async.loading_panel(app.plotAltairLineChart, defer_load=True),
+                  height=500
+                 )
+
+# Keep the data up to date in the background, sessions never wait on a download
+pycovid19refresh.start()
+
+# The chart's data is served next to the app, at content-hashed URLs the browser caches, the process'
+# metrics at /metrics and, in profiling mode, its slowest profiles at /admin/profiles
+pn.serve(panel_app, port=8889, websocket_origin='localhost:8889', show=False,
+         extra_patterns=pycovid19endpoint.routes() + pycovid19metrics.routes() + pycovid19profile.routes())
\ No newline at end of file
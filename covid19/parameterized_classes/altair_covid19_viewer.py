@@ -1,29 +1,35 @@
 from datetime import date
-from datetime import datetime
 from datetime import timedelta
-from urllib.request import urlopen
 import altair as alt
-import hvplot.pandas
-import json
-import numpy as np
-import panel as pn
+import hvplot.pandas  # noqa: F401, adds the .hvplot accessor used below
+import os
 import param
-import pandas as pd
 import plotly.express as px
+import sys
+# The data layer modules are shared with the apps one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import pycovid19async
+import pycovid19cube
+import pycovid19endpoint
+import pycovid19geo
+import pycovid19ingest
+import pycovid19metrics
+import pycovid19pipeline
+import pycovid19refresh
+import pycovid19render
+import pycovid19store
+
+# A few states/countries of daily counts exceed Altair's default limit of 5,000 rows.  The layered charts
+# reference their data once and Panel sends it to the browser as a column data source
+alt.data_transformers.disable_max_rows()
 
 class Covid19ViewerUS(param.Parameterized):
     """ A Panel parameterized class for creating COVID-19 dashboard for US states only """
 
-    # Read source data so that we can create valid values for our selection widget, instead of creating
-    # hard-coded values, sacrificing a little bit of performance for less maintainenance
-    url = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/' + \
-          'master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv'
-    df = pd.read_csv(url).query("Province_State not in(['Grand Princess', 'Diamond Princess'])")
-    states_provinces = df['Province_State'].unique().tolist()
-
-    # Create widget to select one or more states
+    # Create widget to select one or more states.  Valid values are read from the data instead of being
+    # hard-coded, see offerStates
     state_province = param.ListSelector(default=['Ohio'],
-                      objects=states_provinces, label='State:'
+                      objects=['Ohio'], label='State:'
                      )
     # Create date picker widget.  Usually COVID19 data is a day behind
     covid19_date = param.Date(default=date.today() + 
@@ -38,6 +44,49 @@ class Covid19ViewerUS(param.Parameterized):
                        )
     # Create widget to choose linear or log scaling
     ylog = param.Selector(default='linear', objects=['linear', 'symlog'], label='Scale:')
+    # Create widget to choose the counts or one of the metrics derived from them, see pycovid19cube
+    measure = param.Selector(default='Cumulative', objects=list(pycovid19cube.MEASURES), label='Measure:')
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        # The line chart is computed in cached stages, each only depending on the parameters it uses
+        self.pipeline = pycovid19pipeline.Pipeline(self)
+        self.pipeline.stage('fetch', lambda: self.getData(self.confirmed_deaths), params=['confirmed_deaths'], always=True)
+        self.pipeline.stage('aggregate', self.aggregateByState, params=['confirmed_deaths'], inputs=['fetch'])
+        self.pipeline.stage('reshape', lambda cube: cube.long_index(pycovid19cube.MEASURES[self.measure]),
+                            params=['measure'], inputs=['aggregate'])
+        self.pipeline.stage('filter', self.filterByState, params=['covid19_date', 'state_province'], inputs=['reshape'])
+        self.pipeline.stage('render', self.renderAltairLineChart, params=['confirmed_deaths', 'ylog', 'measure'],
+                            inputs=['filter'])
+        self.offerStates()
+        pycovid19refresh.subscribe(self.onRefresh)
+
+    def offerStates(self):
+        """ Function to fill the state selector from the entity list written next to the data snapshots
+
+            The list is a small file, so creating a viewer loads no data, let alone downloads it.
+            Before the very first ingest only the default state is offered, until a chart is drawn.
+        """
+
+        states_provinces = [state for state in pycovid19ingest.read_entities('US')
+                            if state not in pycovid19cube.CRUISE_SHIPS
+                           ]
+        if states_provinces:
+            self.param.state_province.objects = states_provinces
+
+    def onRefresh(self):
+        """ Function to show a new data version swapped in by the background refresh, see pycovid19refresh """
+
+        self.offerStates()
+        start, end = pycovid19refresh.date_bounds('US')
+        # Viewers looking at the latest data move on to the new latest date
+        value = end if self.covid19_date >= self.param.covid19_date.bounds[1] else self.covid19_date
+        self.param.covid19_date.bounds = (start, end)
+        if value != self.covid19_date:
+            self.covid19_date = value
+        else:
+            # Re-render with the new data even though no parameter changed
+            self.param.trigger('covid19_date')
     
     # @param.depends('confirmed_deaths')
     def getData(self, confirmed_deaths):
@@ -52,27 +101,27 @@ class Covid19ViewerUS(param.Parameterized):
                 Pandas dataframe
         """
 
-        if confirmed_deaths == 'Confirmed Cases':
-            url = 'https://raw.githubusercontent.com/CSSEGISandData/' + \
-                  'COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/'+ \
-                  'time_series_covid19_confirmed_US.csv'
-        else:
-            url = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/' + \
-                  'master/csse_covid_19_data/csse_covid_19_time_series/' + \
-                  'time_series_covid19_deaths_US.csv'
-
-        # If making visualizations at county level,
-        # then the FIPS data needs to be fixed - it needs to have leading zeros
-        df = pd.read_csv(url, 
-              converters={'FIPS': lambda x: int(float(x)) if x != '' else x}
-             ).query("FIPS != ''")
-        df['FIPS'] = df['FIPS'].astype('str').str.zfill(5)
-        if 'Population' in df.columns:
-            df.drop(columns='Population', inplace=True)
-        
-        return df
+        # Shared by every session and with FIPS already fixed to have leading zeros
+        # for county level visualizations, see pycovid19store
+        return pycovid19store.get_dataset('US', confirmed_deaths)
+
+    def aggregateByState(self, df):
+        """ Function to aggregate the counts of a dataset by US state, see pycovid19cube
+
+            Parameter
+            ---------
+                df : Pandas dataframe as returned by getData
+
+            Returns
+            -------
+                AggregateCube
+        """
+
+        # Built once per data refresh and shared by every session
+        return pycovid19cube.get_cube('US', self.confirmed_deaths, df)
 
     @param.depends('confirmed_deaths') 
+    @pycovid19metrics.timed
     def dfByState(self):
         """ Function to create dataframe consisting of counts 
             by US states that will be plotted using Altair
@@ -83,42 +132,71 @@ class Covid19ViewerUS(param.Parameterized):
                 Pandas dataframe
         """
 
-        df_by_state = (self.getData(self.confirmed_deaths)
-                       .drop(columns=['UID', 'iso2', 'iso3', 'code3', 
-                                      'FIPS', 'Admin2', 'Country_Region', 
-                                      'Lat', 'Long_', 'Combined_Key'
-                                     ]
-                       )
-                       .groupby('Province_State').agg('sum')
-                       .transpose()
-                       .reset_index()
-                       .melt(id_vars='index', var_name='State_Province', value_name='Qty_Confirmed')
-                       .rename(columns={'index': 'Date'})
-                       .set_index('Date')
-                      )
-        df_by_state.index = [datetime.strptime(date, '%m/%d/%y') for date in df_by_state.index]
-        
-        return df_by_state
-    
-    @param.depends('covid19_date', 'state_province', 'confirmed_deaths', 'ylog')
-    def plotAltairLineChart(self):
+        # Sliced from the aggregate cube built once per data refresh, see pycovid19cube
+        return self.pipeline('aggregate').long_frame(entity_name='State_Province', value_name='Qty_Confirmed')
+
+    def filterByState(self, long_index):
+        """ Function to keep the chosen states up to the chosen date
+
+            Parameter
+            ---------
+                long_index : the chosen measure by state in "long format", grouped by state, see pycovid19cube.LongIndex
+
+            Returns
+            -------
+                Pandas dataframe with Date, State_Province and Qty_Confirmed columns, as Altair
+                charting API only charts dataframe columns
+        """
+
+        # Slices of the chosen states up to the chosen date, rather than a query over every state and date
+        return long_index.select(self.state_province, end=self.covid19_date,
+                                 entity_name='State_Province', value_name='Qty_Confirmed'
+                                )
+
+    @param.depends('covid19_date', 'state_province', 'confirmed_deaths', 'ylog', 'measure')
+    @pycovid19metrics.timed
+    async def plotAltairLineChart(self):
         """ Function to output Altair line chart
 
+            Returns
+            -------
+                Vega-Lite spec of the Altair line chart
+        """
+
+        # The spec is shared by every session showing the same chart, see pycovid19render.  Rendering it,
+        # only the stages depending on the parameter that changed are recomputed, e.g. a new scale
+        # re-renders the chart from the data filtered before.  The data is loaded, filtered and rendered off
+        # the server's event loop, which keeps serving the other sessions meanwhile, see pycovid19async
+        spec = await pycovid19async.run(pycovid19render.vega_spec, 'Covid19ViewerUS.plotAltairLineChart', self,
+                                        ['covid19_date', 'state_province', 'confirmed_deaths', 'ylog', 'measure'],
+                                        lambda: (self.pipeline('filter'), self.pipeline('render')))
+        # The data has been ingested by now, offer every state if only the default one was available
+        if len(self.param.state_province.objects) == 1:
+            self.offerStates()
+        return spec
+
+    def axisTitle(self):
+        """ Function to title the y axis after the chosen measure, e.g. # of Deaths or 7-day average of Deaths """
+
+        return pycovid19cube.measure_title(self.measure, self.confirmed_deaths)
+
+    def renderAltairLineChart(self, data):
+        """ Function to draw the Altair line chart of filtered data
+
+            Parameter
+            ---------
+                data : Pandas dataframe as returned by filterByState
+
             Returns
             -------
                 Altair line chart
         """
-        
-        # Date that will be used to indicate "Data as of user chosen date"
-        iso_date = self.covid19_date.strftime('%Y-%m-%d')
-        # Altair charting API only charts dataframe columns, not index, so need to apply reset_index()
-        alt_chart = alt.Chart(self.dfByState()[:iso_date]
-                     .query("State_Province in(@self.state_province)")
-                     .reset_index()
-                     .rename(columns={'index': 'Date'})
-                    ).mark_line().encode(
+
+        # The layers are created without data, so that they all reference the single
+        # dataset given to the layer chart instead of each embedding a copy of it
+        alt_chart = alt.Chart().mark_line().encode(
                      x=alt.X(title='Date', field='Date', type='temporal'),
-                     y=alt.Y(title='# of ' + self.confirmed_deaths, field='Qty_Confirmed', 
+                     y=alt.Y(title=self.axisTitle(), field='Qty_Confirmed', 
                              type='quantitative', scale=alt.Scale(type=self.ylog)
                             ),
                      color=alt.Color(field='State_Province', type='nominal',
@@ -132,12 +210,8 @@ class Covid19ViewerUS(param.Parameterized):
 
         # To create filled circles in the legend per
         # https://github.com/altair-viz/altair/issues/1206
-        points = alt.Chart(self.dfByState()[:iso_date]
-                  .query("State_Province in(@self.state_province)")
-                  .reset_index()
-                  .rename(columns={'index': 'Date'})
-                 ).mark_circle(size=0).encode(
-                                       color='State_Province'
+        points = alt.Chart().mark_circle(size=0).encode(
+                                       color='State_Province:N'
                                       )
 
         # To add hover tips, but make it less sensitive per
@@ -146,7 +220,8 @@ class Covid19ViewerUS(param.Parameterized):
                     tooltip=alt.TooltipContent("data")
                    )
 
-        alt_chart = alt_chart + points + tooltips
+        # Referenced by URL when served with the data endpoint, see pycovid19endpoint
+        alt_chart = alt.layer(alt_chart, points, tooltips, data=pycovid19endpoint.chart_data(data))
 
         return alt_chart.properties(
                 title='COVID-19 ' + self.confirmed_deaths,
@@ -154,8 +229,9 @@ class Covid19ViewerUS(param.Parameterized):
                 height=400
                )
 
-    @param.depends('state_province', 'confirmed_deaths')
-    def hvtableByState(self):
+    @param.depends('state_province', 'confirmed_deaths', 'measure')
+    @pycovid19metrics.timed
+    async def hvtableByState(self):
         """ Function to output a hvplot table of counts by day.
             If there is more than 1 state chosen, then we will not output the table
 
@@ -165,30 +241,21 @@ class Covid19ViewerUS(param.Parameterized):
         """
 
         if len(self.state_province) == 1:
-            df = self.getData(self.confirmed_deaths)
-            df_by_state = df.iloc[:, np.r_[6, 11:df.shape[1]]] \
-                            .groupby('Province_State').agg('sum').transpose()
-            
-            # A data table of counts by state with difference between rows
-            return ((df_by_state.loc[:, self.state_province]
-                     .sort_values(by=self.state_province, ascending=False)
-                     .rename(columns={'index': 'Date', self.state_province[0]: 'Cum. Qty'})
-                    )
-                    .merge((df_by_state.loc[:, self.state_province]
-                            .sort_values(by=self.state_province, ascending=False)
-                            .rename(columns={'index': 'Date', self.state_province[0]: 'Cum. Qty'})
-                           ).diff(), how='inner', left_index=True, right_index=True
-                    )
-                    .rename(columns={'Cum. Qty_x':'Cum. Qty', 'Cum. Qty_y': 'Difference'})
-                    .reset_index()
-                    .rename(columns={'index': 'Date'})
-                    .hvplot.table(sortable=True, selectable=True, width=300, height=500)
-                   )
+            # A data table of counts by state with difference between days and the chosen measure, all
+            # precomputed in the aggregate cube, shared by every session showing the same state, see
+            # pycovid19render
+            df = await pycovid19async.run(pycovid19render.get, 'Covid19ViewerUS.hvtableByState', self,
+                                          ['state_province', 'confirmed_deaths', 'measure'],
+                                          lambda: pycovid19cube.get_cube('US', self.confirmed_deaths)
+                                                  .table(self.state_province[0],
+                                                         layer=pycovid19cube.MEASURES[self.measure]))
+            return df.hvplot.table(sortable=True, selectable=True, width=300, height=500)
         else:
             return None
 
     @param.depends('state_province', 'confirmed_deaths')
-    def hvtableByCounties(self):
+    @pycovid19metrics.timed
+    async def hvtableByCounties(self):
         """ Function to output a hvplot table by counties.
             If there is more than 1 state chosen, then we will not output the table
 
@@ -198,16 +265,10 @@ class Covid19ViewerUS(param.Parameterized):
         """
 
         if len(self.state_province) == 1:
-            df = self.getData(self.confirmed_deaths)
-            df_by_counties = df.query("not Lat==0").iloc[:, [6, 10, -1]]
-            
-            return (df_by_counties.query("Province_State == @self.state_province")
-                    .sort_values(by=df_by_counties.columns[2], ascending=False)
-                    .drop(columns='Province_State', axis='columns')
-                    .rename(columns={'Combined_Key': 'County', 
-                     df_by_counties.columns[2]: 'Qty as of ' + df_by_counties.columns[2]}
-                    )
-                    .hvplot.table(sortable=True,
+            # Shared by every session showing the same state, see pycovid19render
+            df = await pycovid19async.run(pycovid19render.get, 'Covid19ViewerUS.hvtableByCounties', self,
+                                          ['state_province', 'confirmed_deaths'], self.tableByCounties)
+            return (df.hvplot.table(sortable=True,
                     selectable=True,
                     width=250,
                     height=500
@@ -215,31 +276,67 @@ class Covid19ViewerUS(param.Parameterized):
                    )
         else:
             return None
+
+    def tableByCounties(self):
+        """ Function to list the counties of the chosen state, highest latest count first
+
+            Returns
+            -------
+                Pandas dataframe with County and Qty as of <latest date> columns
+        """
+
+        df = self.getData(self.confirmed_deaths)
+        df_by_counties = df.query("not Lat==0")[['Province_State', 'Combined_Key', df.columns[-1]]]
+
+        return (df_by_counties.query("Province_State == @self.state_province")
+                .sort_values(by=df_by_counties.columns[2], ascending=False)
+                .drop(columns='Province_State', axis='columns')
+                .rename(columns={'Combined_Key': 'County', 
+                 df_by_counties.columns[2]: 'Qty as of ' + df_by_counties.columns[2]}
+                )
+               )
     
     @param.depends('state_province', 'confirmed_deaths')
-    def plotlyChoropleth(self):
+    @pycovid19metrics.timed
+    async def plotlyChoropleth(self):
         """ A function to output a Plotly choropleth map by state's counties.
             If more than 1 state is chosen, then we will not output the Plotly chart
 
             Returns
             -------
-                Plotly choropleth map
+                Plotly choropleth map, as a figure dictionary
         """
 
         if len(self.state_province) == 1:
-            df = self.getData(self.confirmed_deaths)
-            df_choropleth = df.iloc[:, np.r_[4, 5, 6, df.shape[1]-1]]
-            df_choropleth = df_choropleth.rename(
-                             columns={df_choropleth.columns[3]: 'Confirmed_Cases',
-                                      'Admin2': 'County'
-                                     }
-                            )
-            
-            # Get geo json data at state county level based on FIPS
-            with urlopen('https://raw.githubusercontent.com/plotly/' +
-                         'datasets/master/geojson-counties-fips.json') as response:
-                geo_data = json.load(response)
-            
+            # Shared by every session showing the same state, see pycovid19render, and drawn off the
+            # server's event loop
+            return await pycovid19async.run(pycovid19render.get, 'Covid19ViewerUS.plotlyChoropleth', self,
+                                            ['state_province', 'confirmed_deaths'],
+                                            lambda: self.choropleth().to_plotly_json())
+        else:
+            return None
+
+    def choropleth(self):
+        """ Function to draw the Plotly choropleth map of the chosen state's counties
+
+            Returns
+            -------
+                Plotly figure
+        """
+
+        df = self.getData(self.confirmed_deaths)
+        df_choropleth = df[['FIPS', 'Admin2', 'Province_State', df.columns[-1]]]
+        df_choropleth = df_choropleth.rename(
+                         columns={df_choropleth.columns[3]: 'Confirmed_Cases',
+                                  'Admin2': 'County'
+                                 }
+                        )
+
+        # Only the counties of the selected state are sent to the browser, simplified for the zoom level
+        # that fits the state, see pycovid19geo
+        geo_data, center, zoom = pycovid19geo.state_map(self.state_province[0], width=1400, height=700)
+
+        with pycovid19metrics.timer('Covid19ViewerUS.plotly_figure'):
             plotly_chart =  px.choropleth_mapbox(df_choropleth
                              .query("Province_State in@self.state_province"),
                              geojson=geo_data,
@@ -247,34 +344,24 @@ class Covid19ViewerUS(param.Parameterized):
                              color='Confirmed_Cases',
                              color_discrete_map="Viridis",
                              mapbox_style="carto-positron",
-                             zoom=3.5, center = {"lat": 37.0902, "lon": -95.7129},
+                             zoom=zoom, center=center,
                              opacity=0.5,
                              hover_name='County',
                              width=1400,
                              height=700
                             )
             plotly_chart.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
-            
-            return plotly_chart
-        else:
-            return None
+
+        return plotly_chart
 
 
 class Covid19ViewerGlobal(param.Parameterized):
     """ A Panel parameterized class for creating COVID-19 dashboard by countr(y/ies) """
 
-    # Instead of hard-coding a list of country names,
-    # we'll get them directly from the data itself.
-    # This will sacrifice performance for less maintenance.
-    url = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/' + \
-          'master/csse_covid_19_data/csse_covid_19_time_series/' + \
-          'time_series_covid19_confirmed_global.csv'
-    df = pd.read_csv(url)
-    countries_list = df['Country/Region'].unique().tolist()
-
-    # Create widget to select one or more countries
+    # Create widget to select one or more countries.  Instead of hard-coding a list
+    # of country names, we'll get them from the data itself, see offerCountries
     country = param.ListSelector(default=['US'],
-               objects=countries_list, label='Country:'
+               objects=['US'], label='Country:'
               )
     # Create date picker widget.  Usually COVID19 data is a day behind
     covid19_date = param.Date(default=date.today() + timedelta(days=-1), 
@@ -291,6 +378,47 @@ class Covid19ViewerGlobal(param.Parameterized):
     ylog = param.Selector(default='linear', 
             objects=['linear', 'symlog'], label='Scale:'
            )
+    # Create widget to choose the counts or one of the metrics derived from them, see pycovid19cube
+    measure = param.Selector(default='Cumulative', objects=list(pycovid19cube.MEASURES), label='Measure:')
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        # The line chart is computed in cached stages, each only depending on the parameters it uses
+        self.pipeline = pycovid19pipeline.Pipeline(self)
+        self.pipeline.stage('fetch', lambda: self.getData(self.confirmed_deaths), params=['confirmed_deaths'], always=True)
+        self.pipeline.stage('aggregate', self.aggregateByCountry, params=['confirmed_deaths'], inputs=['fetch'])
+        self.pipeline.stage('reshape', lambda cube: cube.long_index(pycovid19cube.MEASURES[self.measure]),
+                            params=['measure'], inputs=['aggregate'])
+        self.pipeline.stage('filter', self.filterByCountry, params=['covid19_date', 'country'], inputs=['reshape'])
+        self.pipeline.stage('render', self.renderAltairLineChart, params=['confirmed_deaths', 'ylog', 'measure'],
+                            inputs=['filter'])
+        self.offerCountries()
+        pycovid19refresh.subscribe(self.onRefresh)
+
+    def offerCountries(self):
+        """ Function to fill the country selector from the entity list written next to the data snapshots
+
+            The list is a small file, so creating a viewer loads no data, let alone downloads it.
+            Before the very first ingest only the default country is offered, until a chart is drawn.
+        """
+
+        countries_list = pycovid19ingest.read_entities('Global')
+        if countries_list:
+            self.param.country.objects = countries_list
+
+    def onRefresh(self):
+        """ Function to show a new data version swapped in by the background refresh, see pycovid19refresh """
+
+        self.offerCountries()
+        start, end = pycovid19refresh.date_bounds('Global')
+        # Viewers looking at the latest data move on to the new latest date
+        value = end if self.covid19_date >= self.param.covid19_date.bounds[1] else self.covid19_date
+        self.param.covid19_date.bounds = (start, end)
+        if value != self.covid19_date:
+            self.covid19_date = value
+        else:
+            # Re-render with the new data even though no parameter changed
+            self.param.trigger('covid19_date')
 
     # @param.depends('confirmed_deaths')
     def getData(self, confirmed_deaths):
@@ -305,21 +433,27 @@ class Covid19ViewerGlobal(param.Parameterized):
                 Pandas dataframe
         """
 
-        if confirmed_deaths == 'Confirmed Cases':
-            url = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/' + \
-                  'master/csse_covid_19_data/csse_covid_19_time_series/' + \
-                  'time_series_covid19_confirmed_global.csv'
-        else:
-            url = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/' + \
-                  'master/csse_covid_19_data/csse_covid_19_time_series/' + \
-                  'time_series_covid19_deaths_global.csv'
-        df = pd.read_csv(url)
+        # Shared by every session, see pycovid19store
+        return pycovid19store.get_dataset('Global', confirmed_deaths)
+
+    def aggregateByCountry(self, df):
+        """ Function to aggregate the counts of a dataset by country, see pycovid19cube
+
+            Parameter
+            ---------
+                df : Pandas dataframe as returned by getData
+
+            Returns
+            -------
+                AggregateCube
+        """
 
-        
-        return df
+        # Built once per data refresh and shared by every session
+        return pycovid19cube.get_cube('Global', self.confirmed_deaths, df)
 
-    @param.depends('covid19_date', 'country', 'confirmed_deaths')
-    def hvtableByDate(self):
+    @param.depends('covid19_date', 'country', 'confirmed_deaths', 'measure')
+    @pycovid19metrics.timed
+    async def hvtableByDate(self):
         """ Function that returns a hvplot table of COVID-19 cases or deaths by date.
             If more than one country is chosen, then return nothing.
 
@@ -329,33 +463,10 @@ class Covid19ViewerGlobal(param.Parameterized):
         """
 
         if len(self.country) == 1:
-            iso_date = self.covid19_date.strftime('%Y-%m-%d')
-            df = self.getData(self.confirmed_deaths)
-            df_countries = (df.drop(columns=['Province/State', 'Lat', 'Long'])
-                            .groupby('Country/Region').agg('sum')
-                            .sort_values(by=df.columns[-1], ascending=False)
-                            .transpose()
-                        )
-            
-            df_countries.index = [datetime.strptime(day, '%m/%d/%y') 
-                                  for day in df_countries.index
-                                 ]
-
-            hvTable = (df_countries[:iso_date].loc[:, self.country]
-                       .sort_values(by=df_countries[:iso_date].loc[:, self.country]
-                       .columns[0], ascending=False
-                       )
-                       .merge(df_countries[:iso_date].loc[:, self.country]
-                        .sort_values(by=df_countries[:iso_date]
-                         .loc[:, self.country].columns[0], ascending=False
-                        ).diff(), how='inner', left_index=True, right_index=True
-                       )
-                       .reset_index()
-                       .rename(columns={'index': 'Date',
-                                f'{self.country[0]}_x': 'Cum. Qty',
-                                f'{self.country[0]}_y': 'Difference'
-                               }
-                              )
+            # Cumulative counts, differences between days and the chosen measure are precomputed in the
+            # aggregate cube
+            cube = await pycovid19async.run(pycovid19cube.get_cube, 'Global', self.confirmed_deaths)
+            hvTable = (cube.table(self.country[0], end=self.covid19_date, layer=pycovid19cube.MEASURES[self.measure])
                        .hvplot.table(sortable=True,
                         selectable=True,
                         width=300,
@@ -367,46 +478,66 @@ class Covid19ViewerGlobal(param.Parameterized):
         else:
             return None
 
-    @param.depends('covid19_date', 'country', 'confirmed_deaths', 'ylog')
-    def plotAltairLineChart(self):
+    def filterByCountry(self, long_index):
+        """ Returns the chosen countries up to the chosen date.
+
+            Parameter
+            ---------
+                long_index : the chosen measure by country in "long format", as Altair requires, grouped by
+                country, see pycovid19cube.LongIndex
+
+            Returns
+            -------
+                Pandas dataframe with Date, Country_Region and Qty columns
+        """
+
+        # Slices of the chosen countries up to the chosen date, rather than a query over every country and date
+        return long_index.select(self.country, end=self.covid19_date, entity_name='Country_Region', value_name='Qty')
+
+    @param.depends('covid19_date', 'country', 'confirmed_deaths', 'ylog', 'measure')
+    @pycovid19metrics.timed
+    async def plotAltairLineChart(self):
         """ Returns an Altair line chart.
 
             Returns
             -------
-                An Altair line chart.
+                The Vega-Lite spec of an Altair line chart.
         """
 
-        df = self.getData(self.confirmed_deaths)
+        # The spec is shared by every session showing the same chart, see pycovid19render.  Rendering it,
+        # only the stages depending on the parameter that changed are recomputed, e.g. a new scale
+        # re-renders the chart from the data filtered before.  The data is loaded, filtered and rendered off
+        # the server's event loop, which keeps serving the other sessions meanwhile, see pycovid19async
+        spec = await pycovid19async.run(pycovid19render.vega_spec, 'Covid19ViewerGlobal.plotAltairLineChart', self,
+                                        ['covid19_date', 'country', 'confirmed_deaths', 'ylog', 'measure'],
+                                        lambda: (self.pipeline('filter'), self.pipeline('render')))
+        # The data has been ingested by now, offer every country if only the default one was available
+        if len(self.param.country.objects) == 1:
+            self.offerCountries()
+        return spec
 
-        iso_date: str = self.covid19_date.strftime('%Y-%m-%d')
-
-        # Altair requires dataframe to be in "long format"
-        df_countries = (df.drop(columns=['Province/State', 'Lat', 'Long'])
-                          .groupby('Country/Region').agg('sum')
-                          .sort_values(by=df.columns[-1], ascending=False)
-                          .transpose()
-                          .reset_index()
-                          .melt(id_vars='index', value_name='Qty')
-                          .rename(columns={'index': 'Date',
-                                   'Country/Region': 'Country_Region'
-                                  }
-                          )
-                          .set_index('Date')
-                       )
+    def axisTitle(self):
+        """ Returns the title of the y axis, after the chosen measure, e.g. # of Deaths or 7-day average of Deaths. """
 
-        # Make index values actual datetime objects so that we can
-        # leverage Panda's date filtering API
-        df_countries.index = [datetime.strptime(day, '%m/%d/%y')
-                              for day in df_countries.index
-                             ]
-    
-        alt_chart = alt.Chart(df_countries[: iso_date]
-                              .query("Country_Region in(@self.country)")
-                              .reset_index()
-                              .rename(columns={'index': 'Date'})
-                             ).mark_line().encode(
+        return pycovid19cube.measure_title(self.measure, self.confirmed_deaths)
+
+    def renderAltairLineChart(self, data):
+        """ Returns the Altair line chart of filtered data.
+
+            Parameter
+            ---------
+                data : Pandas dataframe as returned by filterByCountry
+
+            Returns
+            -------
+                An Altair line chart.
+        """
+
+        # The layers are created without data, so that they all reference the single
+        # dataset given to the layer chart instead of each embedding a copy of it
+        alt_chart = alt.Chart().mark_line().encode(
                               x=alt.X(title='Date', field='Date', type='temporal'),
-                              y=alt.Y(title='# of ' + self.confirmed_deaths, field='Qty',
+                              y=alt.Y(title=self.axisTitle(), field='Qty',
                                type='quantitative', scale=alt.Scale(type=self.ylog)
                               ),
                               color=alt.Color(field='Country_Region', type='nominal',
@@ -419,12 +550,8 @@ class Covid19ViewerGlobal(param.Parameterized):
                             )
         # To create filled circles in the legend per
         # https://github.com/altair-viz/altair/issues/1206
-        points = alt.Chart(df_countries[: iso_date]
-                  .query("Country_Region in(@self.country)")
-                  .reset_index()
-                  .rename(columns={'index': 'Date'})
-                 ).mark_circle(size=0).encode(
-                                       color='Country_Region'
+        points = alt.Chart().mark_circle(size=0).encode(
+                                       color='Country_Region:N'
                                       )
 
         # To add hover tips, but make it less sensitive per
@@ -433,7 +560,8 @@ class Covid19ViewerGlobal(param.Parameterized):
                     tooltip=alt.TooltipContent("data")
                    )
 
-        alt_chart = alt_chart + points + tooltips
+        # Referenced by URL when served with the data endpoint, see pycovid19endpoint
+        alt_chart = alt.layer(alt_chart, points, tooltips, data=pycovid19endpoint.chart_data(data))
 
         return alt_chart.properties(
                 title='COVID-19 ' + self.confirmed_deaths,
@@ -1,24 +1,56 @@
 import altair_covid19_viewer
 import panel as pn
+import pycovid19async
+import pycovid19endpoint
+import pycovid19metrics
+import pycovid19profile
+import pycovid19refresh
 
-us = altair_covid19_viewer.Covid19ViewerUS(name='COVID-19 US Only')
-_global = altair_covid19_viewer.Covid19ViewerGlobal(name='COVID-19 Globally')
 
-us_app = pn.Column(pn.Param(us.param.covid19_date, widgets={'covid19_date': pn.widgets.DatePicker}),
-                   pn.Param(us.param.state_province, height=100, widgets={'state_province': pn.widgets.MultiChoice}),
-                   pn.Param(us.param.confirmed_deaths),
-                   pn.Param(us.param.ylog),
-                   pn.Row(us.plotAltairLineChart, us.hvtableByState, us.hvtableByCounties),
-                   us.plotlyChoropleth
-                  )
+def us_app():
+    """Function that returns the US dashboard of a new session, with a viewer of its own, so that
+    the session's selection is its own and refreshes are shown on its document's thread"""
 
-global_app = pn.Column(pn.Param(_global.param.covid19_date, widgets={'covid19_date': pn.widgets.DatePicker}),
-                   pn.Param(_global.param.country, height=100, widgets={'country': pn.widgets.MultiChoice}),
-                   pn.Param(_global.param.confirmed_deaths),
-                   pn.Param(_global.param.ylog),
-                   pn.Row(_global.plotAltairLineChart, _global.hvtableByDate, min_width=1000, sizing_mode='stretch_width')
-                  ) 
+    us = altair_covid19_viewer.Covid19ViewerUS(name='COVID-19 US Only')
+    return pn.Column(pn.Param(us.param.covid19_date, widgets={'covid19_date': pn.widgets.DatePicker}),
+                     pn.Param(us.param.state_province, height=100, widgets={'state_province': pn.widgets.MultiChoice}),
+                     pn.Param(us.param.confirmed_deaths),
+                     pn.Param(us.param.ylog),
+                     pn.Param(us.param.measure),
+                     # Charts and tables are rendered once the page has loaded, not when the session is created
+                     pn.Row(pycovid19async.loading_panel(us.plotAltairLineChart, defer_load=True),
+                            pycovid19async.loading_panel(us.hvtableByState, defer_load=True),
+                            pycovid19async.loading_panel(us.hvtableByCounties, defer_load=True)
+                           ),
+                     pycovid19async.loading_panel(us.plotlyChoropleth, defer_load=True)
+                    )
+
+
+def global_app():
+    """Function that returns the global dashboard of a new session, with a viewer of its own"""
+
+    _global = altair_covid19_viewer.Covid19ViewerGlobal(name='COVID-19 Globally')
+    return pn.Column(pn.Param(_global.param.covid19_date, widgets={'covid19_date': pn.widgets.DatePicker}),
+                     pn.Param(_global.param.country, height=100, widgets={'country': pn.widgets.MultiChoice}),
+                     pn.Param(_global.param.confirmed_deaths),
+                     pn.Param(_global.param.ylog),
+                     pn.Param(_global.param.measure),
+                     pn.Row(pycovid19async.loading_panel(_global.plotAltairLineChart, defer_load=True),
+                            pycovid19async.loading_panel(_global.hvtableByDate, defer_load=True),
+                            min_width=1000, sizing_mode='stretch_width'
+                           )
+                    )
 
 #us_app.show(host='localhost', port=8889, websocket_origin='localhost:8889', open=False)
 
-pn.serve({'By_Country': global_app, 'US_Only': us_app}, port=8890, websocket_origin='localhost:8890', show=False)
\ No newline at end of file
+apps = {'By_Country': global_app, 'US_Only': us_app}
+
+# Served by `python main.py`, or by several worker processes with `python ../launcher.py main.py`
+if __name__ == '__main__':
+    # Keep the data up to date in the background, sessions never wait on a download
+    pycovid19refresh.start()
+
+    # The charts' data is served next to the apps, at content-hashed URLs the browser caches, the
+    # process' metrics at /metrics and, in profiling mode, its slowest profiles at /admin/profiles
+    pn.serve(apps, port=8890, websocket_origin='localhost:8890', show=False,
+             extra_patterns=pycovid19endpoint.routes() + pycovid19metrics.routes() + pycovid19profile.routes())
\ No newline at end of file
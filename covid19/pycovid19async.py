@@ -0,0 +1,102 @@
+"""Data loading of the apps' callbacks, run off the Bokeh server's event loop
+
+Panel calls the reactive functions and param.depends methods of every session of a process on the
+one event loop of the server.  Whatever a callback waits for there, a download, an ingest, building
+a cube or reading the county geometry when the store misses, freezes every other session until it
+is done.  The callbacks are therefore coroutines that hand their loads to run(), which executes
+them in a pool of threads and awaits the result: the event loop keeps serving the other sessions,
+and the callback only builds its charts, which has to happen on the loop, once the data is there.
+While it waits, loading_panel shows Panel's loading indicator over the chart being replaced.
+
+Settings (environment variables):
+    COVID19_IO_THREADS  threads loading data for the sessions (default 4)
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypeVar, Any, Callable, Dict, Optional
+import asyncio
+import functools
+import inspect
+import os
+import weakref
+import panel as pn
+import pycovid19profile
+# These are related to optional type annotations
+Document = TypeVar('bokeh.document.Document')
+ParamFunction = TypeVar('panel.param.ParamFunction')
+
+THREADS: int = int(os.environ.get('COVID19_IO_THREADS', 4))
+
+# Shared by every session of the process, the store makes concurrent loads of one dataset wait on a single load
+executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='covid19-io')
+
+
+async def run(function: Callable, *args, **kwargs) -> Any:
+    """Function that calls function(*args, **kwargs) in the executor and returns its result,
+    without blocking the event loop meanwhile"""
+
+    call: Callable = functools.partial(function, *args, **kwargs)
+    # In profiling mode, the load is part of the profile of the callback awaiting it
+    interaction: Optional[pycovid19profile.Interaction] = pycovid19profile.current.get()
+    if interaction is not None:
+        call = functools.partial(interaction.load, call)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+def loading_panel(function: Callable, **params) -> ParamFunction:
+    """Function that returns the pane of an async reactive function, which shows Panel's loading
+    indicator from the moment the function is called until its result is shown
+    Parameters
+    ----------
+    function : Callable
+        Coroutine function decorated with pn.depends, or coroutine method of a Parameterized decorated
+        with param.depends
+    params
+        Parameters of the pane, e.g. defer_load=True
+    Returns
+    -------
+    Panel pane
+    """
+
+    # A new call cancels the one still running, the indicator stays until the last one is done.  Calls are
+    # counted by session, a session's count being dropped with it, so that a session closed while loading
+    # neither leaves the indicator on nor is kept alive
+    pending: Dict[Optional[Document], int] = {}
+    # The pane is only reached while it is alive
+    pane: Callable[[], Optional[ParamFunction]] = lambda: None
+
+    def show(loading: bool) -> None:
+        if pane() is not None:
+            pane().loading = loading
+
+    def session_destroyed(doc: Document) -> None:
+        pending.pop(doc, None)
+        show(sum(pending.values()) > 0)
+
+    async def show_loading(*args, **kwargs):
+        doc: Optional[Document] = pn.state.curdoc
+        if doc not in pending and doc is not None and doc.session_context is not None:
+            pn.state.on_session_destroyed(lambda session_context: session_destroyed(doc))
+        pending[doc] = pending.get(doc, 0) + 1
+        show(True)
+        try:
+            return await call(*args, **kwargs)
+        finally:
+            # Unless the session was destroyed meanwhile
+            if doc in pending:
+                pending[doc] -= 1
+            show(sum(pending.values()) > 0)
+
+    if inspect.ismethod(function):
+        # A method depends on parameters named after those of its owner, and is called without their values
+        owner = function.__self__
+        dependencies = [owner.param[dependency.name] for dependency in owner.param.method_dependencies(function.__name__)]
+        call = lambda *values: function()
+        show_loading = pn.depends(*dependencies)(show_loading)
+    else:
+        call = function
+        show_loading = functools.wraps(function)(show_loading)
+
+    # Unless its loading is deferred, the pane calls the function as it is created, without an indicator
+    panel: ParamFunction = pn.panel(show_loading, **params)
+    pane = weakref.ref(panel)
+    return panel
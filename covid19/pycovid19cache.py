@@ -0,0 +1,246 @@
+"""Persistent on-disk cache for the source files the COVID-19 apps download
+
+Every URL is stored once under the cache directory along with the ETag/Last-Modified
+validators upstream sent with it.  Later reads revalidate with a conditional GET and only
+download the body again when upstream has actually changed (anything but 304 Not Modified).
+Parsing is left to the callers, which keep their own snapshots of the parsed data (see
+pycovid19ingest).  Network errors, server errors, rate limiting and timeouts are retried a few times
+with an exponential backoff, and if they persist a cached copy is used as is.  fetch_all brings
+several files up to date at the same time over a bounded number of connections, so that it takes as
+long as the slowest file rather than all of them, and reports how each one went, failing only the
+files that could not be fetched and have no cached copy.
+
+Settings (environment variables):
+    COVID19_CACHE_DIR          where to keep the files (default ~/.cache/covid19)
+    COVID19_CACHE_MAX_AGE      seconds during which a cached file is used without even
+                               revalidating it upstream (default 300)
+    COVID19_FETCH_TIMEOUT      seconds a request may take (default 60)
+    COVID19_FETCH_RETRIES      retries of a failed request (default 2)
+    COVID19_FETCH_CONNECTIONS  files fetch_all fetches at the same time (default 5)
+"""
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from typing import TypeVar, Any, Dict, Optional, Sequence, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+# These are related to optional type annotations
+Path = TypeVar('str')
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR: Path = os.environ.get('COVID19_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'covid19'))
+MAX_AGE: float = float(os.environ.get('COVID19_CACHE_MAX_AGE', 300))
+TIMEOUT: float = float(os.environ.get('COVID19_FETCH_TIMEOUT', 60))
+RETRIES: int = int(os.environ.get('COVID19_FETCH_RETRIES', 2))
+CONNECTIONS: int = int(os.environ.get('COVID19_FETCH_CONNECTIONS', 5))
+# Seconds before the first retry, doubled before every following one
+BACKOFF: float = 1
+
+# One lock per URL so that concurrent sessions asking for the same file share one download
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_for(url: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(url, threading.Lock())
+
+
+def _paths(url: str) -> Dict[str, Path]:
+    key: str = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+    name: str = os.path.basename(url.split('?')[0]) or 'index'
+    stem: Path = os.path.join(CACHE_DIR, f'{key}-{name}')
+    return {'raw': stem, 'meta': stem + '.meta.json'}
+
+
+def _read_meta(path: Path) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    # Write to a temporary file then rename so readers never see a half written file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class FetchReport:
+    """ How fetch brought the local copy of one URL up to date """
+
+    def __init__(self, url: str):
+        self.url = url
+        # 'fresh' (used without revalidating), 'not modified', 'downloaded', 'stale' (upstream
+        # unreachable, the cached copy is used) or 'failed'
+        self.status: Optional[str] = None
+        self.attempts = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.error: Optional[Exception] = None
+
+    def __str__(self) -> str:
+        return (f'{os.path.basename(self.url.split("?")[0]) or self.url}: {self.status} in {self.seconds:.2f} s, '
+                f'{self.attempts} request(s), {self.bytes:,} bytes' + (f' ({self.error})' if self.error else ''))
+
+
+def _retryable(error: Exception) -> bool:
+    # Server errors, rate limiting, timeouts and network failures may go away, other HTTP errors (e.g. 404) do not
+    if isinstance(error, HTTPError):
+        return error.code >= 500 or error.code == 429
+    return isinstance(error, (URLError, OSError))
+
+
+def _open(request: Request, report: FetchReport) -> Tuple[bytes, Any]:
+    # Body and headers of the response, after up to RETRIES retries
+    while True:
+        report.attempts += 1
+        try:
+            with urlopen(request, timeout=TIMEOUT) as response:
+                return response.read(), response.headers
+        except Exception as e:
+            if report.attempts > RETRIES or not _retryable(e):
+                raise
+            delay: float = BACKOFF * 2 ** (report.attempts - 1)
+            logger.info('Retrying %s in %.0f s: %s', request.full_url, delay, e)
+            time.sleep(delay)
+
+
+def fetch(url: str, max_age: Optional[float] = None, report: Optional[FetchReport] = None) -> Path:
+    """Function that returns the path of an up to date local copy of url
+    Parameters
+    ----------
+    url : str
+        Location of the source file
+    max_age : float
+        Seconds during which the local copy is trusted without revalidation (default=MAX_AGE)
+    report : FetchReport
+        Filled in with how the local copy was brought up to date (default=none kept)
+    Returns
+    -------
+    Path of the local copy
+    """
+
+    max_age = MAX_AGE if max_age is None else max_age
+    paths: Dict[str, Path] = _paths(url)
+    report = report or FetchReport(url)
+
+    with _lock_for(url):
+        meta: dict = _read_meta(paths['meta'])
+        have_copy: bool = bool(meta) and os.path.exists(paths['raw'])
+        if have_copy and time.time() - meta.get('checked', 0) < max_age:
+            report.status = 'fresh'
+            return paths['raw']
+
+        request = Request(url)
+        if have_copy:
+            if meta.get('etag'):
+                request.add_header('If-None-Match', meta['etag'])
+            if meta.get('last_modified'):
+                request.add_header('If-Modified-Since', meta['last_modified'])
+
+        try:
+            body, headers = _open(request, report)
+        except HTTPError as e:
+            if not have_copy or (e.code != 304 and not _retryable(e)):
+                raise
+            if e.code != 304:
+                # Upstream failing or rate limiting even after the retries, same as unreachable
+                logger.warning('Could not revalidate %s, using cached copy: %s', url, e)
+                report.status, report.error = 'stale', e
+                return paths['raw']
+            logger.debug('Not modified: %s', url)
+            report.status = 'not modified'
+            meta['checked'] = time.time()
+        except (URLError, OSError) as e:
+            if not have_copy:
+                raise
+            # Upstream unreachable, a stale copy is still better than no dashboard
+            logger.warning('Could not revalidate %s, using cached copy: %s', url, e)
+            report.status, report.error = 'stale', e
+            return paths['raw']
+        else:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            _write_atomic(paths['raw'], body)
+            now: float = time.time()
+            meta = {'url': url,
+                    'etag': headers.get('ETag'),
+                    # Servers that send neither validator can still answer If-Modified-Since
+                    'last_modified': headers.get('Last-Modified') or formatdate(now, usegmt=True),
+                    'fetched': now,
+                    'checked': now
+                   }
+            logger.info('Downloaded %s (%d bytes)', url, len(body))
+            report.status, report.bytes = 'downloaded', len(body)
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _write_atomic(paths['meta'], json.dumps(meta).encode('utf-8'))
+
+    return paths['raw']
+
+
+def fetch_all(urls: Sequence[str], max_age: Optional[float] = None,
+              connections: int = CONNECTIONS) -> Dict[str, FetchReport]:
+    """Function that brings the local copies of several URLs up to date at the same time, see fetch
+    Parameters
+    ----------
+    urls : Sequence[str]
+        Locations of the source files
+    max_age : float
+        Seconds during which a local copy is trusted without revalidation (default=MAX_AGE)
+    connections : int
+        Files fetched at the same time (default=CONNECTIONS)
+    Returns
+    -------
+    FetchReport by URL, once every file is done.  A file upstream keeps failing is served from its
+    cached copy ('stale'), only those without one are 'failed', with their error
+    """
+
+    reports: Dict[str, FetchReport] = {url: FetchReport(url) for url in urls}
+
+    def run(report: FetchReport) -> None:
+        start: float = time.perf_counter()
+        try:
+            fetch(report.url, max_age, report)
+        except Exception as e:
+            report.status, report.error = 'failed', e
+        report.seconds = time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max(1, min(connections, len(reports))),
+                            thread_name_prefix='covid19-fetch') as pool:
+        list(pool.map(run, reports.values()))
+
+    for report in reports.values():
+        if report.status == 'failed':
+            logger.error('Could not fetch %s', report)
+        else:
+            logger.info('Fetched %s', report)
+    return reports
+
+
+def clear() -> None:
+    """Function that removes every file from the cache directory, including the snapshots, geometry,
+    shared blocks and profiles other modules keep in its subdirectories"""
+
+    if os.path.isdir(CACHE_DIR):
+        for name in os.listdir(CACHE_DIR):
+            path: Path = os.path.join(CACHE_DIR, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
@@ -0,0 +1,128 @@
+"""County-level time series explorer, rendered server-side with Datashader
+
+The apps only chart states and countries: the curves of the ~3,300 US counties over 1,000+ days
+are millions of points, too many for the browser to draw.  The explorer instead:
+    - aggregates every county curve with Datashader into an image of the plot's size, counting
+      the curves crossing each pixel, and sends the browser that image only
+    - rasterizes again on every zoom and pan (RangeXY and PlotSize streams), so the payload stays
+      the size of the plot however many points are behind it
+    - answers hovering from the CountyIndex (see pycovid19cube): a binary search on the dates for
+      the pointer's x, then on that date's sorted counts for its y, and highlights the curve of the
+      county found
+
+Requires datashader (and xarray, which it depends on) on top of holoviews.  Every session needs
+its own streams, serve the factory, e.g. pn.serve({'US_Counties': counties_app}).
+"""
+from typing import TypeVar, Optional, Tuple
+import datashader as ds
+import holoviews as hv
+import pandas as pd
+import panel as pn
+import pycovid19cube
+import pycovid19store
+# These are related to optional type annotations
+CountyIndex = TypeVar('pycovid19cube.CountyIndex')
+DataFrame = TypeVar('pd.core.frame.DataFrame')
+Panel = TypeVar('pn.layout.Column')
+
+hv.extension('bokeh')
+
+WIDTH, HEIGHT = 1000, 600
+# Pixels the pointer may be away from a curve for hovering to pick it up
+HOVER_PIXELS = 5
+
+
+def county_lines(index: CountyIndex) -> DataFrame:
+    """Function that returns the counts of every county as Datashader draws lines from the columns of a
+    row (axis=1), one row per county and one column per date"""
+
+    return pd.DataFrame(index.counts.T.astype('float64'), columns=[str(i) for i in range(len(index.dates))])
+
+
+def get_county_lines(metric: str) -> DataFrame:
+    """Function that returns the county_lines of a metric, built once per data refresh and shared by every session"""
+
+    return pycovid19store.store.get(('US', metric, 'county_lines'),
+                                    lambda: county_lines(pycovid19cube.get_county_index(metric))
+                                   )
+
+
+def _extent(index: CountyIndex, x_range: Optional[tuple], y_range: Optional[tuple]) -> Tuple[tuple, tuple]:
+    # The whole data until the first zoom or pan
+    if x_range is None:
+        x_range = (index.dates[0], index.dates[-1])
+    if y_range is None:
+        y_range = (0, float(index.counts[-1].max()))
+    return (pd.Timestamp(x_range[0]).value, pd.Timestamp(x_range[1]).value), tuple(map(float, y_range))
+
+
+def rasterize(index: CountyIndex, lines: DataFrame, x_range: Optional[tuple] = None, y_range: Optional[tuple] = None,
+              width: Optional[int] = None, height: Optional[int] = None) -> hv.Image:
+    """Function that draws every county curve within the given ranges into an image
+    Parameters
+    ----------
+    index : CountyIndex
+        Counts of every county
+    lines : DataFrame
+        The same counts as returned by county_lines
+    x_range, y_range : tuple
+        Dates and counts shown (default=all of them)
+    width, height : int
+        Size of the plot in pixels (default=WIDTH, HEIGHT)
+    Returns
+    -------
+    hv.Image of the number of county curves crossing each pixel
+    """
+
+    x_range, y_range = _extent(index, x_range, y_range)
+    canvas = ds.Canvas(plot_width=width or WIDTH, plot_height=height or HEIGHT, x_range=x_range, y_range=y_range)
+    agg = canvas.line(lines, x=index.dates.asi8, y=list(lines.columns), axis=1, agg=ds.count())
+    # Datashader works on nanoseconds, the plot's x-axis is made of dates
+    agg = agg.assign_coords(x=agg.x.values.astype('datetime64[ns]'))
+    return hv.Image(agg, kdims=['Date', 'Qty'], vdims=['Counties'])
+
+
+def highlight(index: CountyIndex, x=None, y=None, y_range: Optional[tuple] = None,
+              height: Optional[int] = None) -> hv.Curve:
+    """Function that returns the curve of the county under the pointer, labelled with its count,
+    or an empty curve if no county is close enough"""
+
+    if x is None or y is None:
+        return hv.Curve([], 'Date', 'Qty')
+    _, y_range = _extent(index, None, y_range)
+    tolerance: float = (y_range[1] - y_range[0]) / (height or HEIGHT) * HOVER_PIXELS
+    found: Optional[Tuple[int, int]] = index.nearest(x, y, tolerance)
+    if found is None:
+        return hv.Curve([], 'Date', 'Qty')
+    county, position = found
+    label: str = (f'{index.names[county]}: {index.counts[position, county]:,} '
+                  f'as of {index.dates[position].strftime("%Y-%m-%d")}')
+    return hv.Curve((index.dates, index.counts[:, county]), 'Date', 'Qty', label=label)
+
+
+def counties_app() -> Panel:
+    """Function that returns the county explorer of a new session"""
+
+    confirmed_deaths = pn.widgets.Select(name='Confirmed Cases or Deaths:', value='Confirmed Cases',
+                                         options=['Confirmed Cases', 'Deaths'], width=200
+                                        )
+    # Every stream parameter is passed to both callbacks, each picks the ones it needs
+    def image(confirmed_deaths: str, x_range=None, y_range=None, width=None, height=None, **kwargs) -> hv.Image:
+        return rasterize(pycovid19cube.get_county_index(confirmed_deaths), get_county_lines(confirmed_deaths),
+                         x_range, y_range, width, height)
+
+    def pointed(confirmed_deaths: str, x=None, y=None, y_range=None, height=None, **kwargs) -> hv.Curve:
+        return highlight(pycovid19cube.get_county_index(confirmed_deaths), x, y, y_range, height)
+
+    range_xy = hv.streams.RangeXY()
+    plot_size = hv.streams.PlotSize()
+    counties = hv.DynamicMap(pn.bind(image, confirmed_deaths), streams=[range_xy, plot_size])
+    pointer = hv.streams.PointerXY(source=counties)
+    county = hv.DynamicMap(pn.bind(pointed, confirmed_deaths), streams=[pointer, range_xy, plot_size])
+
+    plot = (counties.opts(cmap='fire', cnorm='eq_hist', colorbar=True, width=WIDTH, height=HEIGHT,
+                          tools=[], title='COVID-19 by US county', ylabel='# per county', xlabel='Date')
+            * county.opts(color='deepskyblue', line_width=3, show_legend=True)
+           ).opts(legend_position='top_left')
+
+    return pn.Column(confirmed_deaths, plot)
@@ -0,0 +1,390 @@
+"""Precomputed state/country aggregate cube shared by every chart and table
+
+The views used to redo groupby('Province_State')/groupby('Country/Region') and a transpose on
+every render.  Instead, once per data refresh, each (region, metric) dataset is aggregated into a
+dates x entities numpy matrix together with its derived layers, computed for every entity at once
+(see derive):
+    cumulative  the JHU counts summed per state/country
+    daily       difference between consecutive days (the first day keeps its cumulative count)
+    avg7        trailing 7-day average of the daily layer
+    avg14       trailing 14-day average of the daily layer
+    growth      daily growth of the cumulative count in percent, compounded over the trailing 7 days
+    doubling    days the cumulative count takes to double at that growth rate
+The growth rate and doubling time are NaN where they are undefined, e.g. before any count or
+while the count does not grow.  Charts and tables then only slice rows (dates) and columns
+(entities) out of the matrices, the views offer the layers as measures (see MEASURES).  Each layer
+is also kept in the "long format" the Altair charts require, grouped by entity (see LongIndex).
+The US counties are likewise kept unaggregated in a CountyIndex, for the county explorer.
+"""
+from typing import TypeVar, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from pycovid19ingest import ENTITY_COLUMNS
+import pycovid19ingest
+import pycovid19store
+# These are related to optional type annotations
+DataFrame = TypeVar('pd.core.frame.DataFrame')
+Date = TypeVar('datetime.date')
+DateTimeIndex = TypeVar('pd.core.indexes.datetimes.DatetimeIndex')
+Index = TypeVar('pd.core.indexes.base.Index')
+ndarray = TypeVar('numpy.ndarray')
+
+LAYERS = ('cumulative', 'daily', 'avg7', 'avg14', 'growth', 'doubling')
+# The layers as the views offer them, by label
+MEASURES: Dict[str, str] = {'Cumulative': 'cumulative',
+                            'Daily new': 'daily',
+                            '7-day average': 'avg7',
+                            '14-day average': 'avg14',
+                            'Growth rate (%/day)': 'growth',
+                            'Doubling time (days)': 'doubling'
+                           }
+# Days over which the growth rate is compounded
+GROWTH_WINDOW = 7
+
+# Not US states, they are left out of every US view
+CRUISE_SHIPS: List[str] = ['Diamond Princess', 'Grand Princess']
+
+
+def measure_title(measure: str, metric: str) -> str:
+    """Function that titles the axis of a measure of a metric, e.g. # of Deaths or 7-day average of Deaths"""
+
+    if measure == 'Cumulative':
+        return '# of ' + metric
+    return measure + ' of ' + metric
+
+
+def rolling_mean(daily: ndarray, window: int) -> ndarray:
+    """Function that returns the trailing rolling mean over the rows of a dates x entities matrix,
+    averaging over fewer days at the start of the series"""
+
+    totals: ndarray = np.cumsum(daily, axis=0, dtype='float64')
+    totals[window:] = totals[window:] - totals[:-window]
+    days: ndarray = np.minimum(np.arange(1, daily.shape[0] + 1), window)
+    return totals / days[:, None]
+
+
+def growth_rate(cumulative: ndarray, window: int = GROWTH_WINDOW) -> ndarray:
+    """Function that returns the daily growth of a dates x entities matrix of cumulative counts in
+    percent, compounded over the trailing window: 100 * ((count / count window days before) ** (1 / window) - 1),
+    NaN for the first window days and wherever the earlier count is not positive"""
+
+    growth: ndarray = np.full(cumulative.shape, np.nan)
+    before: ndarray = cumulative[:-window].astype('float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio: ndarray = cumulative[window:] / before
+        growth[window:] = np.where(before > 0, 100 * (ratio ** (1 / window) - 1), np.nan)
+    return growth
+
+
+def doubling_time(growth: ndarray) -> ndarray:
+    """Function that returns the days a count takes to double at daily growth rates in percent,
+    NaN where it does not grow"""
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(growth > 0, np.log(2) / np.log1p(growth / 100), np.nan)
+
+
+def derive(cumulative: ndarray) -> Dict[str, ndarray]:
+    """Function that returns every layer of a dates x entities matrix of cumulative counts, see LAYERS"""
+
+    daily: ndarray = np.empty_like(cumulative)
+    daily[0] = cumulative[0]
+    np.subtract(cumulative[1:], cumulative[:-1], out=daily[1:])
+    growth: ndarray = growth_rate(cumulative)
+    return {'cumulative': cumulative,
+            'daily': daily,
+            'avg7': rolling_mean(daily, 7),
+            'avg14': rolling_mean(daily, 14),
+            'growth': growth,
+            'doubling': doubling_time(growth)
+           }
+
+
+class LongIndex:
+    """ One layer of a cube in "long format", stored grouped by entity
+
+        The values of every entity are contiguous and in date order, those of the i-th entity
+        starting at offsets[i].  Selecting N entities up to a date is a searchsorted on the sorted
+        dates and N slices, O(N + rows selected), instead of a scan of every entity x date row
+        through DataFrame.query.
+    """
+
+    def __init__(self, dates: DateTimeIndex, entities: Index, matrix: ndarray):
+        self.dates: ndarray = dates.to_numpy()
+        self.entities: ndarray = entities.to_numpy()
+        self._positions: Dict[str, int] = {entity: i for i, entity in enumerate(self.entities)}
+        # Every entity has a value for every date, its values are a column of the dates x entities matrix
+        self.values: ndarray = np.ascontiguousarray(matrix.T).reshape(-1)
+        self.offsets: ndarray = np.arange(len(self.entities) + 1) * len(self.dates)
+        self.values.setflags(write=False)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.offsets.nbytes + self.dates.nbytes
+
+    def select(self, entities: Sequence[str], end: Optional[Date] = None,
+               entity_name: str = 'Entity', value_name: str = 'Qty') -> DataFrame:
+        """Function that returns the values of entities up to a date, ready to be charted
+        Parameters
+        ----------
+        entities : Sequence[str]
+            States or countries to include, unknown ones are left out
+        end : Date
+            Last date to include (default=the latest date)
+        entity_name, value_name : str
+            Names of the entity and value columns
+        Returns
+        -------
+        Pandas dataframe with Date, entity and value columns, grouped by entity in the order given
+        """
+
+        count: int = len(self.dates)
+        if end is not None:
+            count = int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end)), side='right'))
+        positions: List[int] = [self._positions[entity] for entity in entities if entity in self._positions]
+        values: ndarray = np.concatenate([self.values[self.offsets[i]:self.offsets[i] + count] for i in positions]
+                                         or [self.values[:0]]
+                                        )
+        return pd.DataFrame({'Date': np.tile(self.dates[:count], len(positions)),
+                             entity_name: np.repeat(self.entities[positions], count),
+                             value_name: values
+                            }
+                           )
+
+
+class AggregateCube:
+    """ Dates x entities matrices of one region and metric, with their derived layers """
+
+    def __init__(self, dates: DateTimeIndex, entities: Index, cumulative: ndarray):
+        self.dates = dates
+        self.entities = entities
+        self._columns: Dict[str, int] = {entity: i for i, entity in enumerate(entities)}
+
+        self.layers: Dict[str, ndarray] = derive(cumulative)
+        for matrix in self.layers.values():
+            matrix.setflags(write=False)
+        self._long: Dict[str, LongIndex] = {layer: LongIndex(dates, entities, matrix)
+                                            for layer, matrix in self.layers.items()
+                                           }
+
+    @property
+    def nbytes(self) -> int:
+        return (sum(matrix.nbytes for matrix in self.layers.values())
+                + sum(index.nbytes for index in self._long.values())
+               )
+
+    def long_index(self, layer: str = 'cumulative') -> LongIndex:
+        """Function that returns a layer in "long format", grouped by entity"""
+
+        return self._long[layer]
+
+    def rows(self, end: Optional[Date] = None) -> slice:
+        """Function that returns the slice of dates up to and including end"""
+
+        if end is None:
+            return slice(None)
+        return slice(0, int(self.dates.searchsorted(pd.Timestamp(end), side='right')))
+
+    def columns(self, entities: Optional[Sequence[str]] = None) -> List[int]:
+        """Function that returns the matrix columns of entities, in the order given"""
+
+        if entities is None:
+            return list(range(len(self.entities)))
+        return [self._columns[entity] for entity in entities if entity in self._columns]
+
+    def frame(self, entities: Optional[Sequence[str]] = None, end: Optional[Date] = None,
+              layer: str = 'cumulative') -> DataFrame:
+        """Function that returns a wide dates x entities slice of a layer
+        Parameters
+        ----------
+        entities : Sequence[str]
+            States or countries to include (default=all of them)
+        end : Date
+            Last date to include (default=the latest date)
+        layer : str
+            One of LAYERS
+        Returns
+        -------
+        Pandas dataframe with a DatetimeIndex and one column per entity
+        """
+
+        rows: slice = self.rows(end)
+        columns: List[int] = self.columns(entities)
+        return pd.DataFrame(self.layers[layer][rows][:, columns],
+                            index=self.dates[rows],
+                            columns=self.entities[columns]
+                           )
+
+    def long_frame(self, entities: Optional[Sequence[str]] = None, end: Optional[Date] = None,
+                   layer: str = 'cumulative', entity_name: str = 'Entity', value_name: str = 'Qty') -> DataFrame:
+        """Function that returns a slice of a layer in the "long format" Altair requires
+        Parameters
+        ----------
+        entities : Sequence[str]
+            States or countries to include (default=all of them)
+        end : Date
+            Last date to include (default=the latest date)
+        layer : str
+            One of LAYERS
+        entity_name, value_name : str
+            Names of the entity and value columns
+        Returns
+        -------
+        Pandas dataframe indexed by date in ascending order, with an entity and a value column
+        """
+
+        rows: slice = self.rows(end)
+        columns: List[int] = self.columns(entities)
+        values: ndarray = self.layers[layer][rows][:, columns]
+        dates: DateTimeIndex = self.dates[rows]
+        return pd.DataFrame({entity_name: np.tile(self.entities[columns].to_numpy(), len(dates)),
+                             value_name: values.ravel()
+                            },
+                            index=dates.repeat(len(columns))
+                           )
+
+    def table(self, entity: str, end: Optional[Date] = None, layer: str = 'cumulative') -> DataFrame:
+        """Function that returns the cumulative count and daily difference of one entity, and
+        another layer, latest date first
+        Parameters
+        ----------
+        entity : str
+            State or country
+        end : Date
+            Last date to include (default=the latest date)
+        layer : str
+            One of LAYERS, added as a column named after its measure unless it is the cumulative
+            count or daily difference (default='cumulative')
+        Returns
+        -------
+        Pandas dataframe with Date, Cum. Qty and Difference columns, and the layer's
+        """
+
+        rows: slice = self.rows(end)
+        column: int = self._columns[entity]
+        columns: Dict[str, ndarray] = {'Date': self.dates[rows],
+                                       'Cum. Qty': self.layers['cumulative'][rows, column],
+                                       'Difference': self.layers['daily'][rows, column]
+                                      }
+        if layer not in ('cumulative', 'daily'):
+            label: str = next(label for label, measure in MEASURES.items() if measure == layer)
+            columns[label] = self.layers[layer][rows, column].round(2)
+        return pd.DataFrame(columns).iloc[::-1].reset_index(drop=True)
+
+
+def build_cube(region: str, metric: str, df: Optional[DataFrame] = None) -> AggregateCube:
+    """Function that aggregates a JHU dataset by state or country into an AggregateCube
+    Parameters
+    ----------
+    region : str
+        'US' (aggregated by Province_State) or 'Global' (aggregated by Country/Region)
+    metric : str
+        'Confirmed Cases' or 'Deaths'
+    df : DataFrame
+        Dataset to aggregate (default=the one in the store)
+    Returns
+    -------
+    AggregateCube
+    """
+
+    if df is None:
+        df = pycovid19store.get_dataset(region, metric)
+    entity: str = ENTITY_COLUMNS[region]
+    if region == 'US':
+        df = df[~df[entity].isin(CRUISE_SHIPS)]
+    counts: List[str] = pycovid19ingest.date_columns(df)
+    by_entity: DataFrame = df.groupby(entity, observed=True, sort=True)[counts].sum()
+
+    return AggregateCube(dates=pycovid19ingest.parse_dates(counts),
+                         entities=pd.Index(by_entity.index.astype(str), name=entity),
+                         cumulative=np.ascontiguousarray(by_entity.to_numpy(dtype='int64').T)
+                        )
+
+
+def get_cube(region: str, metric: str, df: Optional[DataFrame] = None) -> AggregateCube:
+    """Function that returns the aggregate cube of a region and metric, built once per data
+    refresh and shared by every session
+    Parameters
+    ----------
+    region : str
+        'US' or 'Global'
+    metric : str
+        'Confirmed Cases' or 'Deaths'
+    df : DataFrame
+        Dataset to aggregate if the cube is not built yet (default=the one in the store)
+    Returns
+    -------
+    AggregateCube
+    """
+
+    return pycovid19store.store.get((region, metric, 'cube'), lambda: build_cube(region, metric, df))
+
+
+class CountyIndex:
+    """ Cumulative counts of every US county, with each date's counts sorted to find the county
+        closest to a count in O(log counties), see pycovid19counties
+    """
+
+    def __init__(self, names: Index, dates: DateTimeIndex, counts: ndarray):
+        self.names = names
+        self.dates = dates
+        # dates x counties, int32 as ingested
+        self.counts: ndarray = np.ascontiguousarray(counts)
+        self.order: ndarray = np.argsort(self.counts, axis=1, kind='stable').astype('int32')
+        self.sorted: ndarray = np.take_along_axis(self.counts, self.order, axis=1)
+        for matrix in (self.counts, self.order, self.sorted):
+            matrix.setflags(write=False)
+
+    @property
+    def nbytes(self) -> int:
+        return self.counts.nbytes + self.order.nbytes + self.sorted.nbytes
+
+    def nearest(self, x: Date, y: float, tolerance: float) -> Optional[Tuple[int, int]]:
+        """Function that returns the county whose curve passes closest to a point
+        Parameters
+        ----------
+        x : Date
+            Date of the point, the closest date of the data is used
+        y : float
+            Count of the point
+        tolerance : float
+            Largest difference between y and the count of the county
+        Returns
+        -------
+        (county, date) positions in counts, or None if no county is within tolerance
+        """
+
+        position: int = int(self.dates.searchsorted(pd.Timestamp(x)))
+        if position == len(self.dates) or (position > 0 and pd.Timestamp(x) - self.dates[position - 1]
+                                           < self.dates[position] - pd.Timestamp(x)):
+            position -= 1
+        counts: ndarray = self.sorted[position]
+        i: int = int(np.searchsorted(counts, y))
+        candidates: List[int] = [j for j in (i - 1, i) if 0 <= j < len(counts)]
+        if not candidates:
+            return None
+        best: int = min(candidates, key=lambda j: abs(counts[j] - y))
+        if abs(counts[best] - y) > tolerance:
+            return None
+        return int(self.order[position, best]), position
+
+
+def build_county_index(metric: str, df: Optional[DataFrame] = None) -> CountyIndex:
+    """Function that builds the CountyIndex of a metric from the US dataset (default=the one in the store)"""
+
+    if df is None:
+        df = pycovid19store.get_dataset('US', metric)
+    # The rows without a location are not counties, e.g. "Unassigned" or "Out of" a state
+    df = df[df['Lat'] != 0]
+    counts: List[str] = pycovid19ingest.date_columns(df)
+    return CountyIndex(names=pd.Index(df['Combined_Key'].astype(str)),
+                       dates=pycovid19ingest.parse_dates(counts),
+                       counts=df[counts].to_numpy().T
+                      )
+
+
+def get_county_index(metric: str) -> CountyIndex:
+    """Function that returns the CountyIndex of a metric, built once per data refresh and shared by
+    every session"""
+
+    return pycovid19store.store.get(('US', metric, 'counties'), lambda: build_county_index(metric))
@@ -0,0 +1,183 @@
+"""HTTP endpoint serving the chart data out of band, at content-hashed URLs
+
+Inline in a Vega-Lite spec, the long-format data of an Altair chart travels over the websocket
+again on every parameter change.  Instead, chart_data() publishes the filtered frame under the
+hash of its content, and the chart only references its URL:
+    /covid19/data/<hash>.json   records, as Altair would have inlined them
+    /covid19/data/<hash>.csv    the same with a header row, about half the size
+    /covid19/data/<hash>.arrow  Arrow IPC stream, for other clients than the browser charts
+The charts reference them relative to their page, so the URLs follow the server's prefix, if any.
+The content of a URL never changes, so responses are sent gzipped with an ETag and cached by
+the browser for a year: switching back to a view already seen costs no request at all, a
+revalidation only a 304, and the websocket only carries the spec.  Published frames are kept in their own DatasetStore, bounded
+in bytes, until evicted least recently used first.
+
+The handler has to be registered with the server, i.e. pn.serve(..., extra_patterns=routes()).
+Until routes() has been called, e.g. under `panel serve`, charts keep inlining their data.
+
+Settings (environment variables):
+    COVID19_ENDPOINT_MAX_MB  memory ceiling of the published frames and their payloads (default 64)
+"""
+from typing import TypeVar, Callable, Dict, List, Tuple
+import gzip
+import hashlib
+import io
+import os
+import altair as alt
+import pandas as pd
+import panel as pn
+import pyarrow as pa
+import tornado.web
+import pycovid19store
+# These are related to optional type annotations
+DataFrame = TypeVar('pd.core.frame.DataFrame')
+
+PREFIX = '/covid19/data/'
+MAX_BYTES: int = int(float(os.environ.get('COVID19_ENDPOINT_MAX_MB', 64)) * 2**20)
+# A year, the longest lifetime browsers honour
+MAX_AGE = 365 * 24 * 3600
+
+# Published frames by hash, and their gzipped payloads by (hash, format)
+payloads = pycovid19store.DatasetStore(ttl=float('inf'), max_bytes=MAX_BYTES)
+
+# Whether routes() has registered the handler, i.e. whether charts may reference the URLs
+enabled: bool = False
+
+
+def to_json(df: DataFrame) -> bytes:
+    # Dates as local ISO timestamps without timezone, as Altair inlines them
+    dates: Dict[str, pd.Series] = {column: df[column].dt.strftime('%Y-%m-%dT%H:%M:%S')
+                                   for column, dtype in df.dtypes.items() if pd.api.types.is_datetime64_any_dtype(dtype)
+                                  }
+    return df.assign(**dates).to_json(orient='records').encode()
+
+
+def to_csv(df: DataFrame) -> bytes:
+    return df.to_csv(index=False, date_format='%Y-%m-%dT%H:%M:%S').encode()
+
+
+def to_arrow(df: DataFrame) -> bytes:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+FORMATS: Dict[str, Tuple[str, Callable[[DataFrame], bytes]]] = {
+    'json': ('application/json', to_json),
+    'csv': ('text/csv; charset=utf-8', to_csv),
+    'arrow': ('application/vnd.apache.arrow.stream', to_arrow)
+}
+
+
+def publish(df: DataFrame) -> str:
+    """Function that makes a frame available at the data endpoint
+    Parameters
+    ----------
+    df : DataFrame
+        Data to publish, its index is not published
+    Returns
+    -------
+    Hash of the content of df, which the URLs are made of
+    """
+
+    digest = hashlib.sha1(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    digest.update('\0'.join(map(str, df.columns)).encode())
+    key: str = digest.hexdigest()[:24]
+    payloads.get(key, lambda: df)
+    return key
+
+
+def payload(key: str, fmt: str) -> bytes:
+    """Function that returns the gzipped payload of a published frame in one of the FORMATS
+    Raises
+    ------
+    KeyError if nothing was published under key, or it has been evicted since
+    """
+
+    def unpublished() -> DataFrame:
+        raise KeyError(key)
+
+    if key not in payloads:
+        raise KeyError(key)
+
+    def serialize() -> bytes:
+        df: DataFrame = payloads.get(key, unpublished)
+        return gzip.compress(FORMATS[fmt][1](df), compresslevel=6)
+
+    return payloads.get((key, fmt), serialize)
+
+
+def chart_data(df: DataFrame, fmt: str = 'csv'):
+    """Function that returns what to give an Altair chart as its data
+    Parameters
+    ----------
+    df : DataFrame
+        Data of the chart
+    fmt : str
+        'json' or 'csv', the formats Vega-Lite reads (default='csv')
+    Returns
+    -------
+    alt.UrlData referencing the published frame once the endpoint is served, df itself otherwise
+    """
+
+    if not enabled:
+        return df
+
+    # Vega-Lite infers the types of the encoded fields, the others (e.g. in tooltips) are parsed too
+    parse: Dict[str, str] = {column: 'date' if pd.api.types.is_datetime64_any_dtype(dtype) else 'number'
+                             for column, dtype in df.dtypes.items()
+                             if pd.api.types.is_datetime64_any_dtype(dtype) or pd.api.types.is_numeric_dtype(dtype)
+                            }
+    return alt.UrlData(url=f'{base_path()}{publish(df)}.{fmt}', format=alt.DataFormat(type=fmt, parse=parse))
+
+
+def base_path() -> str:
+    """Function that returns the path of the endpoint relative to the page of the current session
+    Bokeh serves the endpoint under the server's prefix like the apps, so a path relative to the page
+    reaches it whatever the prefix.  Panel's rel_path leads from the page back to the root of the apps,
+    e.g. '..' for an app at /group/app, or is the absolute URL of the server for an embedded app
+    """
+
+    rel_path: str = pn.state.rel_path or ''
+    return (rel_path.rstrip('/') + PREFIX) if rel_path else PREFIX.lstrip('/')
+
+
+class ChartDataHandler(tornado.web.RequestHandler):
+    """ Serves the published frames, see chart_data """
+
+    def get(self, key: str, fmt: str) -> None:
+        if key not in payloads:
+            raise tornado.web.HTTPError(404)
+
+        self.set_header('Cache-Control', f'public, max-age={MAX_AGE}, immutable')
+        self.set_header('ETag', f'"{key}"')
+        self.set_header('Vary', 'Accept-Encoding')
+        # The content of a URL never changes, a revalidation is answered before anything is serialized.
+        # Tornado parses If-None-Match as a list of strong or weak (W/) tags, or *
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        try:
+            body: bytes = payload(key, fmt)
+        except KeyError:
+            # Evicted meanwhile
+            raise tornado.web.HTTPError(404)
+        self.set_header('Content-Type', FORMATS[fmt][0])
+        if 'gzip' in self.request.headers.get('Accept-Encoding', ''):
+            self.set_header('Content-Encoding', 'gzip')
+        else:
+            body = gzip.decompress(body)
+        self.write(body)
+
+
+def routes() -> List[tuple]:
+    """Function that returns the Tornado routes of the data endpoint, for pn.serve's extra_patterns,
+    and makes the charts reference it from then on"""
+
+    global enabled
+
+    enabled = True
+    return [(PREFIX + r'([0-9a-f]+)\.(' + '|'.join(FORMATS) + ')', ChartDataHandler)]
@@ -0,0 +1,240 @@
+"""County GeoJSON for the choropleth maps, loaded once and pre-split by state
+
+The plotly county GeoJSON covers the whole US, but a choropleth only ever shows the counties of
+one state.  The file is therefore parsed once, its features indexed by the state FIPS prefix
+(the first two digits of the county FIPS code) and split into one FeatureCollection per state.
+The collections are shared by every session and every render, and each carries a GeoJSON
+"bbox" member so that the map can be centered and zoomed on the state.  As in RFC 7946, the bbox of
+a state crossing the antimeridian (Alaska's Aleutians) has its west edge east of its east edge.
+
+Full resolution borders are far more detailed than a map zoomed out on a state can show, so
+after every download the GeoJSON is also simplified, without opening gaps between counties (see
+pycovid19simplify), at each of the TOLERANCES and written next to the snapshots.  A map picks the
+coarsest level whose error stays under one pixel at its zoom level.
+"""
+from typing import TypeVar, Dict, Iterator, List, Tuple
+import json
+import logging
+import math
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from pycovid19sources import GEOJSON_URL
+import pycovid19cache
+import pycovid19simplify
+import pycovid19store
+# These are related to optional type annotations
+DataFrame = TypeVar('pd.core.frame.DataFrame')
+GeoJSON = TypeVar('dict')
+Path = TypeVar('str')
+
+logger = logging.getLogger(__name__)
+
+# Simplification tolerances in degrees, 0 being the full resolution GeoJSON
+TOLERANCES: Tuple[float, ...] = (0.0, 0.002, 0.01, 0.05)
+
+# Size of a mapbox tile in pixels, used to work out the zoom level that fits a state
+TILE_SIZE = 256
+
+
+def geometry_dir() -> Path:
+    """Function that returns the directory of the simplified GeoJSON, under the current pycovid19cache.CACHE_DIR"""
+
+    return os.path.join(pycovid19cache.CACHE_DIR, 'geometry')
+
+
+def geometry_path(tolerance: float) -> Path:
+    """Function that returns the county GeoJSON simplified at tolerance, simplifying it first
+    if the download is newer than the simplified file
+    Parameters
+    ----------
+    tolerance : float
+        One of TOLERANCES
+    Returns
+    -------
+    Path of the GeoJSON file
+    """
+
+    if tolerance not in TOLERANCES:
+        raise ValueError(f'Unknown simplification tolerance {tolerance}, expected one of {TOLERANCES}')
+    raw: Path = pycovid19cache.fetch(GEOJSON_URL)
+    if tolerance == 0:
+        return raw
+
+    directory: Path = geometry_dir()
+    path: Path = os.path.join(directory, f'counties-{tolerance:g}.json')
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(raw):
+        return path
+
+    with open(raw) as f:
+        simplified: GeoJSON = pycovid19simplify.simplify(json.load(f), tolerance)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(simplified, f, separators=(',', ':'))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    logger.info('Wrote %s (%d bytes)', path, os.path.getsize(path))
+
+    return path
+
+
+def load_counties(tolerance: float = 0.0) -> GeoJSON:
+    """Function that parses the county GeoJSON of the whole US at one of the TOLERANCES"""
+
+    with open(geometry_path(tolerance)) as f:
+        return json.load(f)
+
+
+def _positions(coordinates: list) -> Iterator[list]:
+    # Yields every [lon, lat] position of a Polygon or MultiPolygon, whatever the nesting depth
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        yield coordinates
+    else:
+        for part in coordinates:
+            yield from _positions(part)
+
+
+def extent(positions: np.ndarray) -> List[float]:
+    """Function that returns the [west, south, east, north] bbox of [lon, lat] positions
+    Positions spreading over more than half of the globe are taken to cross the antimeridian,
+    and the bbox then wraps around it: west > east
+    """
+
+    lons, lats = positions[:, 0], positions[:, 1]
+    if lons.max() - lons.min() > 180:
+        lons = np.where(lons > 0, lons - 360, lons)
+    west, east = lons.min(), lons.max()
+    return [float(west + 360 if west < -180 else west), float(lats.min()), float(east), float(lats.max())]
+
+
+def split_by_state(geo_data: GeoJSON) -> Dict[str, GeoJSON]:
+    """Function that splits a county FeatureCollection into one FeatureCollection per state
+    Parameters
+    ----------
+    geo_data : dict
+        County GeoJSON whose feature ids are 5 digit FIPS codes
+    Returns
+    -------
+    Dictionary of FeatureCollections keyed by 2 digit state FIPS prefix, each with a bbox member,
+    sized once for the store (see pycovid19store.SizedDict)
+    """
+
+    features: Dict[str, List[dict]] = {}
+    for feature in geo_data['features']:
+        features.setdefault(str(feature['id'])[:2], []).append(feature)
+
+    by_state: Dict[str, GeoJSON] = {}
+    for prefix, state_features in features.items():
+        positions = np.array([position[:2] for feature in state_features
+                              for position in _positions(feature['geometry']['coordinates'])
+                             ])
+        by_state[prefix] = {'type': 'FeatureCollection',
+                            'bbox': extent(positions),
+                            'features': state_features
+                           }
+
+    return pycovid19store.SizedDict(by_state)
+
+
+def counties_by_state(tolerance: float = 0.0) -> Dict[str, GeoJSON]:
+    """Function that returns the county FeatureCollections keyed by state FIPS prefix, split once
+    per data refresh and shared by every session"""
+
+    return pycovid19store.store.get(('GeoJSON', 'by_state', tolerance),
+                                    lambda: split_by_state(load_counties(tolerance))
+                                   )
+
+
+def state_fips_prefixes(df: DataFrame) -> Dict[str, str]:
+    """Function that maps every state of a JHU US table to its 2 digit FIPS prefix
+    JHU also lists "Out of <state>" and "Unassigned" rows with 80xxx/90xxx codes, so a
+    state's prefix is the one most of its counties share
+    """
+
+    pairs: DataFrame = pd.DataFrame({'state': df['Province_State'].astype(str),
+                                     'prefix': df['FIPS'].astype(str).str[:2]
+                                    })
+    most_common: DataFrame = pairs.value_counts().reset_index().drop_duplicates('state')
+    return dict(zip(most_common['state'], most_common['prefix']))
+
+
+def state_geojson(state: str, tolerance: float = 0.0) -> GeoJSON:
+    """Function that returns the county FeatureCollection of one state
+    Parameters
+    ----------
+    state : str
+        Province_State as spelled in the JHU data, e.g. 'Ohio'
+    tolerance : float
+        One of TOLERANCES, see tolerance_for_zoom (default=full resolution)
+    Returns
+    -------
+    FeatureCollection holding only the counties of state, shared and therefore not to be modified
+    """
+
+    prefixes: Dict[str, str] = pycovid19store.store.get(
+        ('US', 'state_fips'), lambda: state_fips_prefixes(pycovid19store.get_dataset('US', 'Confirmed Cases'))
+    )
+    return counties_by_state(tolerance).get(prefixes.get(state), {'type': 'FeatureCollection', 'features': []})
+
+
+def map_view(geo_data: GeoJSON, width: int, height: int) -> Tuple[Dict[str, float], float]:
+    """Function that returns the mapbox center and zoom level fitting a FeatureCollection
+    Parameters
+    ----------
+    geo_data : dict
+        FeatureCollection with a bbox member, as returned by state_geojson
+    width, height : int
+        Size of the map in pixels
+    Returns
+    -------
+    Center as a {'lat', 'lon'} dictionary and zoom level, the whole US if there is no bbox
+    """
+
+    if 'bbox' not in geo_data:
+        return {'lat': 37.0902, 'lon': -95.7129}, 3.5
+
+    west, south, east, north = geo_data['bbox']
+    # Web mercator stretches latitudes, so the vertical extent is measured in projected units
+    mercator = lambda lat: math.degrees(math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)))
+    # A bbox crossing the antimeridian wraps around it
+    lon_span: float = max((east - west) % 360, 1e-6)
+    lat_span: float = max(mercator(north) - mercator(south), 1e-6)
+    zoom: float = min(math.log2(width * 360 / (TILE_SIZE * lon_span)),
+                      math.log2(height * 360 / (TILE_SIZE * lat_span))
+                     )
+    center: Dict[str, float] = {'lat': (south + north) / 2, 'lon': (west + lon_span / 2 + 180) % 360 - 180}
+
+    # Leave a margin around the state
+    return center, round(zoom - 0.3, 2)
+
+
+def tolerance_for_zoom(zoom: float) -> float:
+    """Function that returns the coarsest of the TOLERANCES still finer than a pixel at a mapbox
+    zoom level"""
+
+    degrees_per_pixel: float = 360 / (TILE_SIZE * 2**zoom)
+    return max(tolerance for tolerance in TOLERANCES if tolerance <= degrees_per_pixel)
+
+
+def state_map(state: str, width: int, height: int) -> Tuple[GeoJSON, Dict[str, float], float]:
+    """Function that returns what a choropleth of the counties of one state needs
+    Parameters
+    ----------
+    state : str
+        Province_State as spelled in the JHU data, e.g. 'Ohio'
+    width, height : int
+        Size of the map in pixels
+    Returns
+    -------
+    FeatureCollection simplified for the extent of the state, map center and zoom level
+    """
+
+    # The extent is taken from the full resolution borders, whose split by state is cached like the
+    # others, rather than simplifying the whole GeoJSON at some tolerance just for a bbox
+    center, zoom = map_view(state_geojson(state), width, height)
+    return state_geojson(state, tolerance_for_zoom(zoom)), center, zoom
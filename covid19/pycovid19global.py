@@ -1,10 +1,13 @@
 from datetime import date
-from datetime import datetime
 from datetime import timedelta
 from typing import TypeVar, List
-import hvplot.pandas
-import pandas as pd
+import hvplot.pandas  # noqa: F401, adds the .hvplot accessor used below
 import panel as pn
+import pycovid19async
+import pycovid19cube
+import pycovid19ingest
+import pycovid19metrics
+import pycovid19refresh
 # These are related to optional type annotations
 DataFrame = TypeVar('pd.core.frame.DataFrame')
 Date = TypeVar('datetime.date')
@@ -15,23 +18,9 @@ MultiChoice = TypeVar('panel.widgets.select.MultiChoice')
 RangeIndex = TypeVar('pandas.core.indexes.range.RangeIndex')
 Select = TypeVar('panel.widgets.select.Select')
 
-url: str = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv'
-df: DataFrame = pd.read_csv(url)
-
-# Create input widgets: date widget and 2 selection widgets
-# There is bug in the date widget in version 0.9.3: https://github.com/holoviz/panel/issues/1173
-# Manually fixed the bug by modifying input.py source file
-# Make default date yesterday (today minus 1 day) since COVID-19 data is usually 1 day behind
-countries_list: List[str] = df['Country/Region'].unique().tolist()
-covid19_date: DatePicker = pn.widgets.DatePicker(name='Date:', value=(date.today() + timedelta(days=-1)))
-country: MultiChoice = pn.widgets.MultiChoice(name='Country:', value=['US'],
-    options=countries_list)
-confirmed_deaths = pn.widgets.Select(name='Confirmed Cases or Deaths:', value='Confirmed Cases', options=['Confirmed Cases', 'Deaths'],
-                                     width=200, css_classes=['grey-theme'])
-ylog: Select = pn.widgets.Select(name='log-y?', value=False, options=[True, False])
-
-@pn.depends(covid19_date.param.value, confirmed_deaths.param.value, country.param.value, ylog.param.value)
-def covid19TimeSeriesByCountry(covid19_date: Date, confirmed_deaths: str, country: List[str]=['US'], ylog: bool=False) -> Panel:
+@pycovid19metrics.timed
+async def covid19TimeSeriesByCountry(covid19_date: Date, confirmed_deaths: str, country: List[str]=['US'], ylog: bool=False,
+                                     measure: str='Cumulative') -> Panel:
     """Function that returns a Panel dashboard displaying confirmed COVID-19 cases
     It is using Panel's "Reactive functions" API: https://panel.holoviz.org/user_guide/APIs.html
     Parameters
@@ -44,6 +33,8 @@ def covid19TimeSeriesByCountry(covid19_date: Date, confirmed_deaths: str, countr
         Option to choose # of confirmed cases or # of deaths from Covid-19
     ylog: bool
         Whether or not to apply log scaling to y-axis.  Default is False
+    measure : str
+        One of pycovid19cube.MEASURES, charted and added to the table by date (default='Cumulative')
     Returns
     -------
     Panel object
@@ -51,27 +42,16 @@ def covid19TimeSeriesByCountry(covid19_date: Date, confirmed_deaths: str, countr
     
     iso_date: str = covid19_date.strftime('%Y-%m-%d')
 
-    # Source of COVID-19 data
-    if confirmed_deaths == 'Confirmed Cases':
-        url: str = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv'
-    else:
-        url: str = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv'
-    df: DataFrame = pd.read_csv(url)
-
-    df_countries: DataFrame = (df.drop(columns=['Province/State', 'Lat', 'Long'])
-                               .groupby('Country/Region').agg('sum')
-                               .sort_values(by=df.columns[-1], ascending=False)
-                               .transpose()
-                              )
-
-    # Make index an actual datetime data type for easier date filtering.
-    # JHU have not been consistent with their year format (YYYY vs YY).
-    # Therefore, added try/except clause to account for both formats
-    try:
-        df_countries.index: RangeIndex = [datetime.strptime(date, '%m/%d/%y') for date in df_countries.index]
-    except ValueError as e:
-        print("YY year format not detected.  Using YYYY instead.", e)
-        df_countries.index: RangeIndex = [datetime.strptime(date, '%m/%d/%Y') for date in df_countries.index]
+    # Counts by country are aggregated once per data refresh and shared by every session, see pycovid19cube.
+    # The cube's index is already an actual datetime data type for easier date filtering.  Loaded off the server's event
+    # loop, which keeps serving the other sessions meanwhile, see pycovid19async
+    cube = await pycovid19async.run(pycovid19cube.get_cube, 'Global', confirmed_deaths)
+    # The metrics derived from the counts are computed along with them, the chart only picks one
+    layer: str = pycovid19cube.MEASURES[measure]
+    df_countries: DataFrame = cube.frame(layer=layer)
+    ytitle: str = pycovid19cube.measure_title(measure, confirmed_deaths)
+    # Averages, growth rates and doubling times are not whole numbers
+    yformat: str = '%d' if layer in ('cumulative', 'daily') else '%.1f'
 
     # If only one country is selected, then also provide a data table containing counts by date
     if len(country) == 1:
@@ -80,24 +60,18 @@ def covid19TimeSeriesByCountry(covid19_date: Date, confirmed_deaths: str, countr
                                logy=ylog,
                                width=700,
                                height=500,
-                               ylabel='# of ' + confirmed_deaths,
+                               ylabel=ytitle,
                                xlabel='Date',
                                legend='bottom',
-                               yformatter='%d',
+                               yformatter=yformat,
                                grid=True
                               ),
-                              df_countries[:iso_date].loc[:, country].sort_values(by=df_countries[:iso_date].loc[:, country].columns[0], ascending=False)
-                                                     .merge(df_countries[:iso_date].loc[:, country].sort_values(by=df_countries[:iso_date]
-                                                            .loc[:, country].columns[0], ascending=False
-                                                           )
-                                                     .diff(), how='inner', left_index=True, right_index=True)
-                                                     .reset_index()
-                                                     .rename(columns={'index': 'Date', f'{country[0]}_x': 'Cum. Qty', f'{country[0]}_y': 'Difference'})
-                                                     .hvplot.table(sortable=True,
-                                                                   selectable=True,
-                                                                   width=300,
-                                                                   height=500
-                                                                  )  
+                              cube.table(country[0], end=covid19_date, layer=layer)
+                                  .hvplot.table(sortable=True,
+                                                selectable=True,
+                                                width=300,
+                                                height=500
+                                               )
                            )
     else:
         panel_app: Panel = pn.Row(df_countries[:iso_date].loc[:, country].hvplot(
@@ -105,20 +79,87 @@ def covid19TimeSeriesByCountry(covid19_date: Date, confirmed_deaths: str, countr
                                logy=ylog,
                                width=700,
                                height=500,
-                               ylabel='# of ' + confirmed_deaths,
+                               ylabel=ytitle,
                                xlabel='Date',
                                legend='bottom',
-                               yformatter='%d',
+                               yformatter=yformat,
                                grid=True
                               )
                            )
 
     return panel_app
 
-global_app = pn.Column(
-                       covid19_date,
-                       country,
-                       confirmed_deaths,
-                       ylog,
-                       covid19TimeSeriesByCountry
-                      )
\ No newline at end of file
+
+class GlobalDashboard:
+    """ The widgets and charts of one session """
+
+    def __init__(self):
+        # Create input widgets: date widget and 2 selection widgets
+        # There is bug in the date widget in version 0.9.3: https://github.com/holoviz/panel/issues/1173
+        # Manually fixed the bug by modifying input.py source file
+        # Make default date yesterday (today minus 1 day) since COVID-19 data is usually 1 day behind
+        # The countries come from the small list written next to the data snapshots, so no data is loaded, let
+        # alone downloaded, when a session starts.  Before the very first ingest only the default country is offered
+        self.covid19_date: DatePicker = pn.widgets.DatePicker(name='Date:', value=(date.today() + timedelta(days=-1)))
+        self.country: MultiChoice = pn.widgets.MultiChoice(name='Country:', value=['US'],
+                                                           options=pycovid19ingest.read_entities('Global') or ['US'])
+        self.confirmed_deaths = pn.widgets.Select(name='Confirmed Cases or Deaths:', value='Confirmed Cases',
+                                                  options=['Confirmed Cases', 'Deaths'],
+                                                  width=200, css_classes=['grey-theme'])
+        self.ylog: Select = pn.widgets.Select(name='log-y?', value=False, options=[True, False])
+        # The counts or one of the metrics derived from them, see pycovid19cube
+        self.measure: Select = pn.widgets.Select(name='Measure:', value='Cumulative',
+                                                 options=list(pycovid19cube.MEASURES))
+
+        # Called back on this session's document, see pycovid19refresh
+        pycovid19refresh.subscribe(self.onRefresh)
+        timeSeries = pn.depends(self.covid19_date.param.value, self.confirmed_deaths.param.value,
+                                self.country.param.value, self.ylog.param.value, self.measure.param.value
+                               )(self.timeSeriesByCountry)
+        self.layout: Panel = pn.Column(
+                                 self.covid19_date,
+                                 self.country,
+                                 self.confirmed_deaths,
+                                 self.ylog,
+                                 self.measure,
+                                 # Rendered once the page has loaded, not when the session is created, with a
+                                 # loading indicator while the data is loaded
+                                 pycovid19async.loading_panel(timeSeries, defer_load=True)
+                             )
+
+    def offerCountries(self, force: bool = False) -> None:
+        """Function that fills the country selector from the entity list written next to the data snapshots,
+        if it only offers the default country or force is set"""
+
+        if force or len(self.country.options) == 1:
+            self.country.options = pycovid19ingest.read_entities('Global')
+
+    async def timeSeriesByCountry(self, covid19_date: Date, confirmed_deaths: str, country: List[str],
+                                  ylog: bool = False, measure: str = 'Cumulative') -> Panel:
+        """Function that returns the charts of the widgets' values, see covid19TimeSeriesByCountry"""
+
+        panel_app: Panel = await covid19TimeSeriesByCountry(covid19_date, confirmed_deaths, country, ylog, measure)
+        # The data has been ingested by now, offer every country if only the default one was available
+        self.offerCountries()
+        return panel_app
+
+    def onRefresh(self) -> None:
+        """Function that shows a new data version swapped in by the background refresh, see pycovid19refresh"""
+
+        self.offerCountries(force=True)
+        start, end = pycovid19refresh.date_bounds('Global')
+        # Sessions looking at the latest data move on to the new latest date
+        value: Date = (end if self.covid19_date.end is None or self.covid19_date.value >= self.covid19_date.end
+                       else self.covid19_date.value)
+        self.covid19_date.param.update(start=start, end=end)
+        if value != self.covid19_date.value:
+            self.covid19_date.value = value
+        else:
+            # Re-render with the new data even though no widget value changed
+            self.covid19_date.param.trigger('value')
+
+
+def global_app() -> Panel:
+    """Function that returns the global dashboard of a new session, every session has widgets of its own"""
+
+    return GlobalDashboard().layout
\ No newline at end of file
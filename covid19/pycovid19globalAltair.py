@@ -1,13 +1,17 @@
 # Currently there is a bug where the dates shown in the Altair tooltip are off by one day
 # https://github.com/holoviz/panel/issues/1303
 from datetime import date
-from datetime import datetime
 from datetime import timedelta
 from typing import TypeVar, List
 import altair as alt
-import hvplot.pandas
-import pandas as pd
+import hvplot.pandas  # noqa: F401, adds the .hvplot accessor used below
 import panel as pn
+import pycovid19async
+import pycovid19cube
+import pycovid19endpoint
+import pycovid19ingest
+import pycovid19metrics
+import pycovid19refresh
 # These are related to optional type annotations
 Altair = TypeVar('altair.vegalite.v4.api.LayerChart')
 DataFrame = TypeVar('pd.core.frame.DataFrame')
@@ -19,6 +23,9 @@ PanelRow = TypeVar('pn.layout.Row')
 MultiChoice = TypeVar('panel.widgets.select.MultiChoice')
 RangeIndex = TypeVar('pandas.core.indexes.range.RangeIndex')
 Select = TypeVar('panel.widgets.select.Select')
+# A few states/countries of daily counts exceed Altair's default limit of 5,000 rows.  The layered charts
+# reference their data once and Panel sends it to the browser as a column data source
+alt.data_transformers.disable_max_rows()
 # Related to customizing your Panel's colors
 css = '''
 .black-theme {
@@ -33,29 +40,9 @@ css = '''
 pn.config.raw_css.clear()
 pn.config.raw_css.append(css)
 
-url: str = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv'
-df: DataFrame = pd.read_csv(url)
-
-# Create input widgets: date widget and 2 selection widgets
-# There is bug in the date widget in version 0.9.3: https://github.com/holoviz/panel/issues/1173
-# Manually fixed the bug by modifying input.py source file
-# Make default date yesterday (today minus 1 day) since COVID-19 data is usually 1 day behind
-countries_list: List[str] = df['Country/Region'].unique().tolist()
-covid19_date: DatePicker = pn.widgets.DatePicker(name='Date:', value=(date.today() + timedelta(days=-1)),
-                            width=200,
-                            css_classes=['grey-theme']
-                           )
-country: MultiChoice = pn.widgets.MultiChoice(name='Country:', value=['US'], options=countries_list)
-confirmed_deaths: Select = pn.widgets.Select(name='Confirmed Cases or Deaths:', value='Confirmed Cases',
-                            options=['Confirmed Cases', 'Deaths'],
-                            width=200, css_classes=['grey-theme']
-                           )
-ylog = pn.widgets.Select(name='Scaling: linear/symlog', value='linear', options=['linear', 'symlog'], 
-        width=200, css_classes=['grey-theme']
-       )
-
-@pn.depends(covid19_date.param.value, confirmed_deaths.param.value, country.param.value, ylog.param.value)
-def covid19TimeSeriesByCountry(covid19_date: Date, confirmed_deaths: str, country: List[str]=['US'], ylog: bool=False) -> PanelRow:
+@pycovid19metrics.timed
+async def covid19TimeSeriesByCountry(covid19_date: Date, confirmed_deaths: str, country: List[str]=['US'], ylog: bool=False,
+                                     measure: str='Cumulative') -> PanelRow:
     """Function that returns a Panel dashboard displaying confirmed COVID-19 cases
     It is using Panel's "Reactive functions" API: https://panel.holoviz.org/user_guide/APIs.html
     Parameters
@@ -68,41 +55,26 @@ def covid19TimeSeriesByCountry(covid19_date: Date, confirmed_deaths: str, countr
         Option to choose # of confirmed cases or # of deaths from Covid-19
     ylog: bool
         Whether or not to apply log scaling to y-axis.  Default is False
+    measure : str
+        One of pycovid19cube.MEASURES, charted and added to the table by date (default='Cumulative')
     Returns
     -------
     Panel object
     """
     
-    iso_date: str = covid19_date.strftime('%Y-%m-%d')
+    # Counts by country in "long format", grouped by country, from the aggregate cube built once per data refresh
+    # and shared by every session, see pycovid19cube.  Loaded off the server's event loop, which keeps serving the
+    # other sessions meanwhile, see pycovid19async
+    cube = await pycovid19async.run(pycovid19cube.get_cube, 'Global', confirmed_deaths)
 
-    # Source of COVID-19 data
-    if confirmed_deaths == 'Confirmed Cases':
-        url: str = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv'
-    else:
-        url: str = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv'
-    df: DataFrame = pd.read_csv(url)
-
-    df_countries: DataFrame = (df.drop(columns=['Province/State', 'Lat', 'Long'])
-                                 .groupby('Country/Region').agg('sum')
-                                 .sort_values(by=df.columns[-1], ascending=False)
-                                 .transpose()
-                                 .reset_index()
-                                 .melt(id_vars='index', value_name='Qty')
-                                 .rename(columns={'index': 'Date', 'Country/Region': 'Country_Region'})
-                                 .set_index('Date')
-                              )
-
-    df_countries.index: DateTimeIndex = [datetime.strptime(date, '%m/%d/%y') for date in df_countries.index]
-
-    # Convert data to "wide format" since hvplot does not work with "long format"
-    df_countries_wide = df_countries.pivot(columns='Country_Region', values='Qty')
-
-    alt_chart: Altair = alt.Chart(df_countries[: iso_date].query("Country_Region in(@country)")
-                         .reset_index()
-                         .rename(columns={'index': 'Date'})
-                        ).mark_line().encode(
+    # The layers are created without data, so that they all reference the single dataset given to the
+    # layer chart instead of each embedding a copy of it
+    # The metrics derived from the counts are computed along with them, the chart only picks one
+    layer: str = pycovid19cube.MEASURES[measure]
+    data: DataFrame = cube.long_index(layer).select(country, end=covid19_date, entity_name='Country_Region', value_name='Qty')
+    alt_chart: Altair = alt.Chart().mark_line().encode(
                          x=alt.X(title='Date', field='Date', type='temporal'),
-                         y=alt.Y(title='# of ' + confirmed_deaths, field='Qty', type='quantitative', scale=alt.Scale(type=ylog)),
+                         y=alt.Y(title=pycovid19cube.measure_title(measure, confirmed_deaths), field='Qty', type='quantitative', scale=alt.Scale(type=ylog)),
                          color=alt.Color(field='Country_Region', type='nominal', legend=alt.Legend(title="Country/Region")),
                          tooltip=[alt.Tooltip(field='Country_Region', type= 'nominal'),
                                   alt.Tooltip(field='Qty', type= 'quantitative'),
@@ -110,7 +82,11 @@ def covid19TimeSeriesByCountry(covid19_date: Date, confirmed_deaths: str, countr
                                  ]
                         )
     # https://github.com/altair-viz/altair/issues/1812
-    alt_chart: Altair = alt_chart + alt_chart.mark_point(size=100, opacity=0, tooltip=alt.TooltipContent("data"))
+    alt_chart: Altair = alt.layer(alt_chart,
+                                  alt_chart.mark_point(size=100, opacity=0, tooltip=alt.TooltipContent("data")),
+                                  # Referenced by URL when served with the data endpoint, see pycovid19endpoint
+                                  data=pycovid19endpoint.chart_data(data)
+                                 )
 
     # If only one country is selected, then also provide a data table containing counts by date
     if len(country) == 1:
@@ -121,20 +97,13 @@ def covid19TimeSeriesByCountry(covid19_date: Date, confirmed_deaths: str, countr
                                   width='container',  # Have to use 'container' option, otherwise, layout is 
                                   height=400
                                  ),
-                                 # Add hvplot table using data in wide format
-                                 df_countries_wide[:iso_date].loc[:, country]
-                                 .sort_values(by=df_countries_wide[:iso_date].loc[:, country].columns[0], ascending=False)
-                                 .merge(df_countries_wide[:iso_date].loc[:, country].sort_values(by=df_countries_wide[:iso_date]
-                                        .loc[:, country].columns[0], ascending=False
-                                       )
-                                 .diff(), how='inner', left_index=True, right_index=True)
-                                 .reset_index()
-                                 .rename(columns={'index': 'Date', f'{country[0]}_x': 'Cum. Qty', f'{country[0]}_y': 'Difference'})
+                                 # Add hvplot table of counts with difference between days, precomputed in the cube
+                                 cube.table(country[0], end=covid19_date, layer=layer)
                                  .hvplot.table(sortable=True,
                                                selectable=True,
                                                width=300,
                                                height=500
-                                              )  
+                                              )
                               )
     # Else provide just the Altair line chart
     else:
@@ -147,12 +116,87 @@ def covid19TimeSeriesByCountry(covid19_date: Date, confirmed_deaths: str, countr
 
     return panel_app
 
-global_app: PanelColumn = pn.Column(
-                           covid19_date,
-                           country,
-                           confirmed_deaths,
-                           ylog,
-                           covid19TimeSeriesByCountry,
-                           sizing_mode='stretch_width',
-                           max_width=1200
-                          )
\ No newline at end of file
+
+class GlobalDashboard:
+    """ The widgets and charts of one session """
+
+    def __init__(self):
+        # Create input widgets: date widget and 2 selection widgets
+        # There is bug in the date widget in version 0.9.3: https://github.com/holoviz/panel/issues/1173
+        # Manually fixed the bug by modifying input.py source file
+        # Make default date yesterday (today minus 1 day) since COVID-19 data is usually 1 day behind
+        # The countries come from the small list written next to the data snapshots, so no data is loaded, let
+        # alone downloaded, when a session starts.  Before the very first ingest only the default country is offered
+        self.covid19_date: DatePicker = pn.widgets.DatePicker(name='Date:', value=(date.today() + timedelta(days=-1)),
+                                                              width=200,
+                                                              css_classes=['grey-theme']
+                                                             )
+        self.country: MultiChoice = pn.widgets.MultiChoice(name='Country:', value=['US'],
+                                                           options=pycovid19ingest.read_entities('Global') or ['US'])
+        self.confirmed_deaths: Select = pn.widgets.Select(name='Confirmed Cases or Deaths:', value='Confirmed Cases',
+                                                          options=['Confirmed Cases', 'Deaths'],
+                                                          width=200, css_classes=['grey-theme']
+                                                         )
+        self.ylog: Select = pn.widgets.Select(name='Scaling: linear/symlog', value='linear',
+                                              options=['linear', 'symlog'], width=200, css_classes=['grey-theme']
+                                             )
+        # The counts or one of the metrics derived from them, see pycovid19cube
+        self.measure: Select = pn.widgets.Select(name='Measure:', value='Cumulative',
+                                                 options=list(pycovid19cube.MEASURES),
+                                                 width=200, css_classes=['grey-theme']
+                                                )
+
+        # Called back on this session's document, see pycovid19refresh
+        pycovid19refresh.subscribe(self.onRefresh)
+        timeSeries = pn.depends(self.covid19_date.param.value, self.confirmed_deaths.param.value,
+                                self.country.param.value, self.ylog.param.value, self.measure.param.value
+                               )(self.timeSeriesByCountry)
+        self.layout: PanelColumn = pn.Column(
+                                       self.covid19_date,
+                                       self.country,
+                                       self.confirmed_deaths,
+                                       self.ylog,
+                                       self.measure,
+                                       # Rendered once the page has loaded, not when the session is created, with
+                                       # a loading indicator while the data is loaded
+                                       pycovid19async.loading_panel(timeSeries, defer_load=True),
+                                       sizing_mode='stretch_width',
+                                       max_width=1200
+                                   )
+
+    def offerCountries(self, force: bool = False) -> None:
+        """Function that fills the country selector from the entity list written next to the data snapshots,
+        if it only offers the default country or force is set"""
+
+        if force or len(self.country.options) == 1:
+            self.country.options = pycovid19ingest.read_entities('Global')
+
+    async def timeSeriesByCountry(self, covid19_date: Date, confirmed_deaths: str, country: List[str],
+                                  ylog: str = 'linear', measure: str = 'Cumulative') -> PanelRow:
+        """Function that returns the charts of the widgets' values, see covid19TimeSeriesByCountry"""
+
+        panel_app: PanelRow = await covid19TimeSeriesByCountry(covid19_date, confirmed_deaths, country, ylog, measure)
+        # The data has been ingested by now, offer every country if only the default one was available
+        self.offerCountries()
+        return panel_app
+
+    def onRefresh(self) -> None:
+        """Function that shows a new data version swapped in by the background refresh, see pycovid19refresh"""
+
+        self.offerCountries(force=True)
+        start, end = pycovid19refresh.date_bounds('Global')
+        # Sessions looking at the latest data move on to the new latest date
+        value: Date = (end if self.covid19_date.end is None or self.covid19_date.value >= self.covid19_date.end
+                       else self.covid19_date.value)
+        self.covid19_date.param.update(start=start, end=end)
+        if value != self.covid19_date.value:
+            self.covid19_date.value = value
+        else:
+            # Re-render with the new data even though no widget value changed
+            self.covid19_date.param.trigger('value')
+
+
+def global_app() -> PanelColumn:
+    """Function that returns the global dashboard of a new session, every session has widgets of its own"""
+
+    return GlobalDashboard().layout
\ No newline at end of file
@@ -0,0 +1,325 @@
+"""Ingest step turning the upstream JHU CSVs into typed, column-compressed Parquet snapshots
+
+The wide JHU layout (one column per day) is slow to parse from CSV text, so each file is parsed
+once after it changes upstream, normalized and written as a Parquet snapshot with
+    * the daily counts stored as int32
+    * the key columns (Province_State, Country/Region, FIPS, Admin2) stored as dictionaries,
+      i.e. pandas categoricals
+    * zstd column compression
+Snapshots are read memory-mapped, so loading one is little more than decompressing the columns.
+Each snapshot records the format it was written in, a snapshot of another format (e.g. written
+before a change of SCHEMAS or COUNT_TYPE) is ingested again instead of being read.
+
+Next to each snapshot the ingest writes the small list of states/countries it holds, from which the
+apps fill their selectors without loading, or downloading, any data.
+
+Normalization is vectorized end to end: the CSV is parsed by Arrow straight into typed columns,
+metadata columns no view reads are never materialized, FIPS codes are zero-padded in bulk, the
+date format is detected once for the whole header and the result is checked against SCHEMAS.
+"""
+from typing import TypeVar, Dict, Iterable, List, Sequence
+import csv
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from pycovid19sources import source_url
+import pycovid19cache
+# These are related to optional type annotations
+DataFrame = TypeVar('pd.core.frame.DataFrame')
+DateTimeIndex = TypeVar('pd.core.indexes.datetimes.DatetimeIndex')
+Path = TypeVar('str')
+Table = TypeVar('pyarrow.lib.Table')
+
+logger = logging.getLogger(__name__)
+
+# Every non-date column of the JHU tables
+META_COLUMNS: List[str] = ['UID', 'iso2', 'iso3', 'code3', 'FIPS', 'Admin2', 'Province_State',
+                           'Country_Region', 'Lat', 'Long_', 'Long', 'Combined_Key', 'Population',
+                           'Province/State', 'Country/Region'
+                          ]
+
+# Metadata columns the views read, with their snapshot types.  The other metadata columns
+# (UID, iso2, iso3, code3, Population, Lat/Long of the global files...) are dropped while parsing
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+SCHEMAS: Dict[str, Dict[str, pa.DataType]] = {
+    'US': {'FIPS': DICTIONARY,
+           'Admin2': DICTIONARY,
+           'Province_State': DICTIONARY,
+           'Lat': pa.float64(),
+           'Combined_Key': pa.string()
+          },
+    'Global': {'Country/Region': DICTIONARY}
+}
+COUNT_TYPE = pa.int32()
+
+# Format of the snapshots, stored in their Parquet metadata.  It follows SCHEMAS and COUNT_TYPE on its
+# own, FORMAT_VERSION is to be bumped for any other change of what a snapshot holds
+FORMAT_VERSION: int = 1
+FORMAT_KEY: bytes = b'covid19.format'
+_LAYOUT: str = repr((sorted((region, sorted(schema.items())) for region, schema in SCHEMAS.items()), COUNT_TYPE))
+SNAPSHOT_FORMAT: bytes = f'{FORMAT_VERSION}-{hashlib.sha1(_LAYOUT.encode()).hexdigest()[:12]}'.encode()
+
+# Column listing the states/countries of each region, in the order of the upstream file
+ENTITY_COLUMNS: Dict[str, str] = {'US': 'Province_State', 'Global': 'Country/Region'}
+
+
+def date_columns(columns: Iterable[str]) -> List[str]:
+    """Function that returns the names of the daily count columns of a JHU table or header"""
+
+    return [column for column in columns if column not in META_COLUMNS]
+
+
+def parse_dates(columns: Sequence[str]) -> DateTimeIndex:
+    """Function that turns JHU date headers into a DatetimeIndex in one call
+    JHU have not been consistent with their year format (YY vs YYYY), so the format is
+    detected once from the first header instead of trying both for every column
+    """
+
+    year: str = columns[0].rsplit('/', 1)[-1]
+    return pd.to_datetime(list(columns), format='%m/%d/%y' if len(year) == 2 else '%m/%d/%Y')
+
+
+def snapshot_dir() -> Path:
+    """Function that returns the directory of the snapshots, under the current pycovid19cache.CACHE_DIR"""
+
+    return os.path.join(pycovid19cache.CACHE_DIR, 'snapshots')
+
+
+def snapshot_path(region: str, metric: str) -> Path:
+    """Function that returns where the snapshot of a region and metric is written"""
+
+    name: str = os.path.basename(source_url(region, metric)).replace('.csv', '.parquet')
+    return os.path.join(snapshot_dir(), name)
+
+
+def snapshot_format(path: Path) -> bytes:
+    """Function that returns the format a snapshot was written in, from its Parquet footer only
+    Parameters
+    ----------
+    path : str
+        Parquet snapshot
+    Returns
+    -------
+    The SNAPSHOT_FORMAT of when it was written, None for a snapshot without one or an unreadable file
+    """
+
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    return metadata.get(FORMAT_KEY)
+
+
+def entities_path(region: str) -> Path:
+    """Function that returns where the entity list of a region is written"""
+
+    return os.path.join(snapshot_dir(), f'entities-{region}.json')
+
+
+def write_entities(table: Table, region: str) -> None:
+    """Function that writes the states/countries of a normalized table, in order of first appearance"""
+
+    entities: List[str] = pc.unique(table[ENTITY_COLUMNS[region]]).to_pylist()
+    fd, tmp = tempfile.mkstemp(dir=snapshot_dir(), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entities, f)
+        os.replace(tmp, entities_path(region))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def read_entities(region: str) -> List[str]:
+    """Function that returns the states/countries of a region as of the last ingest, without any
+    network or snapshot I/O
+    Parameters
+    ----------
+    region : str
+        'US' or 'Global'
+    Returns
+    -------
+    List of Province_State or Country/Region names, empty if nothing was ingested yet
+    """
+
+    try:
+        with open(entities_path(region)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def validate(table: Table, region: str) -> None:
+    """Function that checks a normalized table against the expected schema of its region
+    Raises
+    ------
+    ValueError listing every column that is missing or has the wrong type
+    """
+
+    problems: List[str] = []
+    for column, dtype in SCHEMAS[region].items():
+        if column not in table.column_names:
+            problems.append(f'missing column {column!r}')
+        elif table.schema.field(column).type != dtype:
+            problems.append(f'column {column!r} is {table.schema.field(column).type}, expected {dtype}')
+
+    counts: List[str] = date_columns(table.column_names)
+    if not counts:
+        problems.append('no date columns')
+    else:
+        problems += [f'count column {column!r} is {dtype}, expected {COUNT_TYPE}'
+                     for column, dtype in zip(table.column_names, table.schema.types)
+                     if column not in SCHEMAS[region] and dtype != COUNT_TYPE
+                    ]
+        try:
+            dates: DateTimeIndex = parse_dates(counts)
+        except ValueError as e:
+            problems.append(f'unparseable date header: {e}')
+        else:
+            if not dates.is_monotonic_increasing or not dates.is_unique:
+                problems.append('date columns are not in strictly increasing order')
+
+    if problems:
+        raise ValueError(f'{region} time series does not match the expected schema: ' + '; '.join(problems))
+
+
+def normalize(table: Table, region: str) -> Table:
+    """Function that applies the snapshot schema to a JHU table, one vectorized operation per column
+    Parameters
+    ----------
+    table : pyarrow.Table
+        JHU time series holding at least the SCHEMAS[region] columns and the date columns
+    region : str
+        'US' or 'Global'
+    Returns
+    -------
+    pyarrow.Table with the SCHEMAS[region] columns followed by the int32 count columns
+    """
+
+    counts: List[str] = date_columns(table.column_names)
+    missing: List[str] = [column for column in SCHEMAS[region] if column not in table.column_names]
+    if missing:
+        raise ValueError(f'{region} time series is missing columns: {missing}')
+    table = table.select(list(SCHEMAS[region]) + counts)
+
+    if region == 'US':
+        # To leverage Plotly's choropleth_mapbox function, need to have FIPS as fixed length(n=5)
+        # values consisting of leading zeros.  Rows without a FIPS code cannot be mapped
+        table = table.filter(pc.is_valid(table['FIPS']))
+        fips = pc.cast(pc.cast(table['FIPS'], pa.float64()), pa.int64())
+        table = table.set_column(0, 'FIPS', pc.utf8_lpad(fips.cast(pa.string()), 5, '0'))
+
+    # The table is rebuilt once from its columns, setting 1,000+ columns one by one would be quadratic
+    arrays: list = []
+    for column, values in zip(table.column_names, table.columns):
+        dtype: pa.DataType = SCHEMAS[region].get(column, COUNT_TYPE)
+        if values.null_count and dtype == COUNT_TYPE:
+            values = pc.fill_null(values, 0)
+        if dtype == DICTIONARY:
+            values = pc.dictionary_encode(values.cast(pa.string()))
+        elif values.type != dtype:
+            values = values.cast(dtype)
+        arrays.append(values)
+    table = pa.table(arrays, names=table.column_names)
+
+    validate(table, region)
+    return table
+
+
+def read_normalized(path: Path, region: str) -> Table:
+    """Function that parses a JHU CSV straight into a normalized Arrow table
+    Parameters
+    ----------
+    path : str
+        Local copy of the CSV
+    region : str
+        'US' or 'Global'
+    Returns
+    -------
+    pyarrow.Table with the SCHEMAS[region] columns followed by the int32 count columns
+    """
+
+    with open(path, newline='') as f:
+        header: List[str] = next(csv.reader(f))
+    counts: List[str] = date_columns(header)
+    keep: List[str] = [column for column in SCHEMAS[region] if column in header]
+
+    # Counts are parsed as int32 and the unused metadata columns are never materialized
+    column_types: Dict[str, pa.DataType] = {column: COUNT_TYPE for column in counts}
+    column_types.update({column: pa.float64() if column in ('FIPS', 'Lat') else pa.string() for column in keep})
+    # Large blocks keep the number of chunks per column small, with Arrow's default of 1 MB every
+    # later per-column operation pays for ~20 chunks on the US county files
+    table = pacsv.read_csv(path,
+                           read_options=pacsv.ReadOptions(block_size=1 << 24),
+                           convert_options=pacsv.ConvertOptions(include_columns=keep + counts,
+                                                                column_types=column_types
+                                                               )
+                          )
+    return normalize(table, region)
+
+
+def ingest(region: str, metric: str) -> Path:
+    """Function that makes sure the snapshot of a region and metric reflects the latest upstream CSV
+    Parameters
+    ----------
+    region : str
+        'US' or 'Global'
+    metric : str
+        'Confirmed Cases' or 'Deaths'
+    Returns
+    -------
+    Path of the Parquet snapshot
+    """
+
+    raw: Path = pycovid19cache.fetch(source_url(region, metric))
+    path: Path = snapshot_path(region, metric)
+    # A snapshot is current if it was written after the CSV was last downloaded, in the current format
+    if (os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(raw)
+            and snapshot_format(path) == SNAPSHOT_FORMAT):
+        if not os.path.exists(entities_path(region)):
+            write_entities(pq.read_table(path, columns=[ENTITY_COLUMNS[region]]), region)
+        return path
+
+    table = read_normalized(raw, region)
+    metadata: Dict[bytes, bytes] = dict(table.schema.metadata or {})
+    metadata[FORMAT_KEY] = SNAPSHOT_FORMAT
+    table = table.replace_schema_metadata(metadata)
+    directory: Path = snapshot_dir()
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    os.close(fd)
+    try:
+        pq.write_table(table, tmp, compression='zstd')
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    write_entities(table, region)
+    logger.info('Wrote snapshot %s (%d rows x %d columns)', path, table.num_rows, table.num_columns)
+
+    return path
+
+
+def load(region: str, metric: str) -> DataFrame:
+    """Function that returns the JHU time series of a region and metric from its snapshot
+    Parameters
+    ----------
+    region : str
+        'US' or 'Global'
+    metric : str
+        'Confirmed Cases' or 'Deaths'
+    Returns
+    -------
+    Pandas dataframe with the SCHEMAS[region] columns followed by one int32 column per day,
+    key columns being categoricals
+    """
+
+    table = pq.read_table(ingest(region, metric), memory_map=True)
+    return table.to_pandas()
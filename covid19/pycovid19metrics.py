@@ -0,0 +1,317 @@
+"""Timings, cache hit rates, payload sizes and sessions of the served apps, in Prometheus' text format
+
+Where the time of an interaction goes is recorded as it happens, in the process serving it:
+    covid19_callback_seconds{callback}      every instrumented callback, see timed(): the reactive
+                                            functions of the apps and the param.depends methods of
+                                            the parameterized viewers, loads awaited included
+    covid19_stage_seconds{stage}            the steps of a callback: the stages of a viewer's
+                                            pipeline (fetch, aggregate, reshape, filter, render), and
+                                            any code timed with timer(), e.g. building a Plotly figure
+    covid19_cache_requests_total{cache, result}
+                                            hits and misses of the dataset store, of the data endpoint,
+                                            of the rendered outputs and of every pipeline stage (a
+                                            miss is a recompute)
+    covid19_websocket_message_bytes{msgtype}, covid19_websocket_send_seconds{msgtype}
+                                            size and serialization plus send time of every Bokeh
+                                            message a session is sent, e.g. PULL-DOC-REPLY, the
+                                            document of a new page, and PATCH-DOC, a chart's update
+    covid19_sessions_active, covid19_sessions_created_total
+                                            Bokeh sessions open in the process, and created since start
+routes() returns the handler exposing them at /metrics, for pn.serve's extra_patterns, and starts
+recording the messages and sessions.  The metrics are those of one process: with several workers
+(see launcher.py), scrape every worker at its own port rather than the balancer.  Neither Bokeh nor
+Panel offer a hook on the messages sent, so recording them wraps the functions sending them, see
+recordable(); with versions sending them differently the apps are served without the two websocket
+metrics.
+
+Prometheus' client library is not needed, the few metric types used are written out here.
+"""
+from typing import TypeVar, Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import contextlib
+import functools
+import inspect
+import json
+import logging
+import math
+import threading
+import time
+import bokeh
+import panel as pn
+import panel.io.document
+import tornado.web
+from bokeh.protocol.message import Message
+import pycovid19profile
+# These are related to optional type annotations
+SessionContext = TypeVar('bokeh.server.contexts.BokehSessionContext')
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Prometheus' default buckets, in seconds
+SECONDS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# From 256 bytes to 16 MB, in powers of 4
+BYTES: Tuple[float, ...] = tuple(4.0 ** i for i in range(4, 13))
+
+# Every metric exposed, in the order they were created
+registry: List['Metric'] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """ A metric and its values by label values, see expose() for its text """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 collect: Optional[Callable[[], Dict[tuple, float]]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        # Values read when exposed, from counters kept elsewhere, by label values
+        self.collect = collect
+        self._values: Dict[tuple, Any] = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name} is labelled by {self.labels}, not {tuple(labels)}')
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _labels(self, key: tuple, **extra: str) -> str:
+        pairs: List[Tuple[str, str]] = list(zip(self.labels, key)) + list(extra.items())
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{label}="{_escape(value)}"' for label, value in pairs) + '}'
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """ The name suffix, labels and value of every sample """
+
+        with self._lock:
+            values: Dict[tuple, Any] = dict(self._values)
+        if self.collect:
+            values.update({tuple(map(str, key)): value for key, value in self.collect().items()})
+        for key, value in sorted(values.items()):
+            yield '', self._labels(key), value
+
+    def expose(self) -> str:
+        lines: List[str] = [f'# HELP {self.name} {_escape(self.documentation)}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{self.name}{suffix}{labels} {_format(value)}' for suffix, labels, value in self.samples()]
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key: tuple = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str) -> None:
+        key: tuple = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = SECONDS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key: tuple = self._key(labels)
+        with self._lock:
+            # Counts of every bucket the value falls in, with the sum of the values and their count
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            values: Dict[tuple, Any] = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            for bound, count in zip(self.buckets, counts):
+                yield '_bucket', self._labels(key, le=_format(bound)), count
+            yield '_sum', self._labels(key), total
+            yield '_count', self._labels(key), counts[-1]
+
+
+def expose() -> str:
+    """Function that returns every metric in Prometheus' text exposition format"""
+
+    return ''.join(metric.expose() for metric in registry)
+
+
+callback_seconds = Histogram('covid19_callback_seconds', 'Duration of the apps\' callbacks', ['callback'])
+stage_seconds = Histogram('covid19_stage_seconds', 'Duration of the steps of the callbacks', ['stage'])
+message_bytes = Histogram('covid19_websocket_message_bytes', 'Size of the Bokeh messages sent to the sessions',
+                          ['msgtype'], buckets=BYTES)
+send_seconds = Histogram('covid19_websocket_send_seconds', 'Time serializing and sending the Bokeh messages',
+                         ['msgtype'])
+sessions_active = Gauge('covid19_sessions_active', 'Bokeh sessions open in the process')
+sessions_created = Counter('covid19_sessions_created_total', 'Bokeh sessions created since the process started')
+
+
+def _stores() -> Dict[tuple, float]:
+    # Imported when exposed, the stores count their own lookups
+    import pycovid19endpoint
+    import pycovid19render
+    import pycovid19store
+
+    values: Dict[tuple, float] = {}
+    for name, store in (('store', pycovid19store.store), ('endpoint', pycovid19endpoint.payloads),
+                        ('render', pycovid19render.renders)):
+        values[(name, 'hit')] = store.hits
+        values[(name, 'miss')] = store.misses
+    return values
+
+
+cache_requests = Counter('covid19_cache_requests_total', 'Cache lookups by result (hit or miss)',
+                         ['cache', 'result'], collect=_stores)
+
+
+def timed(function: Callable) -> Callable:
+    """Function that decorates a callback, function or coroutine function, to record its durations in
+    covid19_callback_seconds under its qualified name, e.g. Covid19ViewerUS.plotlyChoropleth, and to
+    profile its calls in profiling mode (see pycovid19profile).  Decorate the function itself, beneath
+    pn.depends or param.depends"""
+
+    name: str = function.__qualname__
+    call: Callable = pycovid19profile.profiled(function, name)
+
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            start: float = time.perf_counter()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                callback_seconds.observe(time.perf_counter() - start, callback=name)
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start: float = time.perf_counter()
+            try:
+                return call(*args, **kwargs)
+            finally:
+                callback_seconds.observe(time.perf_counter() - start, callback=name)
+    return wrapper
+
+
+@contextlib.contextmanager
+def timer(stage: str) -> Iterator[None]:
+    """Function that records the duration of the code it wraps in covid19_stage_seconds, e.g.
+    `with timer('Covid19ViewerUS.plotly_figure'):`"""
+
+    start: float = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=stage)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """ Serves the metrics of the process, see the module docstring """
+
+    def get(self) -> None:
+        self.set_header('Content-Type', CONTENT_TYPE)
+        self.set_header('Cache-Control', 'no-store')
+        self.write(expose())
+
+
+# Whether routes() has started recording the messages and sessions
+enabled: bool = False
+
+
+def _size(message: Message) -> int:
+    return (len(message.header_json) + len(message.metadata_json) + len(message.content_json)
+            + sum(len(json.dumps(buffer.ref)) + memoryview(buffer.data).nbytes for buffer in message._buffers))
+
+
+def recordable() -> bool:
+    """Function that tells whether the functions sending the messages of the sessions are still those
+    _record_messages wraps.  Neither Bokeh nor Panel offer a hook on the messages sent, so these are
+    internals, checked by tests/test_metrics.py for the versions pinned in requirements.txt"""
+
+    send: Optional[Callable] = getattr(Message, 'send', None)
+    dispatch: Optional[Callable] = getattr(panel.io.document, 'dispatch_tornado', None)
+    try:
+        return (inspect.iscoroutinefunction(send) and list(inspect.signature(send).parameters) == ['self', 'conn']
+                and list(inspect.signature(dispatch).parameters) == ['conn', 'events', 'msg'])
+    except TypeError:
+        return False
+
+
+def _record_messages() -> None:
+    # Bokeh sends its own messages, e.g. the document of a new session, Panel writes the patches of the
+    # documents itself.  A message's content is serialized when first written, so both times include it
+    if not recordable():
+        # Better served without these metrics than not at all
+        logger.warning('Not recording the websocket messages, Bokeh %s or Panel %s send them differently',
+                       bokeh.__version__, pn.__version__)
+        return
+    send: Callable = Message.send
+    dispatch: Callable = panel.io.document.dispatch_tornado
+
+    @functools.wraps(send)
+    async def timed_send(message: Message, conn: Any) -> int:
+        start: float = time.perf_counter()
+        sent: int = await send(message, conn)
+        send_seconds.observe(time.perf_counter() - start, msgtype=message.msgtype)
+        message_bytes.observe(sent, msgtype=message.msgtype)
+        return sent
+
+    @functools.wraps(dispatch)
+    def timed_dispatch(conn: Any, events: Optional[list] = None, msg: Optional[Message] = None) -> list:
+        start: float = time.perf_counter()
+        if msg is None and events:
+            msg = conn.protocol.create('PATCH-DOC', events)
+        futures: list = dispatch(conn, msg=msg)
+        if futures:
+            send_seconds.observe(time.perf_counter() - start, msgtype=msg.msgtype)
+            message_bytes.observe(_size(msg), msgtype=msg.msgtype)
+        return futures
+
+    Message.send = timed_send
+    panel.io.document.dispatch_tornado = timed_dispatch
+
+
+def _session_created(session_context: SessionContext) -> None:
+    sessions_created.inc()
+    sessions_active.inc()
+
+
+def _session_destroyed(session_context: SessionContext) -> None:
+    sessions_active.inc(-1)
+
+
+def routes() -> List[tuple]:
+    """Function that returns the Tornado route of the /metrics endpoint, for pn.serve's extra_patterns,
+    and starts recording the messages sent and the sessions of the process"""
+
+    global enabled
+
+    if not enabled:
+        enabled = True
+        _record_messages()
+        pn.state.on_session_created(_session_created)
+        pn.state.on_session_destroyed(_session_destroyed)
+    return [(r'/metrics', MetricsHandler)]
@@ -0,0 +1,122 @@
+"""Pipeline of cached stages behind a parameterized viewer's chart
+
+A method decorated with param.depends is run again from scratch whenever any of its parameters
+changes: toggling the scale of a chart used to slice and filter its data again only to draw the
+same lines.  A Pipeline splits such a method into stages, e.g. fetch -> aggregate -> reshape ->
+filter -> render, each declaring the parameters it reads and the stages it is computed from.  A
+stage keeps its last result and only recomputes it once one of those parameters or input stages
+has changed, so toggling the scale re-renders the chart and nothing else.
+
+Every stage counts its cache hits and recomputes, see Pipeline.stats(), and records them with the
+time it takes in the process' metrics under <class of the owner>.<stage>, see pycovid19metrics.  A
+pipeline may be called from several threads, e.g. those of pycovid19async, which compute its stages
+one call at a time.
+"""
+from typing import TypeVar, Any, Callable, Dict, Optional, Sequence
+import logging
+import threading
+import pycovid19metrics
+# These are related to optional type annotations
+Parameterized = TypeVar('param.Parameterized')
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """ One step of a Pipeline, with the last result it computed and its counters """
+
+    def __init__(self, name: str, compute: Callable[..., Any], params: Sequence[str] = (),
+                 inputs: Sequence[str] = (), always: bool = False):
+        self.name = name
+        self.compute = compute
+        self.params = tuple(params)
+        self.inputs = tuple(inputs)
+        # A stage reading shared state its parameters do not describe (e.g. the dataset store, which a
+        # refresh swaps) is run every time, and only counts as recomputed if its result is a new object
+        self.always = always
+        self.hits = 0
+        self.recomputes = 0
+        # Bumped whenever the result changes, the stages computed from this one compare it
+        self.version = 0
+        self._key: Optional[tuple] = None
+        self._value: Any = None
+
+
+def _frozen(value: Any) -> Any:
+    # List parameters, e.g. the selected states, are compared by content
+    return tuple(value) if isinstance(value, list) else value
+
+
+class Pipeline:
+    """ Cached stages computed from the parameters of owner, see the module docstring """
+
+    def __init__(self, owner: Parameterized):
+        self.owner = owner
+        self.stages: Dict[str, Stage] = {}
+        self._lock = threading.RLock()
+
+    def stage(self, name: str, compute: Callable[..., Any], params: Sequence[str] = (),
+              inputs: Sequence[str] = (), always: bool = False) -> Stage:
+        """Function that appends a stage to the pipeline
+        Parameters
+        ----------
+        name : str
+            Name of the stage, later stages list it in their inputs
+        compute : Callable
+            Called with the results of the input stages, in order.  It may read the parameters
+            listed in params from the owner, and no other parameter
+        params : Sequence[str]
+            Parameters of the owner the stage depends on
+        inputs : Sequence[str]
+            Stages, added before this one, the stage is computed from
+        always : bool
+            Whether to run compute every time, see Stage
+        Returns
+        -------
+        The new Stage
+        """
+
+        for input_ in inputs:
+            if input_ not in self.stages:
+                raise ValueError(f'Stage {name} is computed from {input_}, which has not been added before it')
+        self.stages[name] = Stage(name, compute, params, inputs, always)
+        return self.stages[name]
+
+    def __call__(self, name: str) -> Any:
+        """Function that returns the result of a stage, recomputing it and the stages it is
+        computed from only if what they depend on has changed"""
+
+        with self._lock:
+            stage: Stage = self.stages[name]
+            label: str = f'{type(self.owner).__name__}.{name}'
+            values: list = [self(input_) for input_ in stage.inputs]
+            key: tuple = (tuple(_frozen(getattr(self.owner, parameter)) for parameter in stage.params),
+                          tuple(self.stages[input_].version for input_ in stage.inputs)
+                         )
+
+            if stage.always:
+                with pycovid19metrics.timer(label):
+                    value: Any = stage.compute(*values)
+                if key == stage._key and value is stage._value:
+                    stage.hits += 1
+                    pycovid19metrics.cache_requests.inc(cache=label, result='hit')
+                    return value
+            elif key == stage._key:
+                stage.hits += 1
+                pycovid19metrics.cache_requests.inc(cache=label, result='hit')
+                return stage._value
+            else:
+                with pycovid19metrics.timer(label):
+                    value = stage.compute(*values)
+
+            logger.debug('%s: recomputed stage %s', self.owner.name, name)
+            stage.recomputes += 1
+            pycovid19metrics.cache_requests.inc(cache=label, result='miss')
+            stage.version += 1
+            stage._key, stage._value = key, value
+            return value
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Function that returns the hits and recomputes of every stage, by stage name"""
+
+        return {name: {'hits': stage.hits, 'recomputes': stage.recomputes} for name, stage in self.stages.items()}
@@ -0,0 +1,273 @@
+"""Opt-in profiling of every interaction of the served apps, to find out why a click was slow
+
+In profiling mode, every instrumented callback (see pycovid19metrics.timed) runs under cProfile, one
+profile per call, i.e. per widget change, page load or refresh of a session:
+    - a coroutine callback is only profiled while it runs, not while it awaits: the other sessions'
+      callbacks that the event loop runs meanwhile are left out
+    - the loads it hands to pycovid19async.run are profiled in their thread and added to its profile
+    - the profile is written to DIRECTORY as <time>-<session>-<callback>-<parameters>.prof, e.g.
+      20261018T101502-5f2a9c1e0b7d-Covid19ViewerUS.plotlyChoropleth-state_province=Ohio,confirmed_deaths=Deaths.prof,
+      to be read with pstats or snakeviz.  The session is a short hash of the Bokeh session id, which
+      tells the interactions of a session apart without giving away the id itself, i.e. the means to
+      connect to the session.  The files are kept until removed
+    - the SLOWEST profiles of the process are also kept in memory and served at /admin/profiles
+      (their list, as JSON, slowest first) and /admin/profiles/<name> (the .prof file), only to
+      requests carrying COVID19_ADMIN_TOKEN.  Without a token these routes are not served at all
+Profiling slows every callback down, only turn it on to reproduce a problem.
+
+Settings (environment variables):
+    COVID19_PROFILE          1 to turn profiling on, or launcher.py --profile (default off)
+    COVID19_PROFILE_DIR      where the profiles are written (default the profiles directory of the data cache)
+    COVID19_PROFILE_SLOWEST  number of slowest profiles kept for download (default 20)
+    COVID19_ADMIN_TOKEN      secret /admin/profiles requires, as ?token=... or an
+                             `Authorization: Bearer ...` header (default none, nothing served)
+"""
+from contextvars import ContextVar
+from typing import TypeVar, Any, Callable, Dict, Generator, List, Optional
+import cProfile
+import datetime
+import hashlib
+import heapq
+import hmac
+import inspect
+import io
+import itertools
+import json
+import logging
+import marshal
+import os
+import pstats
+import re
+import threading
+import time
+import panel as pn
+import tornado.web
+import pycovid19cache
+# These are related to optional type annotations
+Path = TypeVar('str')
+
+logger = logging.getLogger(__name__)
+
+ENABLED: bool = os.environ.get('COVID19_PROFILE', '') not in ('', '0')
+DIRECTORY: Path = os.environ.get('COVID19_PROFILE_DIR', os.path.join(pycovid19cache.CACHE_DIR, 'profiles'))
+SLOWEST: int = int(os.environ.get('COVID19_PROFILE_SLOWEST', 20))
+TOKEN: str = os.environ.get('COVID19_ADMIN_TOKEN', '')
+PREFIX = '/admin/profiles'
+# Hexadecimal digits of the session hashes, plenty to tell the sessions of a process apart
+SESSION_DIGITS = 12
+# Longest file name most file systems accept, less room for the suffix
+MAX_NAME = 240
+
+
+def enable() -> None:
+    """Function that turns profiling on, e.g. for launcher.py --profile, before the apps are served"""
+
+    global ENABLED
+
+    ENABLED = True
+
+
+def _slug(text: str) -> str:
+    return re.sub(r'[^A-Za-z0-9._=,+-]+', '_', text)
+
+
+class Interaction:
+    """ The profile of one call of a callback, and the profiles of the loads it awaited """
+
+    def __init__(self, callback: str, session: str, parameters: Dict[str, Any]):
+        self.callback = callback
+        self.session = session
+        self.parameters = parameters
+        self.started = datetime.datetime.now()
+        self.seconds = 0.0
+        self.profiler = cProfile.Profile()
+        self.loads: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        parameters: str = ','.join(f'{name}={"+".join(map(str, value)) if isinstance(value, (list, tuple)) else value}'
+                                   for name, value in self.parameters.items())
+        return _slug(f'{self.started:%Y%m%dT%H%M%S}-{self.session}-{self.callback}-{parameters}')[:MAX_NAME] + '.prof'
+
+    def load(self, function: Callable[[], Any]) -> Any:
+        """ Runs a load of the callback, in a thread of pycovid19async, under a profiler of its own """
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function)
+        finally:
+            with self._lock:
+                self.loads.append(profiler)
+
+    def dump(self) -> bytes:
+        """ The profile in the format of pstats.Stats.dump_stats """
+
+        stats = pstats.Stats(self.profiler, stream=io.StringIO())
+        with self._lock:
+            for profiler in self.loads:
+                stats.add(profiler)
+        return marshal.dumps(stats.stats)
+
+
+# The interaction a callback's code runs in, for the loads it awaits
+current: ContextVar[Optional[Interaction]] = ContextVar('covid19_interaction', default=None)
+
+# The SLOWEST profiles kept, a heap of (seconds, order, interaction, profile), the fastest first
+slowest: List[tuple] = []
+_order = itertools.count()
+_slowest_lock = threading.Lock()
+
+
+def _session() -> str:
+    session_context = getattr(pn.state.curdoc, 'session_context', None)
+    if session_context is None:
+        return 'nosession'
+    return hashlib.sha256(session_context.id.encode()).hexdigest()[:SESSION_DIGITS]
+
+
+def _parameters(function: Callable, args: tuple, kwargs: dict) -> Dict[str, Any]:
+    if args and hasattr(args[0], 'param') and hasattr(args[0].param, 'method_dependencies'):
+        # A method of a parameterized viewer, called without arguments: the parameters it depends on
+        owner = args[0]
+        return {dependency.name: getattr(owner, dependency.name)
+                for dependency in owner.param.method_dependencies(function.__name__)
+               }
+    return dict(inspect.signature(function).bind(*args, **kwargs).arguments)
+
+
+def _keep(interaction: Interaction) -> None:
+    profile: bytes = interaction.dump()
+    try:
+        os.makedirs(DIRECTORY, exist_ok=True)
+        with open(os.path.join(DIRECTORY, interaction.name), 'wb') as f:
+            f.write(profile)
+    except OSError:
+        logger.exception('Could not write the profile %s', interaction.name)
+    with _slowest_lock:
+        entry: tuple = (interaction.seconds, next(_order), interaction, profile)
+        if len(slowest) < SLOWEST:
+            heapq.heappush(slowest, entry)
+        elif slowest and entry[0] > slowest[0][0]:
+            heapq.heapreplace(slowest, entry)
+
+
+class _ProfiledCoroutine:
+    """ Awaits a coroutine, profiling each of its steps and none of what the event loop runs in between """
+
+    def __init__(self, coroutine, interaction: Interaction):
+        self.coroutine = coroutine
+        self.interaction = interaction
+
+    def __await__(self) -> Generator:
+        value: Any = None
+        error: Optional[BaseException] = None
+        while True:
+            token = current.set(self.interaction)
+            self.interaction.profiler.enable()
+            try:
+                yielded = self.coroutine.throw(error) if error is not None else self.coroutine.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.interaction.profiler.disable()
+                current.reset(token)
+            try:
+                value, error = (yield yielded), None
+            except BaseException as e:
+                # e.g. the task is cancelled by a newer call of the callback
+                value, error = None, e
+
+
+def profiled(function: Callable, name: str) -> Callable:
+    """Function that returns function, a callback or coroutine callback, profiled under name in
+    profiling mode, see the module docstring"""
+
+    def interaction(args: tuple, kwargs: dict) -> Optional[Interaction]:
+        # A callback called by another is part of its caller's profile
+        if not ENABLED or current.get() is not None:
+            return None
+        return Interaction(name, _session(), _parameters(function, args, kwargs))
+
+    if inspect.iscoroutinefunction(function):
+        async def wrapper(*args, **kwargs):
+            profile: Optional[Interaction] = interaction(args, kwargs)
+            if profile is None:
+                return await function(*args, **kwargs)
+            start: float = time.perf_counter()
+            try:
+                return await _ProfiledCoroutine(function(*args, **kwargs), profile)
+            finally:
+                profile.seconds = time.perf_counter() - start
+                _keep(profile)
+    else:
+        def wrapper(*args, **kwargs):
+            profile: Optional[Interaction] = interaction(args, kwargs)
+            if profile is None:
+                return function(*args, **kwargs)
+            start: float = time.perf_counter()
+            token = current.set(profile)
+            try:
+                return profile.profiler.runcall(function, *args, **kwargs)
+            finally:
+                current.reset(token)
+                profile.seconds = time.perf_counter() - start
+                _keep(profile)
+    return wrapper
+
+
+class _AdminHandler(tornado.web.RequestHandler):
+
+    def prepare(self) -> None:
+        # routes() does not serve the handlers without a token, this is in case they are registered elsewhere
+        if not TOKEN:
+            raise tornado.web.HTTPError(403)
+        authorization: str = self.request.headers.get('Authorization', '')
+        given: str = self.get_query_argument('token', '') or authorization.partition('Bearer ')[2]
+        if not hmac.compare_digest(given.encode(), TOKEN.encode()):
+            raise tornado.web.HTTPError(403)
+
+
+class ProfilesHandler(_AdminHandler):
+    """ Lists the slowest profiles kept, slowest first """
+
+    def get(self) -> None:
+        with _slowest_lock:
+            entries: List[tuple] = sorted(slowest, reverse=True)
+        self.set_header('Content-Type', 'application/json')
+        self.set_header('Cache-Control', 'no-store')
+        self.write(json.dumps([{'name': interaction.name, 'url': f'{PREFIX}/{interaction.name}',
+                                'callback': interaction.callback, 'session': interaction.session,
+                                'parameters': {name: str(value) for name, value in interaction.parameters.items()},
+                                'started': interaction.started.isoformat(), 'seconds': round(seconds, 4),
+                                'bytes': len(profile)}
+                               for seconds, _, interaction, profile in entries
+                              ], indent=1))
+
+
+class ProfileHandler(_AdminHandler):
+    """ Serves one of the slowest profiles kept, as a .prof file """
+
+    def get(self, name: str) -> None:
+        with _slowest_lock:
+            profile: Optional[bytes] = next((profile for _, _, interaction, profile in slowest
+                                             if interaction.name == name), None)
+        if profile is None:
+            raise tornado.web.HTTPError(404)
+        self.set_header('Content-Type', 'application/octet-stream')
+        self.set_header('Content-Disposition', f'attachment; filename="{name}"')
+        self.write(profile)
+
+
+def routes() -> List[tuple]:
+    """Function that returns the Tornado routes of /admin/profiles, for pn.serve's extra_patterns, none
+    unless profiling is on and COVID19_ADMIN_TOKEN is set"""
+
+    if not ENABLED:
+        return []
+    logger.warning('Profiling every interaction to %s', DIRECTORY)
+    if not TOKEN:
+        # The profiles name the callbacks, parameters and sessions of the users, not for anyone to read
+        logger.error('Not serving %s, set COVID19_ADMIN_TOKEN to download the profiles', PREFIX)
+        return []
+    return [(PREFIX, ProfilesHandler), (PREFIX + r'/([^/]+\.prof)', ProfileHandler)]
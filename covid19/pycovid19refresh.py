@@ -0,0 +1,248 @@
+"""Background refresh of the COVID-19 data inside the pn.serve process
+
+JHU publish new counts about once a day, yet without a scheduler every interaction may end up
+revalidating, downloading and re-ingesting the upstream files.  start() instead runs a daemon
+thread that, every INTERVAL seconds:
+    1. revalidates every upstream file at the same time (see pycovid19cache.fetch_all), so a refresh
+       takes as long as the slowest file, and re-ingests the changed ones
+       (see pycovid19ingest), which writes new snapshots with an atomic rename.  A file upstream
+       keeps failing is used as cached, only a file that was never fetched fails the refresh
+    2. if anything changed, loads the datasets and rebuilds everything derived from them
+       (aggregate cubes, county index, state FIPS prefixes, simplified county geometry) off to the side,
+       and publishes it for every server process, unless another process already did (see
+       pycovid19shared).  Either way, the process attaches the published block
+    3. swaps the whole shared store at once (see DatasetStore.swap), so every session moves to the
+       new data version together and none ever mixes two versions, and drops the outputs rendered
+       from the previous version (see pycovid19render)
+    4. notifies the subscribers, i.e. the apps, which update their date bounds and re-render
+
+A refresh holds the lock of the shared directory, so that processes refreshing at the same time
+revalidate, download and rebuild once.  Processes that should not revalidate upstream at all, e.g.
+the workers of launcher.py whose parent runs the scheduler, start a follower instead: every
+FOLLOW_INTERVAL seconds it only checks the version counter of the shared directory and, if another
+process published a newer block, runs steps 3 and 4 with it (see follow).  Once the scheduler runs, sessions never revalidate upstream
+themselves and the store entries never expire, so no interaction waits on a download.  Only the scheduler runs the downloads and
+the rebuilds, in its own thread, so they never block the server's event loop either.
+
+Settings (environment variables):
+    COVID19_REFRESH_INTERVAL  seconds between two refreshes (default 3600)
+    COVID19_FOLLOW_INTERVAL   seconds between two checks of a follower for a new version (default 10)
+"""
+from datetime import date
+from typing import TypeVar, Any, Callable, Dict, Hashable, List, Optional, Tuple
+import logging
+import os
+import threading
+import weakref
+import panel as pn
+from pycovid19sources import GEOJSON_URL, METRICS, REGIONS, source_url
+import pycovid19cache
+import pycovid19cube
+import pycovid19geo
+import pycovid19ingest
+import pycovid19render
+import pycovid19shared
+import pycovid19store
+# These are related to optional type annotations
+Document = TypeVar('bokeh.document.Document')
+
+logger = logging.getLogger(__name__)
+
+INTERVAL: float = float(os.environ.get('COVID19_REFRESH_INTERVAL', 3600))
+FOLLOW_INTERVAL: float = float(os.environ.get('COVID19_FOLLOW_INTERVAL', 10))
+
+# Version of the data swapped in, the same in every process (see pycovid19shared), 0 until the first
+# refresh completes
+version: int = 0
+
+# How each upstream file was fetched by the latest refresh, by URL
+fetches: Dict[str, pycovid19cache.FetchReport] = {}
+
+_fingerprint: Optional[tuple] = None
+_subscribers: List[Tuple[Callable[[], Optional[Callable]], Optional[Document]]] = []
+_subscribers_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def subscribe(callback: Callable[[], None]) -> None:
+    """Function that registers callback to be called after every data version swap
+    Parameters
+    ----------
+    callback : Callable
+        Called without arguments.  Only a weak reference is kept, so subscribing a session's
+        objects does not keep them alive.  If subscribed from within a session, as the dashboards'
+        factories do, callback runs on that session's document through add_next_tick_callback,
+        otherwise in the scheduler thread
+    """
+
+    reference = weakref.WeakMethod(callback) if hasattr(callback, '__self__') else weakref.ref(callback)
+    doc: Optional[Document] = pn.state.curdoc if pn.state.curdoc and pn.state.curdoc.session_context else None
+    with _subscribers_lock:
+        _subscribers.append((reference, doc))
+
+
+def _notify() -> None:
+    with _subscribers_lock:
+        alive = []
+        for reference, doc in _subscribers:
+            callback = reference()
+            if callback is None or (doc is not None and doc.session_context is None):
+                continue
+            alive.append((reference, doc))
+            try:
+                if doc is None:
+                    callback()
+                else:
+                    doc.add_next_tick_callback(callback)
+            except Exception:
+                logger.exception('Refresh subscriber %r failed', callback)
+        _subscribers[:] = alive
+
+
+def date_bounds(region: str) -> Tuple[date, date]:
+    """Function that returns the first and last dates of the current data of a region"""
+
+    dates = pycovid19cube.get_cube(region, 'Confirmed Cases').dates
+    return dates[0].date(), dates[-1].date()
+
+
+def rebuild() -> Dict[Hashable, Any]:
+    """Function that loads the current snapshots and builds everything derived from them,
+    without touching the shared store
+    Returns
+    -------
+    Dictionary of store entries, see pycovid19store, pycovid19cube and pycovid19geo for the keys
+    """
+
+    entries: Dict[Hashable, Any] = {}
+    for region in REGIONS:
+        for metric in METRICS:
+            df = pycovid19ingest.load(region, metric)
+            entries[(region, metric)] = df
+            entries[(region, metric, 'cube')] = pycovid19cube.build_cube(region, metric, df)
+            if region == 'US':
+                entries[(region, metric, 'counties')] = pycovid19cube.build_county_index(metric, df)
+    entries[('US', 'state_fips')] = pycovid19geo.state_fips_prefixes(entries[('US', 'Confirmed Cases')])
+    for tolerance in pycovid19geo.TOLERANCES:
+        entries[('GeoJSON', 'by_state', tolerance)] = pycovid19geo.split_by_state(pycovid19geo.load_counties(tolerance))
+
+    return entries
+
+
+def refresh() -> bool:
+    """Function that revalidates the upstream data and, if it changed, swaps in the new version
+    and notifies the subscribers
+    Returns
+    -------
+    True if a new data version was swapped in
+    """
+
+    global version, fetches, _fingerprint
+
+    with _refresh_lock, pycovid19shared.lock():
+        # Revalidate and re-ingest, the snapshots and simplified geometry are only rewritten if
+        # their source changed
+        fetches = pycovid19cache.fetch_all([source_url(region, metric) for region in REGIONS for metric in METRICS]
+                                           + [GEOJSON_URL], max_age=0)
+        # Files upstream keeps failing are used as cached, only a file never fetched stops the refresh.
+        # The files fetched meanwhile are kept, the next run only downloads the missing ones
+        failed: List[pycovid19cache.FetchReport] = [report for report in fetches.values() if report.status == 'failed']
+        if failed:
+            raise failed[0].error
+        paths: List[str] = [pycovid19ingest.ingest(region, metric) for region in REGIONS for metric in METRICS]
+        paths += [pycovid19geo.geometry_path(tolerance) for tolerance in pycovid19geo.TOLERANCES]
+
+        # A block built by code deriving other layers from the same files is built again, see pycovid19cube
+        fingerprint: tuple = tuple((path, os.path.getmtime(path)) for path in paths) + (pycovid19cube.LAYERS,)
+        if fingerprint == _fingerprint:
+            logger.info('Data unchanged upstream, keeping version %d', version)
+            return False
+
+        # The first process to see this data builds it, the others find it published
+        if pycovid19shared.fingerprint() != fingerprint:
+            pycovid19shared.publish(rebuild(), fingerprint)
+        # The publisher too serves the views of the block, its own copy is dropped
+        entries: Dict[Hashable, Any]
+        version, entries = pycovid19shared.attach()
+        pycovid19store.store.swap(entries)
+        # The charts and tables rendered from the previous version go with it
+        pycovid19render.invalidate(version)
+        _fingerprint = fingerprint
+        logger.info('Swapped in data version %d', version)
+
+    _notify()
+    return True
+
+
+def follow() -> bool:
+    """Function that swaps in the latest data version another process published, if it is newer than
+    the one served, and notifies the subscribers.  Nothing is revalidated, downloaded or built
+    Returns
+    -------
+    True if a new data version was swapped in
+    """
+
+    global version
+
+    # Cheap enough to run often: the counter is read without the lock, which is only taken, so that
+    # the block is not removed meanwhile, to attach a new version
+    if pycovid19shared.current() <= version:
+        return False
+    with _refresh_lock, pycovid19shared.lock():
+        entries: Dict[Hashable, Any]
+        version, entries = pycovid19shared.attach()
+        pycovid19store.store.swap(entries)
+        pycovid19render.invalidate(version)
+        logger.info('Swapped in data version %d, published by another process', version)
+
+    _notify()
+    return True
+
+
+def _run(step: Callable[[], bool], interval: float) -> None:
+    while not _stop.is_set():
+        try:
+            step()
+        except Exception:
+            # Sessions keep being served the current version, the next run tries again
+            logger.exception('Data refresh failed')
+        _stop.wait(interval)
+
+
+def start(interval: Optional[float] = None, follower: bool = False) -> threading.Thread:
+    """Function that starts the refresh scheduler, a first refresh running right away
+    Parameters
+    ----------
+    interval : float
+        Seconds between two refreshes (default=INTERVAL, FOLLOW_INTERVAL for a follower)
+    follower : bool
+        Only follow the versions other processes publish instead of refreshing, see follow (default=False)
+    Returns
+    -------
+    The scheduler's daemon thread
+    """
+
+    global _thread
+
+    if _thread is not None and _thread.is_alive():
+        return _thread
+
+    # From now on only the scheduler revalidates the upstream files and replaces the datasets
+    pycovid19cache.MAX_AGE = float('inf')
+    pycovid19store.store.ttl = float('inf')
+
+    _stop.clear()
+    if interval is None:
+        interval = FOLLOW_INTERVAL if follower else INTERVAL
+    _thread = threading.Thread(target=_run, args=(follow if follower else refresh, interval),
+                               name='covid19-follow' if follower else 'covid19-refresh', daemon=True)
+    _thread.start()
+    return _thread
+
+
+def stop() -> None:
+    """Function that stops the refresh scheduler after its current run"""
+
+    _stop.set()
@@ -0,0 +1,127 @@
+"""Process-wide cache of the rendered outputs of the parameterized viewers, shared by every session
+
+Most users look at the same few views, e.g. Ohio, Confirmed Cases, the latest date and a linear
+scale, yet every session used to render them again.  Instead, the first session to show a view
+for some parameters renders it once as plain data, and every session showing the same view with
+the same parameters is given that data:
+    Vega-Lite spec  the line charts, see vega_spec
+    dataframe       the data of the tables, turned into a table by each session
+    figure dict     the Plotly maps, as returned by to_plotly_json
+The outputs are keyed on the view, its parameters normalized (a selection of states is the same
+whatever order it was picked in) and the version of the data they were rendered from.  A refresh
+swapping in a new version drops them all (see pycovid19refresh), otherwise they expire with the
+datasets they were rendered from (COVID19_STORE_TTL, see pycovid19store).  The cache is bounded in
+bytes, evicting least recently used outputs first.  Sessions asking for an output being rendered
+wait for it rather than render it again.  Outputs are shared, they must never be modified.
+
+Settings (environment variables):
+    COVID19_RENDER_MAX_MB  memory ceiling of the rendered outputs (default 64)
+"""
+from typing import TypeVar, Any, Callable, Dict, Hashable, Sequence, Tuple
+import copy
+import os
+import pycovid19endpoint
+import pycovid19store
+# These are related to optional type annotations
+DataFrame = TypeVar('pd.core.frame.DataFrame')
+Parameterized = TypeVar('param.Parameterized')
+TopLevelMixin = TypeVar('altair.vegalite.v4.api.TopLevelMixin')
+
+MAX_BYTES: int = int(float(os.environ.get('COVID19_RENDER_MAX_MB', 64)) * 2**20)
+
+# Rendered outputs by (view, parameters, data version)
+renders = pycovid19store.DatasetStore(max_bytes=MAX_BYTES)
+
+# Version of the data the outputs are rendered from, see invalidate
+version: int = 0
+
+
+def normalize(params: Dict[str, Any]) -> tuple:
+    """Function that returns the parameters of a view as a key, in name order, selections sorted"""
+
+    return tuple((name, tuple(sorted(value)) if isinstance(value, (list, tuple)) else value)
+                 for name, value in sorted(params.items()))
+
+
+class _Changed(Exception):
+    """ Raised by a render whose parameters changed while it ran, with what it rendered """
+
+    def __init__(self, output: Any):
+        super().__init__()
+        self.output = output
+
+
+def get(view: str, owner: Parameterized, params: Sequence[str], render: Callable[[], Any]) -> Any:
+    """Function that returns the output of a view for the current parameters of owner, rendered from
+    the current data by whichever session asked for it first
+    Parameters
+    ----------
+    view : str
+        Qualified name of the view, e.g. Covid19ViewerUS.plotlyChoropleth
+    owner : Parameterized
+        The viewer of the session
+    params : Sequence[str]
+        Every parameter of owner the output depends on
+    render : Callable
+        Called without arguments to render the output from the parameters of owner if it is not
+        cached yet, as plain data
+    Returns
+    -------
+    The output, shared by every session and therefore not to be modified
+    """
+
+    def key() -> Hashable:
+        return (view, normalize({name: getattr(owner, name) for name in params}), version)
+
+    rendered_for: Hashable = key()
+
+    def checked_render() -> Any:
+        output: Any = render()
+        # The session changed a parameter meanwhile, e.g. picked another state, part of the output may
+        # be from the new value.  It is only returned, to a callback about to be called again
+        if key() != rendered_for:
+            raise _Changed(output)
+        return output
+
+    try:
+        return renders.get(rendered_for, checked_render)
+    except _Changed as changed:
+        return changed.output
+
+
+def vega_spec(view: str, owner: Parameterized, params: Sequence[str],
+              render: Callable[[], Tuple[DataFrame, TopLevelMixin]]) -> dict:
+    """Function that returns the Vega-Lite spec of an Altair chart, see get
+    Parameters
+    ----------
+    view, owner, params : see get
+    render : Callable
+        Called without arguments to render the chart, returns its data and the chart
+    Returns
+    -------
+    A copy of the spec of its own, for the Vega pane
+    """
+
+    data, spec = get(view, owner, params, lambda: _spec(render))
+    # The chart references its data at the endpoint, which may have evicted it since
+    if pycovid19endpoint.enabled:
+        pycovid19endpoint.publish(data)
+    # The Vega pane takes the inline datasets out of the spec it is given, and may change other parts of it
+    # too.  Every session gets a copy down to the last nested dictionary, the cached spec is never shared
+    return copy.deepcopy(spec)
+
+
+def _spec(render: Callable[[], Tuple[DataFrame, TopLevelMixin]]) -> Tuple[DataFrame, dict]:
+    data, chart = render()
+    return data, chart.to_dict()
+
+
+def invalidate(data_version: int) -> None:
+    """Function that drops every output, rendered from a previous data version, and renders the
+    following ones from data_version"""
+
+    global version
+
+    version = data_version
+    # Outputs still being rendered from the previous data are not stored either, see DatasetStore.swap
+    renders.swap({})
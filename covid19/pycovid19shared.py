@@ -0,0 +1,181 @@
+"""Data of the COVID-19 apps published once for every server process, as memory-mapped blocks
+
+Each process serving the apps (e.g. the workers of launcher.py, or several `panel serve`) would
+otherwise build and hold its own copy of every dataset, cube and county index.  Instead, the first
+process to see a new version of the data builds it (see pycovid19refresh.rebuild) and publishes it
+as one block file, then every process attaches the block:
+    - the store entries are pickled with protocol 5, which hands the buffers of the numpy arrays,
+      i.e. the count matrices of the datasets (pandas blocks), cube layers and long-format values,
+      date indexes and county indexes, out of band.  The block holds the pickle followed by these
+      buffers, each aligned for numpy
+    - attaching maps the block read-only and unpickles it with the buffers pointing into the
+      mapping: the arrays are read-only views of the very same pages in every process, only the
+      small objects around them (categories, entity names, GeoJSON dictionaries) are copied
+    - blocks are numbered by a version counter.  A new block is written under a temporary name and
+      renamed, and only then is the counter file replaced, so a process reading the counter always
+      finds a complete block.  Processes move to the new block on their next refresh; the previous
+      one stays mapped, and its pages valid, until the last view of it is dropped, even once its
+      file has been removed
+Publishing and attaching run under an exclusive lock on the directory, so processes refreshing at
+the same time download and build a new version once.
+
+Settings (environment variables):
+    COVID19_SHARED_DIR  where the blocks live (default the shared directory of the data cache).
+                        A tmpfs such as /dev/shm/covid19 keeps them off the disk
+"""
+from contextlib import contextmanager
+from typing import TypeVar, Any, Dict, Hashable, Iterator, List, Optional, Tuple
+import logging
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import pycovid19cache
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows, where processes refreshing at the same time may each publish a version
+    fcntl = None
+# These are related to optional type annotations
+Path = TypeVar('str')
+
+logger = logging.getLogger(__name__)
+
+DIRECTORY: Path = os.environ.get('COVID19_SHARED_DIR', os.path.join(pycovid19cache.CACHE_DIR, 'shared'))
+# Alignment of every buffer in a block, enough for any numpy dtype and a cache line
+ALIGNMENT = 64
+# The trailer of a block: the length of its header, which precedes the trailer
+TRAILER = struct.Struct('<Q')
+
+
+def _path(version: int) -> Path:
+    return os.path.join(DIRECTORY, f'block-{version}.bin')
+
+
+def _version_path() -> Path:
+    return os.path.join(DIRECTORY, 'VERSION')
+
+
+@contextmanager
+def lock() -> Iterator[None]:
+    """Function that holds the lock of the shared directory, across processes, while in the with block"""
+
+    os.makedirs(DIRECTORY, exist_ok=True)
+    with open(os.path.join(DIRECTORY, 'lock'), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def current() -> int:
+    """Function that returns the version of the latest block published, 0 if there is none"""
+
+    try:
+        with open(_version_path()) as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _header(block: mmap.mmap) -> Dict[str, Any]:
+    size: int = TRAILER.unpack_from(block, len(block) - TRAILER.size)[0]
+    return pickle.loads(block[len(block) - TRAILER.size - size:len(block) - TRAILER.size])
+
+
+def _map(version: int) -> mmap.mmap:
+    with open(_path(version), 'rb') as f:
+        # The mapping keeps its own reference to the file, which may be closed and even removed
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def fingerprint() -> Optional[tuple]:
+    """Function that returns the fingerprint of the source files the latest block was built from,
+    None if there is no block"""
+
+    version: int = current()
+    if version == 0:
+        return None
+    return _header(_map(version))['fingerprint']
+
+
+def publish(entries: Dict[Hashable, Any], fingerprint: tuple) -> int:
+    """Function that writes store entries to a new block and makes it the latest one
+    Parameters
+    ----------
+    entries : Dict[Hashable, Any]
+        Store entries, see pycovid19refresh.rebuild
+    fingerprint : tuple
+        Identifies the source files the entries were built from
+    Returns
+    -------
+    The version of the new block
+    """
+
+    buffers: List[pickle.PickleBuffer] = []
+    data: bytes = pickle.dumps(entries, protocol=5, buffer_callback=buffers.append)
+    version: int = current() + 1
+
+    os.makedirs(DIRECTORY, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=DIRECTORY, prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+        layout: List[Tuple[int, int]] = []
+        for buffer in buffers:
+            raw: memoryview = buffer.raw()
+            f.write(b'\0' * (-f.tell() % ALIGNMENT))
+            layout.append((f.tell(), raw.nbytes))
+            f.write(raw)
+        header: bytes = pickle.dumps({'version': version, 'fingerprint': fingerprint,
+                                      'data': (0, len(data)), 'buffers': layout})
+        f.write(header)
+        f.write(TRAILER.pack(len(header)))
+    os.replace(tmp, _path(version))
+
+    # Only now that the block is complete do readers of the counter get to see it
+    fd, tmp = tempfile.mkstemp(dir=DIRECTORY, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        f.write(str(version))
+    os.replace(tmp, _version_path())
+
+    # The previous block is left for processes still attaching it, older ones are only mapped, if at all
+    for name in os.listdir(DIRECTORY):
+        if name.startswith('block-') and int(name[len('block-'):-len('.bin')]) < version - 1:
+            try:
+                os.remove(os.path.join(DIRECTORY, name))
+            except OSError:
+                # Windows does not remove a file that is mapped
+                pass
+
+    logger.info('Published data version %d, %.1f MB', version, os.path.getsize(_path(version)) / 2**20)
+    return version
+
+
+def attach(version: Optional[int] = None) -> Tuple[int, Dict[Hashable, Any]]:
+    """Function that maps a block and returns its store entries, whose arrays are read-only views of it
+    Parameters
+    ----------
+    version : int
+        Version of the block (default=the latest one)
+    Returns
+    -------
+    Tuple of the version of the block and its store entries
+    """
+
+    version = version or current()
+    if version == 0:
+        raise ValueError(f'No data published in {DIRECTORY}')
+    block: mmap.mmap = _map(version)
+    header: Dict[str, Any] = _header(block)
+    view = memoryview(block)
+    start, size = header['data']
+    entries: Dict[Hashable, Any] = pickle.loads(view[start:start + size],
+                                                buffers=[view[offset:offset + nbytes]
+                                                         for offset, nbytes in header['buffers']
+                                                        ]
+                                               )
+    return version, entries
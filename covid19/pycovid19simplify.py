@@ -0,0 +1,186 @@
+"""Topology-preserving simplification of the county polygons
+
+Simplifying every county polygon on its own (e.g. Douglas-Peucker ring by ring) opens gaps and
+overlaps between neighbouring counties, since each side of a shared border is simplified
+differently.  As TopoJSON does, the rings are instead cut into arcs at their junctions, the
+vertices where the set of counties sharing the border changes from one edge to the next.  Every arc is simplified once, in
+a canonical direction, so the counties on either side of a border keep exactly the same vertices.
+Junctions are never removed, and the arcs of rings with fewer than three junctions keep some
+interior vertices, so that no ring collapses below a triangle.
+"""
+from typing import TypeVar, Dict, FrozenSet, List, Tuple
+import numpy as np
+# These are related to optional type annotations
+GeoJSON = TypeVar('dict')
+ndarray = TypeVar('numpy.ndarray')
+Point = Tuple[float, float]
+
+# Decimals kept in the simplified coordinates, 1e-5 degrees is about 1 meter
+DECIMALS = 5
+
+
+def _distances(points: ndarray, start: ndarray, end: ndarray) -> ndarray:
+    # Distance of every point to the segment start-end (to start if the segment is a point)
+    direction: ndarray = end - start
+    length2: float = float(direction @ direction)
+    if length2 == 0:
+        return np.hypot(*(points - start).T)
+    t: ndarray = np.clip((points - start) @ direction / length2, 0, 1)
+    return np.hypot(*(points - (start + t[:, None] * direction)).T)
+
+
+def douglas_peucker(points: ndarray, tolerance: float, min_depth: int = 1) -> ndarray:
+    """Function that returns which vertices of a line Douglas-Peucker keeps
+    Parameters
+    ----------
+    points : ndarray
+        n x 2 array of [lon, lat] positions
+    tolerance : float
+        Largest distance in degrees a removed vertex may lie from the simplified line
+    min_depth : int
+        Number of recursion levels that split at the farthest vertex whatever its distance,
+        so that short closed arcs keep enough vertices to remain polygons
+    Returns
+    -------
+    Boolean mask of the vertices kept, always including both ends
+    """
+
+    keep: ndarray = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack: List[Tuple[int, int, int]] = [(0, len(points) - 1, 0)]
+    while stack:
+        first, last, depth = stack.pop()
+        if last - first < 2:
+            continue
+        distances: ndarray = _distances(points[first + 1:last], points[first], points[last])
+        farthest: int = int(np.argmax(distances))
+        if distances[farthest] > tolerance or depth < min_depth:
+            middle: int = first + 1 + farthest
+            keep[middle] = True
+            stack += [(first, middle, depth + 1), (middle, last, depth + 1)]
+
+    return keep
+
+
+def _rings(geometry: dict) -> List[list]:
+    # Every ring of a Polygon or MultiPolygon, as the lists stored in the geometry
+    if geometry['type'] == 'Polygon':
+        return list(geometry['coordinates'])
+    if geometry['type'] == 'MultiPolygon':
+        return [ring for polygon in geometry['coordinates'] for ring in polygon]
+    return []
+
+
+def _open_ring(ring: list) -> List[Point]:
+    points: List[Point] = [(position[0], position[1]) for position in ring]
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    return points
+
+
+def find_junctions(rings: List[List[Point]]) -> set:
+    """Function that returns the vertices where a ring's shared border begins or ends
+    Parameters
+    ----------
+    rings : List[List[Point]]
+        Open rings (without the closing vertex) of every polygon
+    Returns
+    -------
+    Set of the junction vertices
+    """
+
+    junctions: set = set()
+    # Rings going through every edge, whatever the direction they go through it
+    owners: Dict[Tuple[Point, Point], set] = {}
+    for i, ring in enumerate(rings):
+        visited: set = set()
+        for point, following in zip(ring, ring[1:] + ring[:1]):
+            # A ring going twice through the same vertex is pinched there
+            if point in visited:
+                junctions.add(point)
+            visited.add(point)
+            owners.setdefault((point, following) if point < following else (following, point), set()).add(i)
+
+    edges: Dict[Tuple[Point, Point], FrozenSet[int]] = {edge: frozenset(ring_ids) for edge, ring_ids in owners.items()}
+    for ring in rings:
+        for previous, point, following in zip(ring[-1:] + ring[:-1], ring, ring[1:] + ring[:1]):
+            before: FrozenSet[int] = edges[(previous, point) if previous < point else (point, previous)]
+            after: FrozenSet[int] = edges[(point, following) if point < following else (following, point)]
+            if before != after:
+                junctions.add(point)
+
+    return junctions
+
+
+def _canonical(arc: List[Point]) -> Tuple[tuple, bool]:
+    # Every arc is simplified in a canonical direction, so both rings sharing it get the same vertices
+    reverse: bool = (arc[-1], arc[-2]) < (arc[0], arc[1])
+    return tuple(arc[::-1] if reverse else arc), reverse
+
+
+def _split_ring(ring: List[Point], junctions: set) -> List[List[Point]]:
+    # Arcs of an open ring, in ring order, each starting and ending at a junction
+    cuts: List[int] = [i for i, point in enumerate(ring) if point in junctions]
+    if not cuts:
+        # An island or an enclave, its only arc starts at its smallest vertex whatever the ring's start
+        cuts = [ring.index(min(ring))]
+    ring = ring[cuts[0]:] + ring[:cuts[0]]
+    cuts = [cut - cuts[0] for cut in cuts] + [len(ring)]
+
+    closed_ring: List[Point] = ring + ring[:1]
+    return [closed_ring[first:last + 1] for first, last in zip(cuts[:-1], cuts[1:])]
+
+
+def simplify(geo_data: GeoJSON, tolerance: float) -> GeoJSON:
+    """Function that simplifies a polygon FeatureCollection without opening gaps between neighbours
+    Parameters
+    ----------
+    geo_data : dict
+        FeatureCollection of Polygon/MultiPolygon features, e.g. the plotly county GeoJSON
+    tolerance : float
+        Douglas-Peucker tolerance in degrees
+    Returns
+    -------
+    New FeatureCollection with the same features (ids, properties) and simplified geometries
+    """
+
+    rings: List[List[Point]] = [_open_ring(ring)
+                                for feature in geo_data['features']
+                                for ring in _rings(feature['geometry'])
+                               ]
+    junctions: set = find_junctions(rings)
+    ring_arcs: List[List[List[Point]]] = [_split_ring(ring, junctions) if len(ring) > 3 else [ring + ring[:1]]
+                                          for ring in rings
+                                         ]
+
+    # A ring cut into fewer than 3 arcs would collapse to a line if its arcs kept their ends only
+    short_rings: set = {_canonical(arc)[0] for arcs in ring_arcs if len(arcs) < 3 for arc in arcs}
+    simplified_arcs: Dict[tuple, List[Point]] = {}
+
+    def simplify_ring(arcs: List[List[Point]]) -> List[list]:
+        ring: List[Point] = []
+        for arc in arcs:
+            key, reverse = _canonical(arc)
+            if key not in simplified_arcs:
+                min_depth: int = 0
+                if key in short_rings:
+                    min_depth = 2 if key[0] == key[-1] else 1
+                keep: ndarray = douglas_peucker(np.array(key), tolerance, min_depth)
+                simplified_arcs[key] = [key[i] for i in np.flatnonzero(keep)]
+            ring += (simplified_arcs[key][::-1] if reverse else simplified_arcs[key])[:-1]
+        ring.append(ring[0])
+        return [[round(x, DECIMALS), round(y, DECIMALS)] for x, y in ring]
+
+    simplified_rings = iter([simplify_ring(arcs) for arcs in ring_arcs])
+    features: List[dict] = []
+    for feature in geo_data['features']:
+        geometry: dict = feature['geometry']
+        if geometry['type'] == 'Polygon':
+            coordinates: list = [next(simplified_rings) for _ in geometry['coordinates']]
+        elif geometry['type'] == 'MultiPolygon':
+            coordinates = [[next(simplified_rings) for _ in polygon] for polygon in geometry['coordinates']]
+        else:
+            coordinates = geometry['coordinates']
+        features.append({**feature, 'geometry': {'type': geometry['type'], 'coordinates': coordinates}})
+
+    return {**geo_data, 'features': features}
@@ -0,0 +1,45 @@
+from typing import TypeVar
+import os
+# These are related to optional type annotations
+Url = TypeVar('str')
+
+# Source of data is from John Hopkins University GitHub repo.  Both base URLs can be pointed at a
+# local HTTP stand-in (e.g. "python -m http.server" in a directory of JHU-shaped CSVs) through
+# environment variables, which is how the apps are exercised without network access
+JHU_BASE_URL: Url = os.environ.get('COVID19_JHU_BASE_URL',
+                                   'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/'
+                                   'master/csse_covid_19_data/csse_covid_19_time_series/'
+                                  )
+GEOJSON_URL: Url = os.environ.get('COVID19_GEOJSON_URL',
+                                  'https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json'
+                                 )
+
+REGIONS = ('US', 'Global')
+METRICS = ('Confirmed Cases', 'Deaths')
+
+_FILE_NAMES = {('US', 'Confirmed Cases'): 'time_series_covid19_confirmed_US.csv',
+               ('US', 'Deaths'): 'time_series_covid19_deaths_US.csv',
+               ('Global', 'Confirmed Cases'): 'time_series_covid19_confirmed_global.csv',
+               ('Global', 'Deaths'): 'time_series_covid19_deaths_global.csv'
+              }
+
+
+def source_url(region: str, metric: str) -> Url:
+    """Function that returns the URL of a JHU time-series CSV
+    Parameters
+    ----------
+    region : str
+        'US' for the county level US file or 'Global' for the country level file
+    metric : str
+        'Confirmed Cases' or 'Deaths'
+    Returns
+    -------
+    URL of the CSV file
+    """
+
+    try:
+        file_name: str = _FILE_NAMES[(region, metric)]
+    except KeyError:
+        raise ValueError(f'No JHU time series for region={region!r}, metric={metric!r}') from None
+
+    return JHU_BASE_URL.rstrip('/') + '/' + file_name
@@ -0,0 +1,229 @@
+"""Process-wide in-memory store of the datasets behind the COVID-19 apps
+
+Python imports a module once per process, so the store below is shared by every Panel
+session and every callback of both apps served by one pn.serve process.  Entries are keyed
+by (region, metric), e.g. ('US', 'Deaths'), expire after a TTL and are evicted least recently
+used first once the store grows past its memory ceiling.  Memory therefore grows with the
+number of datasets, not with the number of connected users.  A background refresh (see
+pycovid19refresh) replaces the whole content at once with swap().
+
+Settings (environment variables):
+    COVID19_STORE_TTL     seconds an entry is served before it is reloaded (default 600)
+    COVID19_STORE_MAX_MB  memory ceiling of the store in megabytes (default 512)
+"""
+from collections import OrderedDict
+from typing import TypeVar, Any, Callable, Dict, Hashable, Optional
+import os
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pycovid19ingest
+# These are related to optional type annotations
+DataFrame = TypeVar('pd.core.frame.DataFrame')
+
+TTL: float = float(os.environ.get('COVID19_STORE_TTL', 600))
+MAX_BYTES: int = int(float(os.environ.get('COVID19_STORE_MAX_MB', 512)) * 2**20)
+
+# Returned by a lookup that finds nothing, unlike None, which may well be a stored value
+_MISSING = object()
+
+
+def sizeof(value: Any) -> int:
+    """Function that returns an estimate of the memory used by value in bytes"""
+
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, str)):
+        return sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+class SizedDict(dict):
+    """ A dictionary of nested plain objects, e.g. parsed GeoJSON, whose size is estimated once when
+        it is built, rather than walked again every time it is stored.  Like every stored value it
+        must be treated as read-only, its size is not updated.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Walked as a plain dictionary, nbytes not being set yet
+        self.nbytes: int = sizeof(self)
+
+
+class DatasetStore:
+    """ A thread-safe key/value store with a TTL, a memory ceiling with LRU eviction and
+        hit/miss counters.  Values must be treated as read-only by callers since they are
+        shared between sessions.
+    """
+
+    def __init__(self, ttl: float = TTL, max_bytes: int = MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        # Bumped by every swap, so that a value loaded from the previous data is not stored afterwards
+        self.generation = 0
+        # key -> (expires at, size in bytes, value), ordered from least to most recently used
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.RLock()
+        self._loading: Dict[Hashable, threading.Lock] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, loader: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """Function that returns the value stored under key, calling loader to create it
+        when it is missing or expired
+        Parameters
+        ----------
+        key : Hashable
+            For datasets a (region, metric) tuple such as ('US', 'Deaths')
+        loader : Callable
+            Called without arguments to create the value on a miss
+        ttl : float
+            Seconds the new value is served for (default=the store's ttl)
+        Returns
+        -------
+        The stored value
+        """
+
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                return value
+            loading: threading.Lock = self._loading.setdefault(key, threading.Lock())
+
+        # Only one session loads a given key, the others wait for it and then hit
+        try:
+            with loading:
+                with self._lock:
+                    value = self._lookup(key, count_miss=True)
+                    if value is not _MISSING:
+                        return value
+                    generation: int = self.generation
+                value = loader()
+                with self._lock:
+                    if generation == self.generation:
+                        self.put(key, value, ttl)
+        finally:
+            # Also when the loader failed, the next get tries again with a lock of its own
+            with self._lock:
+                if self._loading.get(key) is loading:
+                    del self._loading[key]
+
+        return value
+
+    def _lookup(self, key: Hashable, count_miss: bool = False) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+        if count_miss:
+            self.misses += 1
+        return _MISSING
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Function that stores value under key, evicting least recently used entries
+        until the store fits under its memory ceiling again"""
+
+        size: int = sizeof(value)
+        expires: float = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (expires, size, value)
+            self.nbytes += size
+            # Never evict the entry just stored, even if it alone is over the ceiling
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def _discard(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Function that drops key from the store, or every entry if key is None"""
+
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self.nbytes = 0
+            else:
+                self._discard(key)
+
+    def swap(self, entries: Dict[Hashable, Any], ttl: Optional[float] = None) -> None:
+        """Function that atomically replaces the whole content of the store by entries, so that
+        no reader ever mixes values derived from two versions of the data
+        Parameters
+        ----------
+        entries : Dict[Hashable, Any]
+            New values by key, every other key is dropped and reloaded on its next get
+        ttl : float
+            Seconds the new values are served for (default=the store's ttl)
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.generation += 1
+            for key, value in entries.items():
+                self.put(key, value, ttl)
+
+    def stats(self) -> Dict[str, Any]:
+        """Function that returns the counters of the store"""
+
+        with self._lock:
+            lookups: int = self.hits + self.misses
+            return {'entries': len(self._entries),
+                    'bytes': self.nbytes,
+                    'max_bytes': self.max_bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'generation': self.generation,
+                    'hit_rate': self.hits / lookups if lookups else 0.0
+                   }
+
+
+# The one store shared by every session in this process
+store = DatasetStore()
+
+
+def get_dataset(region: str, metric: str) -> DataFrame:
+    """Function that returns the JHU time series of a region and metric, shared by every session
+    Parameters
+    ----------
+    region : str
+        'US' or 'Global'
+    metric : str
+        'Confirmed Cases' or 'Deaths'
+    Returns
+    -------
+    Pandas dataframe with int32 counts and categorical key columns, shared and therefore
+    not to be modified in place
+    """
+
+    # Loaded from the memory-mapped Parquet snapshot, see pycovid19ingest
+    return store.get((region, metric), lambda: pycovid19ingest.load(region, metric))
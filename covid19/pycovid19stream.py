@@ -0,0 +1,162 @@
+"""Line chart of counts by state/country that only ships what changed to the browser
+
+A reactive function returning a new hvplot chart on every widget change re-sends every series:
+adding a state to the selection transfers the data of all the states already drawn once again.
+StreamingLineChart instead keeps one Bokeh ColumnDataSource per session, a Date column and one
+column per entity, and brings it up to date in place:
+    entity added         its column is set (only that column is sent) and a line is added
+    entity removed       its line is removed, its column is kept so that adding it back costs nothing
+    later date           the new days are appended with ColumnDataSource.stream
+    new data version     counts revised upstream are patched with ColumnDataSource.patch and the
+                         new days are streamed
+    log scale toggled    a new figure is drawn from the same source, which the browser already has
+Only a new metric or measure, an earlier date or too many hidden entities replace the whole source.
+
+The chart holds session state, so every session needs its own, see pycovid19usStream.
+"""
+from collections import Counter
+from typing import TypeVar, Dict, List, Optional, Sequence
+import numpy as np
+import panel as pn
+from bokeh.models import ColumnDataSource, HoverTool, NumeralTickFormatter
+from bokeh.palettes import Category20
+from bokeh.plotting import figure
+import pycovid19cube
+# These are related to optional type annotations
+AggregateCube = TypeVar('pycovid19cube.AggregateCube')
+Date = TypeVar('datetime.date')
+Figure = TypeVar('bokeh.plotting.figure')
+ndarray = TypeVar('numpy.ndarray')
+
+# Columns of hidden entities kept in the source before it is rebuilt without them
+MAX_HIDDEN = 10
+
+
+class StreamingLineChart:
+    """ Line chart of a measure of the counts of a few states or countries, updated in place """
+
+    def __init__(self, region: str, width: int = 700, height: int = 500):
+        self.region = region
+        self.width = width
+        self.height = height
+        self.source = ColumnDataSource(data={'Date': np.array([], dtype='datetime64[ns]')})
+        self.metric: Optional[str] = None
+        self.measure = 'Cumulative'
+        self.log = False
+        # Entities drawn, in the order they were selected
+        self.shown: List[str] = []
+        # Number of updates of each kind sent to the browser: reset, column, stream, patch, figure
+        self.operations: Counter = Counter()
+        self.figure: Figure = self._figure()
+        self.pane = pn.pane.Bokeh(self.figure)
+
+    def _figure(self) -> Figure:
+        fig: Figure = figure(title='COVID-19 ' + (self.metric or ''), x_axis_type='datetime',
+                             y_axis_type='log' if self.log else 'linear',
+                             width=self.width, height=self.height, x_axis_label='Date',
+                             y_axis_label=pycovid19cube.measure_title(self.measure, self.metric or ''),
+                             tools='pan,wheel_zoom,box_zoom,reset,save'
+                            )
+        fig.add_tools(HoverTool(tooltips=[('', '$name'), ('Date', '@Date{%F}'), ('Qty', '$snap_y{0,0}')],
+                                formatters={'@Date': 'datetime'}
+                               ))
+        if not self.log:
+            fig.yaxis.formatter = NumeralTickFormatter(format='0,0')
+        return fig
+
+    def _color(self, entity: str, cube: AggregateCube) -> str:
+        # Stable per entity, whatever else is selected
+        return Category20[20][cube.columns([entity])[0] % 20]
+
+    def _add_line(self, entity: str, cube: AggregateCube) -> None:
+        self.figure.line(x='Date', y=entity, source=self.source, name=entity, legend_label=entity,
+                         line_width=2, color=self._color(entity, cube)
+                        )
+        self.figure.legend.location = 'top_left'
+        self.figure.legend.click_policy = 'hide'
+
+    def _remove_line(self, entity: str) -> None:
+        self.figure.renderers = [renderer for renderer in self.figure.renderers if renderer.name != entity]
+        for legend in self.figure.legend:
+            legend.items = [item for item in legend.items if entity not in [renderer.name for renderer in item.renderers]]
+
+    def _sync_source(self, cube: AggregateCube, entities: Sequence[str], end: Optional[Date], layer: str,
+                     reset: bool) -> None:
+        rows: slice = cube.rows(end)
+        dates: ndarray = cube.dates[rows].to_numpy()
+        counts: ndarray = cube.layers[layer][rows]
+
+        def values(entity: str) -> ndarray:
+            return counts[:, cube.columns([entity])[0]]
+
+        old_dates: ndarray = self.source.data['Date']
+        kept: List[str] = [column for column in self.source.data if column != 'Date']
+        added: List[str] = [entity for entity in entities if entity not in self.source.data]
+        reset = (reset
+                 or len(dates) < len(old_dates)
+                 or not np.array_equal(dates[:len(old_dates)], old_dates)
+                 or len(cube.columns(kept)) < len(kept)
+                 or len(kept) - len(self.shown) > MAX_HIDDEN
+                )
+        if reset:
+            self.source.data = {'Date': dates, **{entity: values(entity) for entity in entities}}
+            self.operations['reset'] += 1
+            return
+
+        # Counts of the dates already sent that were revised by a new data version
+        patches: Dict[str, list] = {}
+        for column in kept:
+            old: ndarray = self.source.data[column]
+            new: ndarray = values(column)[:len(old)]
+            # The growth rate and doubling time are NaN where undefined, those did not change
+            changed: ndarray = np.flatnonzero((old != new) & ~(np.isnan(old) & np.isnan(new)))
+            if len(changed):
+                patches[column] = list(zip(changed.tolist(), new[changed].tolist()))
+        if patches:
+            self.source.patch(patches)
+            self.operations['patch'] += 1
+        # Days after the ones already sent
+        if len(dates) > len(old_dates):
+            self.source.stream({'Date': dates[len(old_dates):],
+                                **{column: values(column)[len(old_dates):] for column in kept}
+                               })
+            self.operations['stream'] += 1
+        for entity in added:
+            self.source.data[entity] = values(entity)
+            self.operations['column'] += 1
+
+    def update(self, entities: Sequence[str], end: Optional[Date], metric: str, log: bool = False,
+               measure: str = 'Cumulative') -> None:
+        """Function that brings the chart up to date, sending the browser only what changed
+        Parameters
+        ----------
+        entities : Sequence[str]
+            States or countries to draw, unknown ones are left out
+        end : Date
+            Last date to draw (default=the latest date)
+        metric : str
+            'Confirmed Cases' or 'Deaths'
+        log : bool
+            Whether to use a log scale on the y-axis
+        measure : str
+            One of pycovid19cube.MEASURES
+        """
+
+        cube: AggregateCube = pycovid19cube.get_cube(self.region, metric)
+        entities = [entity for entity in entities if cube.columns([entity])]
+        self._sync_source(cube, entities, end, pycovid19cube.MEASURES[measure],
+                          reset=metric != self.metric or measure != self.measure)
+
+        if metric != self.metric or measure != self.measure or log != self.log:
+            self.metric, self.measure, self.log = metric, measure, log
+            self.figure, self.shown = self._figure(), []
+            self.operations['figure'] += 1
+        for entity in self.shown:
+            if entity not in entities:
+                self._remove_line(entity)
+        for entity in entities:
+            if entity not in self.shown:
+                self._add_line(entity, cube)
+        self.shown = list(entities)
+        if self.pane.object is not self.figure:
+            self.pane.object = self.figure
@@ -1,15 +1,17 @@
 from datetime import date
-from datetime import datetime
 from datetime import timedelta
 from typing import TypeVar, List
-from urllib.request import urlopen
-import hvplot.pandas
-import json
-import numpy as np
-import pandas as pd
+import hvplot.pandas  # noqa: F401, adds the .hvplot accessor used below
 import panel as pn
 import platform
 import plotly.express as px
+import pycovid19async
+import pycovid19cube
+import pycovid19geo
+import pycovid19ingest
+import pycovid19metrics
+import pycovid19refresh
+import pycovid19store
 # These are related to optional type annotations
 DataFrame = TypeVar('pd.core.frame.DataFrame')
 Date = TypeVar('datetime.date')
@@ -35,25 +37,9 @@ css = '''
 pn.config.raw_css.clear()
 pn.config.raw_css.append(css)
 
-# Source of data is from John Hopkins University GitHub repo
-url: str = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv'
-df: DataFrame = pd.read_csv(url)
-
-# Create input widgets: date widget, multi-choice, and selection widgets
-# Make default date yesterday (today minus 1 day) since COVID-19 data is usually 1 day behind
-states_provinces: List[str] = df['Province_State'].unique().tolist()
-covid19_date: DatePicker = pn.widgets.DatePicker(name='Date:', value=(date.today() + timedelta(days=-1)),
-                                                 width=200, css_classes=['grey-theme']
-                                                )
-state_province = pn.widgets.MultiChoice(name='State:', value=['Ohio'],
-    options=states_provinces)
-confirmed_deaths = pn.widgets.Select(name='Confirmed Cases or Deaths:', value='Confirmed Cases',
-                                     options=['Confirmed Cases', 'Deaths'],
-                                     width=200, css_classes=['grey-theme'])
-ylog = pn.widgets.Select(name='log-y?', value=False, options=[True, False], width=200, css_classes=['grey-theme'])
-
-@pn.depends(covid19_date.param.value, state_province.param.value, confirmed_deaths.param.value, ylog.param.value)
-def covid19TimeSeriesByState(covid19_date: Date, state_province: List[str], confirmed_deaths: str, ylog: bool=False) -> Panel:
+@pycovid19metrics.timed
+async def covid19TimeSeriesByState(covid19_date: Date, state_province: List[str], confirmed_deaths: str, ylog: bool=False,
+                                   measure: str='Cumulative') -> Panel:
     """Function that returns a Panel dashboard displaying confirmed COVID-19 cases
     It is using Panel's "Reactive functions" API: https://panel.holoviz.org/user_guide/APIs.html
     Parameters
@@ -66,6 +52,8 @@ def covid19TimeSeriesByState(covid19_date: Date, state_province: List[str], conf
         Choose number of confirmed cases or number of deaths from Covid-19
     ylog : bool
         To enable log scaling or not on y-axis.  Log scale can be useful to easily discern growth rate.
+    measure : str
+        One of pycovid19cube.MEASURES, charted and added to the table by date (default='Cumulative')
     Returns
     -------
     Panel object
@@ -82,61 +70,46 @@ def covid19TimeSeriesByState(covid19_date: Date, state_province: List[str], conf
     elif 'Windows' in platform.system():
         data_date: str = date.fromisoformat(iso_date).strftime('%#m/%#d/%Y')
 
-    # Get geo json data of at state county level based on FIPS
-    with urlopen('https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json') as response:
-        geo_data = json.load(response)
+    # Source of COVID-19 data, shared by every session and with FIPS already zero-padded for Plotly, see pycovid19store.
+    # Loaded off the server's event loop, which keeps serving the other sessions meanwhile, see pycovid19async
+    df: DataFrame = await pycovid19async.run(pycovid19store.get_dataset, 'US', confirmed_deaths)
 
-    # Source of COVID-19 data
-    if confirmed_deaths == 'Confirmed Cases':
-        url: str = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv'
-    else:
-        url: str = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_US.csv'
-
-    # To leverage Plotly's choropleth_mapbox function, need to have FIPS as fixed length(n=5) values consisting of leading zeros
-    df: DataFrame = pd.read_csv(url, converters={'FIPS': lambda x: int(float(x)) if x != '' else x}).query("FIPS != ''")
-    df['FIPS']: Series = df['FIPS'].astype('str').str.zfill(5)
-    if 'Population' in df.columns:
-        df.drop(columns='Population', inplace=True)
-
-    df_by_state: DataFrame = (df.query("not Province_State in('Diamond Princess', 'Grand Princess')")
-                                .drop(columns=['UID', 'iso2', 'iso3', 'code3', 'FIPS', 'Admin2', 'Country_Region', 'Lat', 'Long_', 'Combined_Key'])
-                                .groupby('Province_State').agg('sum')
-                                .transpose()
-                             )
-    
-    # https://stackoverflow.com/questions/53052914/selecting-non-adjacent-columns-by-column-number-pandas
-    df_by_state_ts: DataFrame = df.iloc[:, np.r_[6, 11:df.shape[1]]].groupby('Province_State').agg('sum').transpose()
-    
-    df_by_counties: DataFrame = df.query("not Lat==0").iloc[:, [6, 10, -1]]
+    # Counts by state are aggregated once per data refresh, see pycovid19cube.  The cube's index is already
+    # an actual datetime data type for easier date filtering
+    cube = await pycovid19async.run(pycovid19cube.get_cube, 'US', confirmed_deaths)
+    # The metrics derived from the counts are computed along with them, the chart only picks one
+    layer: str = pycovid19cube.MEASURES[measure]
+    df_by_state: DataFrame = cube.frame(layer=layer)
+    ytitle: str = pycovid19cube.measure_title(measure, confirmed_deaths)
+    # Averages, growth rates and doubling times are not whole numbers
+    yformat: str = '%d' if layer in ('cumulative', 'daily') else '%.1f'
+
+    df_by_counties: DataFrame = df.query("not Lat==0")[['Province_State', 'Combined_Key', df.columns[-1]]]
     
-    df_choropleth: DataFrame = df.iloc[:, np.r_[4, 5, 6, df.shape[1]-1]]
+    df_choropleth: DataFrame = df[['FIPS', 'Admin2', 'Province_State', df.columns[-1]]]
     df_choropleth: DataFrame = df_choropleth.rename(columns={df_choropleth.columns[3]: 'Confirmed_Cases', 'Admin2': 'County'})
-        
-    # Make index an actual datetime data type for easier date filtering.
-    # So far JHU has been incosistent with their year format (YYYY vs YY)
-    # Therfore, have to account for either formats
-    try:
-        df_by_state.index: RangeIndex = [datetime.strptime(date, '%m/%d/%y') for date in df_by_state.index]
-    except ValueError as e:
-        print("YY year format not detected.  Using YYYY format instead.", e)
-        df_by_state.index: RangeIndex = [datetime.strptime(date, '%m/%d/%Y') for date in df_by_state.index]
 
     # If only one state is selected, then also provide data tables containing counts by counties, by date, and counties choropleth map
     if len(state_province) == 1:
+        # Only the counties of the selected state are sent to the browser, simplified for the zoom level
+        # that fits the state, see pycovid19geo
+        geo_data, center, zoom = await pycovid19async.run(pycovid19geo.state_map, state_province[0], width=1300, height=700)
+
         # Prepare/instantiate plotly's choropleth map at county level
-        fig: Figure = px.choropleth_mapbox(df_choropleth.query("Province_State in@state_province"),
-                                           geojson=geo_data,
-                                           locations='FIPS',
-                                           color='Confirmed_Cases',
-                                           color_discrete_map="Viridis",
-                                           mapbox_style="carto-positron",
-                                           zoom=3.5, center = {"lat": 37.0902, "lon": -95.7129},
-                                           opacity=0.5,
-                                           hover_name='County',
-                                           width=1300,
-                                           height=700
-                                          )
-        fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+        with pycovid19metrics.timer('covid19TimeSeriesByState.plotly_figure'):
+            fig: Figure = px.choropleth_mapbox(df_choropleth.query("Province_State in@state_province"),
+                                               geojson=geo_data,
+                                               locations='FIPS',
+                                               color='Confirmed_Cases',
+                                               color_discrete_map="Viridis",
+                                               mapbox_style="carto-positron",
+                                               zoom=zoom, center=center,
+                                               opacity=0.5,
+                                               hover_name='County',
+                                               width=1300,
+                                               height=700
+                                              )
+            fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
 
         # Layout the panel app such that the column will consist of a row of line chart, data table by counties, and data table by state
         # then a plotly choropleth below them 
@@ -149,10 +122,10 @@ def covid19TimeSeriesByState(covid19_date: Date, state_province: List[str], conf
                                                    logy=ylog,
                                                    width=600,
                                                    height=500,
-                                                   ylabel='# of ' + confirmed_deaths,
+                                                   ylabel=ytitle,
                                                    xlabel='Date',
                                                    legend='bottom',
-                                                   yformatter='%d',
+                                                   yformatter=yformat,
                                                    grid=True
                                            ),
                                            # A data table of counts by counties
@@ -165,19 +138,9 @@ def covid19TimeSeriesByState(covid19_date: Date, state_province: List[str], conf
                                                                        width=300,
                                                                        height=500
                                            ),
-                                           # A data table of counts by state with difference between rows
-                                           (df_by_state_ts.loc[:, state_province]
-                                                          .sort_values(by=state_province, ascending=False)
-                                                          .rename(columns={'index': 'Date', state_province[0]: 'Cum. Qty'})
-                                           ).merge((df_by_state_ts.loc[:, state_province]
-                                                                  .sort_values(by=state_province, ascending=False)
-                                                                  .rename(columns={'index': 'Date', state_province[0]: 'Cum. Qty'})
-                                                   ).diff(), how='inner', left_index=True, right_index=True
-                                                  )
-                                            .rename(columns={'Cum. Qty_x':'Cum. Qty', 'Cum. Qty_y': 'Difference'})
-                                            .reset_index()
-                                            .rename(columns={'index': 'Date'})
-                                            .hvplot.table(sortable=True, selectable=True, width=300, height=500)
+                                           # A data table of counts by state with difference between days
+                                           cube.table(state_province[0], layer=layer)
+                                               .hvplot.table(sortable=True, selectable=True, width=300, height=500)
                                      ),
                                      # A plotly choropleth Figure
                                      fig
@@ -190,21 +153,89 @@ def covid19TimeSeriesByState(covid19_date: Date, state_province: List[str], conf
                                logy=ylog,
                                width=700,
                                height=500,
-                               ylabel='# of ' + confirmed_deaths,
+                               ylabel=ytitle,
                                xlabel='Date',
                                legend='right',
-                               yformatter='%d',
+                               yformatter=yformat,
                                grid=True
                               )
                            )
 
     return panel_app
 
-# Final Panel object
-us_app = pn.Column(
-          covid19_date,
-          state_province,
-          confirmed_deaths,
-          ylog,
-          covid19TimeSeriesByState
-      )
+
+class USDashboard:
+    """ The widgets and charts of one session """
+
+    def __init__(self):
+        # Create input widgets: date widget, multi-choice, and selection widgets
+        # Make default date yesterday (today minus 1 day) since COVID-19 data is usually 1 day behind
+        # The states come from the small list written next to the data snapshots, so no data is loaded, let
+        # alone downloaded, when a session starts.  Before the very first ingest only the default state is offered
+        self.covid19_date: DatePicker = pn.widgets.DatePicker(name='Date:', value=(date.today() + timedelta(days=-1)),
+                                                              width=200, css_classes=['grey-theme']
+                                                             )
+        self.state_province: MultiChoice = pn.widgets.MultiChoice(name='State:', value=['Ohio'],
+                                                                  options=pycovid19ingest.read_entities('US') or ['Ohio']
+                                                                 )
+        self.confirmed_deaths = pn.widgets.Select(name='Confirmed Cases or Deaths:', value='Confirmed Cases',
+                                                  options=['Confirmed Cases', 'Deaths'],
+                                                  width=200, css_classes=['grey-theme'])
+        self.ylog = pn.widgets.Select(name='log-y?', value=False, options=[True, False], width=200,
+                                      css_classes=['grey-theme'])
+        # The counts or one of the metrics derived from them, see pycovid19cube
+        self.measure = pn.widgets.Select(name='Measure:', value='Cumulative', options=list(pycovid19cube.MEASURES),
+                                         width=200, css_classes=['grey-theme'])
+
+        # Called back on this session's document, see pycovid19refresh
+        pycovid19refresh.subscribe(self.onRefresh)
+        timeSeries = pn.depends(self.covid19_date.param.value, self.state_province.param.value,
+                                self.confirmed_deaths.param.value, self.ylog.param.value, self.measure.param.value
+                               )(self.timeSeriesByState)
+        self.layout: Panel = pn.Column(
+                                 self.covid19_date,
+                                 self.state_province,
+                                 self.confirmed_deaths,
+                                 self.ylog,
+                                 self.measure,
+                                 # Rendered once the page has loaded, not when the session is created, with a
+                                 # loading indicator while the data is loaded
+                                 pycovid19async.loading_panel(timeSeries, defer_load=True)
+                             )
+
+    def offerStates(self, force: bool = False) -> None:
+        """Function that fills the state selector from the entity list written next to the data snapshots,
+        if it only offers the default state or force is set"""
+
+        if force or len(self.state_province.options) == 1:
+            self.state_province.options = pycovid19ingest.read_entities('US')
+
+    async def timeSeriesByState(self, covid19_date: Date, state_province: List[str], confirmed_deaths: str,
+                                ylog: bool = False, measure: str = 'Cumulative') -> Panel:
+        """Function that returns the charts of the widgets' values, see covid19TimeSeriesByState"""
+
+        panel_app: Panel = await covid19TimeSeriesByState(covid19_date, state_province, confirmed_deaths, ylog, measure)
+        # The data has been ingested by now, offer every state if only the default one was available
+        self.offerStates()
+        return panel_app
+
+    def onRefresh(self) -> None:
+        """Function that shows a new data version swapped in by the background refresh, see pycovid19refresh"""
+
+        self.offerStates(force=True)
+        start, end = pycovid19refresh.date_bounds('US')
+        # Sessions looking at the latest data move on to the new latest date
+        value: Date = (end if self.covid19_date.end is None or self.covid19_date.value >= self.covid19_date.end
+                       else self.covid19_date.value)
+        self.covid19_date.param.update(start=start, end=end)
+        if value != self.covid19_date.value:
+            self.covid19_date.value = value
+        else:
+            # Re-render with the new data even though no widget value changed
+            self.covid19_date.param.trigger('value')
+
+
+def us_app() -> Panel:
+    """Function that returns the US dashboard of a new session, every session has widgets of its own"""
+
+    return USDashboard().layout
@@ -1,18 +1,20 @@
 # Currently there is a bug where the dates shown in the Altair tooltip are off by one day
 # https://github.com/holoviz/panel/issues/1303
 from datetime import date
-from datetime import datetime
 from datetime import timedelta
 from typing import TypeVar, List
-from urllib.request import urlopen
 import altair as alt
-import hvplot.pandas
-import json
-import numpy as np
-import pandas as pd
+import hvplot.pandas  # noqa: F401, adds the .hvplot accessor used below
 import panel as pn
-import platform
 import plotly.express as px
+import pycovid19async
+import pycovid19cube
+import pycovid19endpoint
+import pycovid19geo
+import pycovid19ingest
+import pycovid19metrics
+import pycovid19refresh
+import pycovid19store
 # These are related to optional type annotations
 Altair = TypeVar('altair.vegalite.v4.api.LayerChart')
 DataFrame = TypeVar('pd.core.frame.DataFrame')
@@ -25,6 +27,9 @@ Plotly = TypeVar('plotly.graph_objs._figure.Figure')
 MultiChoice = TypeVar('panel.widgets.select.MultiChoice')
 RangeIndex = TypeVar('pandas.core.indexes.range.RangeIndex')
 Series = TypeVar('pandas.core.series.Series')
+# A few states/countries of daily counts exceed Altair's default limit of 5,000 rows.  The layered charts
+# reference their data once and Panel sends it to the browser as a column data source
+alt.data_transformers.disable_max_rows()
 # Related to customizing your Panel's colors
 css = '''
 .black-theme {
@@ -39,29 +44,14 @@ css = '''
 pn.config.raw_css.clear()
 pn.config.raw_css.append(css)
 
-url: str = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv'
-df: DataFrame = pd.read_csv(url).query("Province_State not in(['Diamond Princess', 'Grand Princess'])")
+def states() -> List[str]:
+    """Function that returns the states offered, from the entity list written next to the data snapshots"""
 
-# Create input widgets: date widget, multi-choice, and selection widgets
-# Make default date yesterday (today minus 1 day) since COVID-19 data is usually 1 day behind
-states_provinces: List[str] = df['Province_State'].unique().tolist()
-covid19_date: DatePicker = pn.widgets.DatePicker(name='Date:', value=(date.today() + timedelta(days=-1)),
-                                                 width=200, css_classes=['grey-theme']
-                                                )
-state_province = pn.widgets.MultiChoice(name='State:', value=['Ohio'],
-                            options=states_provinces
-                           )
-confirmed_deaths = pn.widgets.Select(name='Confirmed Cases or Deaths:', value='Confirmed Cases',
-                                     options=['Confirmed Cases', 'Deaths'],
-                                     width=200, css_classes=['grey-theme']
-                                    )
-ylog = pn.widgets.Select(name='Scaling: linear/symlog', value='linear', options=['linear', 'symlog'], 
-                         width=200,
-                         css_classes=['grey-theme']
-                        )
-
-@pn.depends(covid19_date.param.value, state_province.param.value, confirmed_deaths.param.value, ylog.param.value)
-def covid19TimeSeriesByState(covid19_date: Date, state_province: List[str], confirmed_deaths: List[str], ylog: bool=False) -> PanelColumn:
+    return [state for state in pycovid19ingest.read_entities('US') if state not in pycovid19cube.CRUISE_SHIPS]
+
+@pycovid19metrics.timed
+async def covid19TimeSeriesByState(covid19_date: Date, state_province: List[str], confirmed_deaths: List[str], ylog: bool=False,
+                                   measure: str='Cumulative') -> PanelColumn:
     """Function that returns a Panel dashboard displaying confirmed COVID-19 cases
     It is using Panel's "Reactive functions" API: https://panel.holoviz.org/user_guide/APIs.html
     Parameters
@@ -74,70 +64,35 @@ def covid19TimeSeriesByState(covid19_date: Date, state_province: List[str], conf
         Option to choose # of confirmed cases or deaths due to COVID-19
     ylog : bool
         To enable log scaling or not on y-axis.  Log scale can be useful to easily discern growth rate.
+    measure : str
+        One of pycovid19cube.MEASURES, charted and added to the table by date (default='Cumulative')
     Returns
     -------
     Panel object
     """
 
-    # Panel's date widget returns date in ISO-8601 format
-    iso_date: str = covid19_date.strftime('%Y-%m-%d')
+    # Source of COVID-19 data, shared by every session and with FIPS already zero-padded for Plotly, see pycovid19store.
+    # Loaded off the server's event loop, which keeps serving the other sessions meanwhile, see pycovid19async
+    df: DataFrame = await pycovid19async.run(pycovid19store.get_dataset, 'US', confirmed_deaths)
 
-    # Get geo json data at state county level based on FIPS
-    with urlopen('https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json') as response:
-        geo_data: dict = json.load(response)
-
-    # Source of COVID-19 data
-    # To leverage Plotly's choropleth_mapbox function, need to have FIPS as fixed length(n=5) values consisting of leading zeros
-    if confirmed_deaths == 'Confirmed Cases':
-        url: str = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv'
-    else:
-        url: str = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_US.csv'
-    df: DataFrame = pd.read_csv(url, converters={'FIPS': lambda x: int(float(x)) if x != '' else x}).query("FIPS != ''")
-    df['FIPS']: Series = df['FIPS'].astype('str').str.zfill(5)
-    if 'Population' in df.columns:
-        df.drop(columns='Population', inplace=True)
-
-    df_by_state: DataFrame = (df.drop(columns=['UID', 'iso2', 'iso3', 'code3', 'FIPS', 'Admin2', 'Country_Region', 'Lat', 'Long_', 'Combined_Key'])
-                                .groupby('Province_State').agg('sum')
-                                .transpose()
-                                .reset_index()
-                                .melt(id_vars='index', var_name='State_Province', value_name='Qty_Confirmed')
-                                .rename(columns={'index': 'Date'})
-                                .set_index('Date')
-                             )
-    df_by_state.index: DateTimeIndex = [datetime.strptime(date, '%m/%d/%y') for date in df_by_state.index]
+    # Counts by state in "long format", grouped by state, from the aggregate cube built once per data refresh,
+    # see pycovid19cube
+    cube = await pycovid19async.run(pycovid19cube.get_cube, 'US', confirmed_deaths)
 
     # Prepare data for hvplot tables 
-    # https://stackoverflow.com/questions/53052914/selecting-non-adjacent-columns-by-column-number-pandas
-    df_by_state_ts: DataFrame = df.iloc[:, np.r_[6, 11:df.shape[1]]].groupby('Province_State').agg('sum').transpose()
-    df_by_counties: DataFrame = df.query("not Lat==0").iloc[:, [6, 10, -1]]
-
-    # Prepare data for Plotly choropleth map 
-    df_choropleth: DataFrame = df.iloc[:, np.r_[4, 5, 6, df.shape[1]-1]]
-    df_choropleth: DataFrame = df_choropleth.rename(columns={df_choropleth.columns[3]: 'Confirmed_Cases', 'Admin2': 'County'})
-    
-    # Initialize plotly choropleth map
-    plotly_chart: Plotly = px.choropleth_mapbox(df_choropleth.query("Province_State in@state_province"),
-                                        geojson=geo_data,
-                                        locations='FIPS',
-                                        color='Confirmed_Cases',
-                                        color_discrete_map="Viridis",
-                                        mapbox_style="carto-positron",
-                                        zoom=3.5, center = {"lat": 37.0902, "lon": -95.7129},
-                                        opacity=0.5,
-                                        hover_name='County',
-                                        width=1400,
-                                        height=700
-                                        )
-    plotly_chart.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+    df_by_counties: DataFrame = df.query("not Lat==0")[['Province_State', 'Combined_Key', df.columns[-1]]]
 
-    # Initialize altair chart
-    alt_chart: Altair = alt.Chart(df_by_state[:iso_date].query("State_Province in(@state_province)")
-                                                        .reset_index()
-                                                        .rename(columns={'index': 'Date'})
-                                 ).mark_line().encode(
+    # Initialize altair chart.  The layers are created without data, so that they all reference the single
+    # dataset given to the layer chart instead of each embedding a copy of it
+    # The metrics derived from the counts are computed along with them, the chart only picks one
+    layer: str = pycovid19cube.MEASURES[measure]
+    data: DataFrame = cube.long_index(layer).select(state_province, end=covid19_date,
+                                                    entity_name='State_Province', value_name='Qty_Confirmed'
+                                                   )
+    alt_chart: Altair = alt.Chart().mark_line().encode(
                                                x=alt.X(title='Date', field='Date', type='temporal'),
-                                               y=alt.Y(title='# of ' + confirmed_deaths, field='Qty_Confirmed', 
+                                               y=alt.Y(title=pycovid19cube.measure_title(measure, confirmed_deaths),
+                                                  field='Qty_Confirmed', 
                                                   type='quantitative', scale=alt.Scale(type=ylog)
                                                  ),
                                                color=alt.Color(field='State_Province', type='nominal',
@@ -148,10 +103,38 @@ def covid19TimeSeriesByState(covid19_date: Date, state_province: List[str], conf
                                                         alt.Tooltip(field='Date', type= 'temporal')]
                                               )
     # https://github.com/altair-viz/altair/issues/1812
-    alt_chart: Altair = alt_chart + alt_chart.mark_point(size=100, opacity=0, tooltip=alt.TooltipContent("data"))
+    alt_chart: Altair = alt.layer(alt_chart,
+                                  alt_chart.mark_point(size=100, opacity=0, tooltip=alt.TooltipContent("data")),
+                                  # Referenced by URL when served with the data endpoint, see pycovid19endpoint
+                                  data=pycovid19endpoint.chart_data(data)
+                                 )
 
     # If only one state is selected, then also provide data tables containing counts by counties, by date, and counties choropleth map
     if len(state_province) == 1:
+        # Prepare data for Plotly choropleth map 
+        df_choropleth: DataFrame = df[['FIPS', 'Admin2', 'Province_State', df.columns[-1]]]
+        df_choropleth: DataFrame = df_choropleth.rename(columns={df_choropleth.columns[3]: 'Confirmed_Cases', 'Admin2': 'County'})
+
+        # Only the counties of the selected state are sent to the browser, simplified for the zoom level
+        # that fits the state, see pycovid19geo
+        geo_data, center, zoom = await pycovid19async.run(pycovid19geo.state_map, state_province[0], width=1400, height=700)
+
+        # Initialize plotly choropleth map
+        with pycovid19metrics.timer('covid19TimeSeriesByState.plotly_figure'):
+            plotly_chart: Plotly = px.choropleth_mapbox(df_choropleth.query("Province_State in@state_province"),
+                                                geojson=geo_data,
+                                                locations='FIPS',
+                                                color='Confirmed_Cases',
+                                                color_discrete_map="Viridis",
+                                                mapbox_style="carto-positron",
+                                                zoom=zoom, center=center,
+                                                opacity=0.5,
+                                                hover_name='County',
+                                                width=1400,
+                                                height=700
+                                                )
+            plotly_chart.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+
         # Layout the panel app such that the column will consist of a row of line chart, data table by counties, and data table by state
         # then a plotly choropleth below them 
         panel_app: PanelColumn = pn.Column(pn.Row(
@@ -174,19 +157,8 @@ def covid19TimeSeriesByState(covid19_date: Date, state_province: List[str], conf
                                                          width=250,
                                                          height=500
                                            ),
-                                           # A data table of counts by state with difference between rows
-                                           (df_by_state_ts.loc[:, state_province]
-                                                          .sort_values(by=state_province, ascending=False)
-                                                          .rename(columns={'index': 'Date', state_province[0]: 'Cum. Qty'})
-                                           )
-                                           .merge((df_by_state_ts.loc[:, state_province]
-                                                                 .sort_values(by=state_province, ascending=False)
-                                                                 .rename(columns={'index': 'Date', state_province[0]: 'Cum. Qty'})
-                                                  ).diff(), how='inner', left_index=True, right_index=True
-                                           )
-                                           .rename(columns={'Cum. Qty_x':'Cum. Qty', 'Cum. Qty_y': 'Difference'})
-                                           .reset_index()
-                                           .rename(columns={'index': 'Date'})
+                                           # A data table of counts by state with difference between days
+                                           cube.table(state_province[0], layer=layer)
                                            .hvplot.table(sortable=True, selectable=True, width=300, height=500),
                                            width=1200,
                                            sizing_mode='stretch_width'
@@ -210,11 +182,86 @@ def covid19TimeSeriesByState(covid19_date: Date, state_province: List[str], conf
 
     return panel_app
 
-# Final Panel object, stack Panel components in columnar layout
-us_app: PanelColumn = pn.Column(
-                         covid19_date,
-                         state_province,
-                         confirmed_deaths,
-                         ylog,
-                         covid19TimeSeriesByState
-                      )
\ No newline at end of file
+
+class USDashboard:
+    """ The widgets and charts of one session """
+
+    def __init__(self):
+        # Create input widgets: date widget, multi-choice, and selection widgets
+        # Make default date yesterday (today minus 1 day) since COVID-19 data is usually 1 day behind
+        # The states come from the small list written next to the data snapshots, so no data is loaded, let
+        # alone downloaded, when a session starts.  Before the very first ingest only the default state is offered
+        self.covid19_date: DatePicker = pn.widgets.DatePicker(name='Date:', value=(date.today() + timedelta(days=-1)),
+                                                              width=200, css_classes=['grey-theme']
+                                                             )
+        self.state_province: MultiChoice = pn.widgets.MultiChoice(name='State:', value=['Ohio'],
+                                                                  options=states() or ['Ohio']
+                                                                 )
+        self.confirmed_deaths = pn.widgets.Select(name='Confirmed Cases or Deaths:', value='Confirmed Cases',
+                                                  options=['Confirmed Cases', 'Deaths'],
+                                                  width=200, css_classes=['grey-theme']
+                                                 )
+        self.ylog = pn.widgets.Select(name='Scaling: linear/symlog', value='linear', options=['linear', 'symlog'],
+                                      width=200,
+                                      css_classes=['grey-theme']
+                                     )
+        # The counts or one of the metrics derived from them, see pycovid19cube
+        self.measure = pn.widgets.Select(name='Measure:', value='Cumulative', options=list(pycovid19cube.MEASURES),
+                                         width=200,
+                                         css_classes=['grey-theme']
+                                        )
+
+        # Called back on this session's document, see pycovid19refresh
+        pycovid19refresh.subscribe(self.onRefresh)
+        timeSeries = pn.depends(self.covid19_date.param.value, self.state_province.param.value,
+                                self.confirmed_deaths.param.value, self.ylog.param.value, self.measure.param.value
+                               )(self.timeSeriesByState)
+        # Final Panel object, stack Panel components in columnar layout
+        self.layout: PanelColumn = pn.Column(
+                                       self.covid19_date,
+                                       self.state_province,
+                                       self.confirmed_deaths,
+                                       self.ylog,
+                                       self.measure,
+                                       # Rendered once the page has loaded, not when the session is created, with
+                                       # a loading indicator while the data is loaded
+                                       pycovid19async.loading_panel(timeSeries, defer_load=True)
+                                   )
+
+    def offerStates(self, force: bool = False) -> None:
+        """Function that fills the state selector from the entity list written next to the data snapshots,
+        if it only offers the default state or force is set"""
+
+        if force or len(self.state_province.options) == 1:
+            self.state_province.options = states()
+
+    async def timeSeriesByState(self, covid19_date: Date, state_province: List[str], confirmed_deaths: str,
+                                ylog: str = 'linear', measure: str = 'Cumulative') -> PanelColumn:
+        """Function that returns the charts of the widgets' values, see covid19TimeSeriesByState"""
+
+        panel_app: PanelColumn = await covid19TimeSeriesByState(covid19_date, state_province, confirmed_deaths, ylog,
+                                                                measure)
+        # The data has been ingested by now, offer every state if only the default one was available
+        self.offerStates()
+        return panel_app
+
+    def onRefresh(self) -> None:
+        """Function that shows a new data version swapped in by the background refresh, see pycovid19refresh"""
+
+        self.offerStates(force=True)
+        start, end = pycovid19refresh.date_bounds('US')
+        # Sessions looking at the latest data move on to the new latest date
+        value: Date = (end if self.covid19_date.end is None or self.covid19_date.value >= self.covid19_date.end
+                       else self.covid19_date.value)
+        self.covid19_date.param.update(start=start, end=end)
+        if value != self.covid19_date.value:
+            self.covid19_date.value = value
+        else:
+            # Re-render with the new data even though no widget value changed
+            self.covid19_date.param.trigger('value')
+
+
+def us_app() -> PanelColumn:
+    """Function that returns the US dashboard of a new session, every session has widgets of its own"""
+
+    return USDashboard().layout
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""Streaming variant of the US time series view, see pycovid19stream
+
+Like the dashboards of pycovid19us and pycovid19usAltair, every session gets its own widgets and chart,
+the chart keeping track of the data its browser already has.  Serve the factory rather than an object,
+e.g. pn.serve({'US_Streaming': us_stream_app}).
+The cube a chart update needs is loaded off the server's event loop, see pycovid19async.
+"""
+from datetime import date
+from datetime import timedelta
+from typing import TypeVar, List
+import panel as pn
+import pycovid19async
+import pycovid19cube
+import pycovid19ingest
+import pycovid19refresh
+import pycovid19stream
+# These are related to optional type annotations
+Date = TypeVar('datetime.date')
+Panel = TypeVar('pn.layout.Column')
+
+
+class StreamingDashboard:
+    """ The widgets and streaming line chart of one session """
+
+    def __init__(self):
+        # Before the very first ingest only the default state is offered
+        self.covid19_date = pn.widgets.DatePicker(name='Date:', value=(date.today() + timedelta(days=-1)), width=200)
+        self.state_province = pn.widgets.MultiChoice(name='State:', value=['Ohio'],
+                                                     options=pycovid19ingest.read_entities('US') or ['Ohio']
+                                                    )
+        self.confirmed_deaths = pn.widgets.Select(name='Confirmed Cases or Deaths:', value='Confirmed Cases',
+                                                  options=['Confirmed Cases', 'Deaths'], width=200
+                                                 )
+        self.measure = pn.widgets.Select(name='Measure:', value='Cumulative', options=list(pycovid19cube.MEASURES),
+                                         width=200
+                                        )
+        self.ylog = pn.widgets.Select(name='log-y?', value=False, options=[True, False], width=200)
+        self.chart = pycovid19stream.StreamingLineChart('US')
+
+        for widget in (self.covid19_date, self.state_province, self.confirmed_deaths, self.measure, self.ylog):
+            widget.param.watch(self.updateChart, 'value')
+        pycovid19refresh.subscribe(self.onRefresh)
+        self.layout: Panel = pn.Column(self.covid19_date, self.state_province, self.confirmed_deaths, self.measure,
+                                       self.ylog, self.chart.pane
+                                      )
+        # Drawn once the page has loaded, not when the session is created
+        pn.state.onload(self.updateChart)
+
+    def offerStates(self, force: bool = False) -> None:
+        """Function that fills the state selector from the entity list written next to the data snapshots,
+        if it only offers the default state or force is set"""
+
+        if force or len(self.state_province.options) == 1:
+            self.state_province.options = pycovid19ingest.read_entities('US')
+
+    async def updateChart(self, *events) -> None:
+        """Function that sends the browser what changed in the chart since the last update"""
+
+        # The chart then finds the cube in the store.  The widgets are read once it is loaded, the latest
+        # values win if they changed meanwhile
+        self.chart.pane.loading = True
+        try:
+            await pycovid19async.run(pycovid19cube.get_cube, 'US', self.confirmed_deaths.value)
+        finally:
+            self.chart.pane.loading = False
+        self.chart.update(self.state_province.value, self.covid19_date.value, self.confirmed_deaths.value,
+                          log=self.ylog.value, measure=self.measure.value
+                         )
+        # The data has been ingested by now, offer every state if only the default one was available
+        self.offerStates()
+
+    def onRefresh(self) -> None:
+        """Function that shows a new data version swapped in by the background refresh, see pycovid19refresh"""
+
+        self.offerStates(force=True)
+        start, end = pycovid19refresh.date_bounds('US')
+        # Sessions looking at the latest data move on to the new latest date
+        value: Date = (end if self.covid19_date.end is None or self.covid19_date.value >= self.covid19_date.end
+                       else self.covid19_date.value)
+        self.covid19_date.param.update(start=start, end=end)
+        if value != self.covid19_date.value:
+            self.covid19_date.value = value
+        else:
+            # Stream the new data even though no widget value changed
+            pn.state.execute(self.updateChart)
+
+
+def us_stream_app() -> Panel:
+    """Function that returns the streaming US dashboard of a new session"""
+
+    return StreamingDashboard().layout
@@ -0,0 +1,49 @@
+import asyncio
+import os
+import sys
+import threading
+import pytest
+import tornado.httpclient
+import tornado.httpserver
+import tornado.testing
+import tornado.web
+# The modules of the apps import each other by name, from the covid19 directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+
+@pytest.fixture
+def serve():
+    """ Serves Tornado routes on a loop of their own, in a thread, until the test is done.  Called with
+        the routes, returns a function fetching a path from them synchronously, see HTTPClient.fetch
+    """
+
+    loop = asyncio.new_event_loop()
+    servers, clients = [], []
+
+    def start(routes):
+        sock, port = tornado.testing.bind_unused_port()
+
+        async def listen():
+            server = tornado.httpserver.HTTPServer(tornado.web.Application(routes))
+            server.add_sockets([sock])
+            return server
+
+        servers.append(asyncio.run_coroutine_threadsafe(listen(), loop).result())
+        client = tornado.httpclient.HTTPClient()
+        clients.append(client)
+
+        def fetch(path, **kwargs):
+            return client.fetch(f'http://127.0.0.1:{port}{path}', raise_error=False, **kwargs)
+
+        return fetch
+
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield start
+    for client in clients:
+        client.close()
+    for server in servers:
+        loop.call_soon_threadsafe(server.stop)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
@@ -0,0 +1,95 @@
+"""Tests of the loading indicator of pycovid19async.loading_panel"""
+from types import SimpleNamespace
+import asyncio
+from bokeh.document import Document
+from panel.io.state import set_curdoc
+import panel as pn
+import pytest
+import pycovid19async
+
+
+@pytest.fixture
+def view():
+    # A reactive function whose calls wait for their gate
+    widget = pn.widgets.IntInput(value=0)
+    gates = {}
+
+    @pn.depends(widget.param.value)
+    async def function(value):
+        await gates.setdefault(value, asyncio.Event()).wait()
+        return value
+
+    return SimpleNamespace(widget=widget, function=function, gates=gates)
+
+
+def session():
+    doc = Document()
+    context = SimpleNamespace(id='session')
+    # Bokeh keeps a weak reference to the session context
+    doc._session_context = lambda: context
+    return doc
+
+
+async def call(pane, value, doc=None):
+    # Called as Panel calls it, from the session of doc
+    if doc is None:
+        return await pane.object(value)
+    with set_curdoc(doc):
+        return await pane.object(value)
+
+
+def test_loading_until_last_call_done(view):
+    async def scenario():
+        pane = pycovid19async.loading_panel(view.function, defer_load=True)
+        assert not pane.loading
+        first = asyncio.ensure_future(call(pane, 1))
+        second = asyncio.ensure_future(call(pane, 2))
+        await asyncio.sleep(0)
+        assert pane.loading
+
+        view.gates[1].set()
+        assert await first == 1
+        assert pane.loading
+        view.gates[2].set()
+        assert await second == 2
+        assert not pane.loading
+
+    asyncio.run(scenario())
+
+
+def test_session_destroyed_while_loading(view):
+    async def scenario():
+        pane = pycovid19async.loading_panel(view.function, defer_load=True)
+        doc = session()
+        pending = asyncio.ensure_future(call(pane, 1, doc))
+        await asyncio.sleep(0)
+        assert pane.loading
+
+        # Bokeh calls these once the session's websocket is closed and the session expired
+        for callback in doc.session_destroyed_callbacks:
+            callback(doc.session_context)
+        assert not pane.loading
+        view.gates[1].set()
+        await pending
+        assert not pane.loading
+
+    asyncio.run(scenario())
+
+
+def test_other_session_keeps_loading(view):
+    async def scenario():
+        pane = pycovid19async.loading_panel(view.function, defer_load=True)
+        closed, still_open = session(), session()
+        pending = [asyncio.ensure_future(call(pane, 1, closed)), asyncio.ensure_future(call(pane, 2, still_open))]
+        await asyncio.sleep(0)
+
+        for callback in closed.session_destroyed_callbacks:
+            callback(closed.session_context)
+        assert pane.loading
+        view.gates[2].set()
+        await pending[1]
+        assert not pane.loading
+        view.gates[1].set()
+        await pending[0]
+
+    asyncio.run(scenario())
@@ -0,0 +1,233 @@
+"""Tests of pycovid19cache against a local HTTP stand-in of upstream"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+import threading
+import time
+import pytest
+import pycovid19cache
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """ Answers with the body and validators of its server, or the error or delay it was told to """
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if server.delay:
+            time.sleep(server.delay)
+        if server.errors.get(self.path):
+            self.send_error(server.errors[self.path].pop(0))
+            return
+        if ((server.etag and self.headers.get('If-None-Match') == server.etag)
+                or (server.last_modified and self.headers.get('If-Modified-Since') == server.last_modified)):
+            self.send_response(304)
+            self.end_headers()
+            return
+        try:
+            self.send_response(200)
+            if server.etag:
+                self.send_header('ETag', server.etag)
+            if server.last_modified:
+                self.send_header('Last-Modified', server.last_modified)
+            self.send_header('Content-Length', str(len(server.body)))
+            self.end_headers()
+            self.wfile.write(server.body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    server.daemon_threads = True
+    server.body, server.etag, server.last_modified = b'a,b\n1,2\n', '"v1"', None
+    # Status codes to answer the next requests of a path with, before its body
+    server.errors, server.delay, server.requests = {}, 0, []
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/data.csv'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(pycovid19cache, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(pycovid19cache, 'TIMEOUT', 5)
+    monkeypatch.setattr(pycovid19cache, 'RETRIES', 2)
+    monkeypatch.setattr(pycovid19cache, 'BACKOFF', 0)
+    return tmp_path
+
+
+def fetch(url):
+    report = pycovid19cache.FetchReport(url)
+    with open(pycovid19cache.fetch(url, max_age=0, report=report), 'rb') as f:
+        return f.read(), report
+
+
+def test_first_download(upstream):
+    body, report = fetch(upstream.url)
+
+    assert body == upstream.body
+    assert (report.status, report.attempts, report.bytes) == ('downloaded', 1, len(upstream.body))
+    assert 'If-None-Match' not in upstream.requests[0]
+    assert 'If-Modified-Since' not in upstream.requests[0]
+
+
+def test_not_modified_etag(upstream):
+    fetch(upstream.url)
+    body, report = fetch(upstream.url)
+
+    assert body == upstream.body
+    assert (report.status, report.bytes) == ('not modified', 0)
+    assert upstream.requests[1]['If-None-Match'] == '"v1"'
+
+
+def test_not_modified_last_modified(upstream):
+    upstream.etag, upstream.last_modified = None, 'Wed, 01 Apr 2020 00:00:00 GMT'
+    fetch(upstream.url)
+    body, report = fetch(upstream.url)
+
+    assert body == upstream.body
+    assert report.status == 'not modified'
+    assert 'If-None-Match' not in upstream.requests[1]
+    assert upstream.requests[1]['If-Modified-Since'] == upstream.last_modified
+
+
+def test_changed(upstream):
+    fetch(upstream.url)
+    upstream.body, upstream.etag = b'a,b\n1,2\n3,4\n', '"v2"'
+    body, report = fetch(upstream.url)
+
+    assert body == upstream.body
+    assert report.status == 'downloaded'
+    assert upstream.requests[1]['If-None-Match'] == '"v1"'
+    # The new validators are the ones sent next
+    fetch(upstream.url)
+    assert upstream.requests[2]['If-None-Match'] == '"v2"'
+
+
+def test_timeout_with_stale_copy(upstream, monkeypatch):
+    expected, _ = fetch(upstream.url)
+    monkeypatch.setattr(pycovid19cache, 'TIMEOUT', 0.2)
+    upstream.delay, upstream.body = 1, b'changed'
+    body, report = fetch(upstream.url)
+
+    assert body == expected
+    assert report.status == 'stale'
+    assert isinstance(report.error, OSError)
+
+
+def test_refused_with_stale_copy(upstream):
+    expected, _ = fetch(upstream.url)
+    upstream.shutdown()
+    upstream.server_close()
+    body, report = fetch(upstream.url)
+
+    assert body == expected
+    assert (report.status, report.attempts) == ('stale', 3)
+    assert isinstance(report.error, URLError)
+
+
+@pytest.mark.parametrize('code', [500, 503, 429])
+def test_server_error_with_stale_copy(upstream, code):
+    expected, _ = fetch(upstream.url)
+    upstream.errors['/data.csv'] = [code] * 3
+    body, report = fetch(upstream.url)
+
+    assert body == expected
+    assert (report.status, report.attempts) == ('stale', 3)
+    assert report.error.code == code
+
+
+def test_server_error_without_copy(upstream):
+    upstream.errors['/data.csv'] = [503] * 3
+
+    with pytest.raises(HTTPError) as error:
+        fetch(upstream.url)
+    assert error.value.code == 503
+
+
+def test_not_found_with_copy(upstream):
+    # The file is gone upstream rather than upstream failing, that is not hidden
+    fetch(upstream.url)
+    upstream.errors['/data.csv'] = [404]
+
+    with pytest.raises(HTTPError) as error:
+        fetch(upstream.url)
+    assert error.value.code == 404
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # The backoff delays, without waiting for them
+    delays = []
+    monkeypatch.setattr(pycovid19cache.time, 'sleep', delays.append)
+    return delays
+
+
+def test_retries(upstream, sleeps, monkeypatch):
+    monkeypatch.setattr(pycovid19cache, 'RETRIES', 3)
+    upstream.errors['/data.csv'] = [503, 429, 500]
+    body, report = fetch(upstream.url)
+
+    assert body == upstream.body
+    assert (report.status, report.attempts) == ('downloaded', 4)
+    assert len(upstream.requests) == 4
+
+
+def test_backoff(upstream, sleeps, monkeypatch):
+    monkeypatch.setattr(pycovid19cache, 'RETRIES', 3)
+    monkeypatch.setattr(pycovid19cache, 'BACKOFF', 1.5)
+    upstream.errors['/data.csv'] = [503] * 3
+    fetch(upstream.url)
+
+    assert sleeps == [1.5, 3, 6]
+
+
+@pytest.mark.parametrize('code', [400, 403, 404])
+def test_client_error_not_retried(upstream, sleeps, code):
+    upstream.errors['/data.csv'] = [code]
+
+    with pytest.raises(HTTPError) as error:
+        fetch(upstream.url)
+    assert error.value.code == code
+    assert len(upstream.requests) == 1
+    assert sleeps == []
+
+
+def test_retries_run_out(upstream, sleeps):
+    upstream.errors['/data.csv'] = [503] * 3
+
+    with pytest.raises(HTTPError) as error:
+        fetch(upstream.url)
+    assert error.value.code == 503
+    assert len(upstream.requests) == 3
+    assert sleeps == [0, 0]
+
+
+def test_fetch_all_falls_back_per_file(upstream, sleeps):
+    base = upstream.url.rsplit('/', 1)[0]
+    cached, missing, healthy = base + '/cached.csv', base + '/missing.csv', base + '/healthy.csv'
+    fetch(cached)
+    upstream.errors = {'/cached.csv': [503] * 3, '/missing.csv': [503] * 3}
+    reports = pycovid19cache.fetch_all([cached, missing, healthy], max_age=0)
+
+    assert {url: report.status for url, report in reports.items()} == {cached: 'stale', missing: 'failed',
+                                                                       healthy: 'downloaded'}
+    assert reports[missing].error.code == 503
+    assert reports[missing].attempts == 3
+
+
+def test_clear(upstream, cache):
+    fetch(upstream.url)
+    (cache / 'snapshots').mkdir()
+    (cache / 'snapshots' / 'US-Deaths.parquet').write_bytes(b'')
+    pycovid19cache.clear()
+
+    assert list(cache.iterdir()) == []
@@ -0,0 +1,134 @@
+"""Tests of pycovid19cube, on a small cube whose values are worked out by hand"""
+from datetime import date
+import numpy as np
+import pandas as pd
+import pytest
+import pycovid19cube
+
+DATES = pd.date_range('2020-03-01', periods=5)
+ENTITIES = pd.Index(['Ohio', 'Texas', 'Utah'], name='Province_State')
+# Cumulative counts, dates x entities
+CUMULATIVE = np.array([[1, 0, 4],
+                       [3, 2, 4],
+                       [6, 2, 4],
+                       [10, 5, 4],
+                       [15, 9, 4]])
+
+
+@pytest.fixture
+def cube():
+    return pycovid19cube.AggregateCube(DATES, ENTITIES, CUMULATIVE.copy())
+
+
+def test_select_entities_in_order_given(cube):
+    data = cube.long_index().select(['Utah', 'Ohio'])
+
+    assert data.columns.tolist() == ['Date', 'Entity', 'Qty']
+    assert data['Entity'].tolist() == ['Utah'] * 5 + ['Ohio'] * 5
+    assert data['Date'].tolist() == DATES.tolist() * 2
+    assert data['Qty'].tolist() == [4, 4, 4, 4, 4, 1, 3, 6, 10, 15]
+
+
+def test_select_leaves_unknown_entities_out(cube):
+    assert cube.long_index().select(['Atlantis', 'Texas'])['Entity'].unique().tolist() == ['Texas']
+    assert cube.long_index().select([]).empty
+    assert cube.long_index().select(['Atlantis']).columns.tolist() == ['Date', 'Entity', 'Qty']
+
+
+@pytest.mark.parametrize('end, count', [(date(2020, 3, 3), 3), (date(2020, 3, 5), 5), (date(2020, 4, 1), 5),
+                                        (date(2020, 2, 29), 0), (None, 5)])
+def test_select_up_to_end(cube, end, count):
+    data = cube.long_index('daily').select(['Ohio', 'Texas'], end=end)
+
+    assert data['Date'].tolist() == DATES[:count].tolist() * 2
+    assert data['Qty'].tolist() == [1, 2, 3, 4, 5][:count] + [0, 2, 0, 3, 4][:count]
+
+
+def test_select_renamed_columns(cube):
+    data = cube.long_index().select(['Texas'], end=date(2020, 3, 2), entity_name='State_Province',
+                                    value_name='Qty_Confirmed')
+
+    assert data.columns.tolist() == ['Date', 'State_Province', 'Qty_Confirmed']
+    assert data.to_dict('list') == {'Date': DATES[:2].tolist(), 'State_Province': ['Texas', 'Texas'],
+                                    'Qty_Confirmed': [0, 2]}
+
+
+def test_table_latest_date_first(cube):
+    table = cube.table('Ohio')
+
+    assert table.columns.tolist() == ['Date', 'Cum. Qty', 'Difference']
+    assert table['Date'].tolist() == DATES[::-1].tolist()
+    assert table['Cum. Qty'].tolist() == [15, 10, 6, 3, 1]
+    # The first date has no day before, its difference is the count itself
+    assert table['Difference'].tolist() == [5, 4, 3, 2, 1]
+
+
+def test_table_up_to_end(cube):
+    table = cube.table('Texas', end=date(2020, 3, 3))
+
+    assert table['Date'].tolist() == DATES[2::-1].tolist()
+    assert table['Cum. Qty'].tolist() == [2, 2, 0]
+    assert table['Difference'].tolist() == [0, 2, 0]
+
+
+def test_table_with_measure(cube):
+    table = cube.table('Ohio', end=date(2020, 3, 4), layer='avg7')
+
+    assert table.columns.tolist() == ['Date', 'Cum. Qty', 'Difference', '7-day average']
+    # Averaged over the days so far: 10 / 4, 6 / 3, 3 / 2, 1 / 1
+    assert table['7-day average'].tolist() == [2.5, 2.0, 1.5, 1.0]
+
+
+# Nine days of counts: doubling every day, flat, falling back (a correction) and starting late
+SERIES = np.array([[1, 5, 16, 0],
+                   [2, 5, 16, 0],
+                   [4, 5, 16, 0],
+                   [8, 5, 16, 0],
+                   [16, 5, 16, 0],
+                   [32, 5, 16, 0],
+                   [64, 5, 16, 0],
+                   [128, 5, 1, 3],
+                   [256, 5, 16, 6]])
+
+
+def test_derive_layers():
+    layers = pycovid19cube.derive(SERIES)
+
+    assert list(layers) == list(pycovid19cube.LAYERS)
+    assert layers['cumulative'] is SERIES
+    # The first day has no day before, its daily count is the cumulative one
+    assert layers['daily'][:, 0].tolist() == [1, 1, 2, 4, 8, 16, 32, 64, 128]
+    assert layers['daily'][:, 2].tolist() == [16, 0, 0, 0, 0, 0, 0, -15, 15]
+
+
+def test_rolling_mean():
+    daily = pycovid19cube.derive(SERIES)['daily']
+
+    # Averaged over the days so far for the first six days, then over the last seven
+    assert pycovid19cube.rolling_mean(daily, 7)[:, 0] == pytest.approx(
+        [1, 1, 4 / 3, 2, 16 / 5, 32 / 6, 64 / 7, 127 / 7, 254 / 7])
+    assert pycovid19cube.rolling_mean(daily, 7)[:, 1] == pytest.approx(
+        [5, 5 / 2, 5 / 3, 5 / 4, 1, 5 / 6, 5 / 7, 0, 0])
+
+
+def test_growth_rate():
+    growth = pycovid19cube.growth_rate(SERIES)
+
+    # No count seven days before
+    assert np.isnan(growth[:7]).all()
+    # 128 / 1 and 256 / 2: doubling every day
+    assert growth[7:, 0] == pytest.approx([100, 100])
+    assert growth[7:, 1].tolist() == [0, 0]
+    # 1 / 16 over seven days: halving every 1.75 days
+    assert growth[7, 2] == pytest.approx(100 * (0.5 ** (4 / 7) - 1))
+    assert growth[8, 2] == 0
+    # Nothing to grow from
+    assert np.isnan(growth[7:, 3]).all()
+
+
+def test_doubling_time():
+    doubling = pycovid19cube.doubling_time(np.array([100, 10, 0, -50, np.nan]))
+
+    assert doubling[:2] == pytest.approx([1, np.log(2) / np.log(1.1)])
+    # Not growing, or falling: it never doubles
+    assert np.isnan(doubling[2:]).all()
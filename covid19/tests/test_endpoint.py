@@ -0,0 +1,84 @@
+"""Tests of the data endpoint of pycovid19endpoint"""
+from types import SimpleNamespace
+import gzip
+import pandas as pd
+import pytest
+import pycovid19endpoint
+import pycovid19store
+
+FRAME = pd.DataFrame({'Date': pd.to_datetime(['2020-03-10', '2020-03-11']),
+                      'State_Province': ['Ohio', 'Ohio'],
+                      'Qty_Confirmed': [3, 5]
+                     })
+
+
+@pytest.fixture
+def endpoint(monkeypatch, serve):
+    monkeypatch.setattr(pycovid19endpoint, 'payloads', pycovid19store.DatasetStore(ttl=float('inf')))
+    monkeypatch.setattr(pycovid19endpoint, 'enabled', False)
+    key = pycovid19endpoint.publish(FRAME)
+    fetch = serve(pycovid19endpoint.routes())
+    return SimpleNamespace(key=key, path=f'/covid19/data/{key}.csv', fetch=fetch)
+
+
+def serialized():
+    # Payloads serialized so far, by (hash, format)
+    return [key for key in pycovid19endpoint.payloads._entries if isinstance(key, tuple)]
+
+
+def test_get(endpoint):
+    response = endpoint.fetch(endpoint.path, decompress_response=False, headers={'Accept-Encoding': 'gzip'})
+
+    assert response.code == 200
+    assert response.headers['ETag'] == f'"{endpoint.key}"'
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.body).decode().splitlines() == ['Date,State_Province,Qty_Confirmed',
+                                                                    '2020-03-10T00:00:00,Ohio,3',
+                                                                    '2020-03-11T00:00:00,Ohio,5']
+
+
+def test_get_uncompressed(endpoint):
+    response = endpoint.fetch(endpoint.path, decompress_response=False)
+
+    assert 'Content-Encoding' not in response.headers
+    assert response.body.startswith(b'Date,State_Province,Qty_Confirmed')
+
+
+def test_unpublished(endpoint):
+    assert endpoint.fetch('/covid19/data/0123456789abcdef01234567.csv').code == 404
+
+
+@pytest.mark.parametrize('if_none_match', ['"{key}"', 'W/"{key}"', '"other", W/"{key}"', '"other",W/"{key}"', '*'])
+def test_not_modified(endpoint, if_none_match):
+    response = endpoint.fetch(endpoint.path, headers={'If-None-Match': if_none_match.format(key=endpoint.key)})
+
+    assert response.code == 304
+    assert response.body == b''
+    # Answered without serializing the frame
+    assert serialized() == []
+
+
+@pytest.mark.parametrize('if_none_match', ['"other"', 'W/"other", "{key}0"', '"W/{key}"'])
+def test_modified(endpoint, if_none_match):
+    response = endpoint.fetch(endpoint.path, headers={'If-None-Match': if_none_match.format(key=endpoint.key)})
+
+    assert response.code == 200
+    assert serialized() == [(endpoint.key, 'csv')]
+
+
+@pytest.mark.parametrize('rel_path, url', [(None, 'covid19/data/'), ('', 'covid19/data/'),
+                                           ('..', '../covid19/data/'),
+                                           ('http://example.com/prefix', 'http://example.com/prefix/covid19/data/')])
+def test_chart_data_url_is_relative(endpoint, monkeypatch, rel_path, url):
+    monkeypatch.setattr(pycovid19endpoint.pn, 'state', SimpleNamespace(rel_path=rel_path))
+
+    data = pycovid19endpoint.chart_data(FRAME)
+
+    assert data.url == f'{url}{endpoint.key}.csv'
+    assert data.format.parse == {'Date': 'date', 'Qty_Confirmed': 'number'}
+
+
+def test_chart_data_inline_until_routed(monkeypatch):
+    monkeypatch.setattr(pycovid19endpoint, 'enabled', False)
+
+    assert pycovid19endpoint.chart_data(FRAME) is FRAME
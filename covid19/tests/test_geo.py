@@ -0,0 +1,86 @@
+"""Tests of the per-state maps of pycovid19geo, on a few hand-made counties"""
+import pytest
+import pycovid19geo
+import pycovid19store
+
+
+def county(fips, *rings):
+    return {'type': 'Feature', 'id': fips,
+            'geometry': {'type': 'MultiPolygon', 'coordinates': [[ring + ring[:1]] for ring in rings]}
+           }
+
+
+def box(west, south, east, north):
+    return [[west, south], [east, south], [east, north], [west, north]]
+
+
+COUNTIES = {'type': 'FeatureCollection',
+            'features': [county('39001', box(-84.8, 38.4, -82.0, 40.0)),
+                         county('39003', box(-82.0, 39.0, -80.5, 42.0)),
+                         # Aleutians West, on both sides of the antimeridian
+                         county('02016', box(172.4, 51.3, 179.9, 53.0), box(-179.2, 51.2, -177.0, 52.1)),
+                         county('02290', box(-165.0, 60.0, -141.0, 71.4))
+                        ]
+           }
+
+
+@pytest.fixture
+def loaded(monkeypatch):
+    # Tolerances the county GeoJSON was loaded at, through a store of its own
+    tolerances = []
+
+    def load_counties(tolerance=0.0):
+        tolerances.append(tolerance)
+        return COUNTIES
+
+    monkeypatch.setattr(pycovid19store, 'store', pycovid19store.DatasetStore())
+    pycovid19store.store.put(('US', 'state_fips'), {'Ohio': '39', 'Alaska': '02'})
+    monkeypatch.setattr(pycovid19geo, 'load_counties', load_counties)
+    return tolerances
+
+
+def test_bbox():
+    by_state = pycovid19geo.split_by_state(COUNTIES)
+
+    assert by_state['39']['bbox'] == [-84.8, 38.4, -80.5, 42.0]
+    assert [feature['id'] for feature in by_state['39']['features']] == ['39001', '39003']
+
+
+def test_bbox_across_antimeridian():
+    west, south, east, north = pycovid19geo.split_by_state(COUNTIES)['02']['bbox']
+
+    assert (west, south, east, north) == (172.4, 51.2, -141.0, 71.4)
+
+
+def test_map_view_across_antimeridian():
+    center, zoom = pycovid19geo.map_view(pycovid19geo.split_by_state(COUNTIES)['02'], 1300, 700)
+
+    # 46.6 degrees wide, centered between 172.4 and 219.0 (i.e. -141.0)
+    assert center['lon'] == pytest.approx(-164.3)
+    assert center['lat'] == pytest.approx(61.3)
+    # Fitting the 20.2 degrees of latitude, rather than 353 of longitude
+    assert 4 < zoom < 4.5
+
+
+def test_map_view_without_bbox():
+    assert pycovid19geo.map_view({'type': 'FeatureCollection', 'features': []}, 1300, 700)[1] == 3.5
+
+
+def test_state_map_extent_from_full_resolution(loaded):
+    geo_data, center, zoom = pycovid19geo.state_map('Ohio', 1300, 700)
+
+    assert center == pytest.approx({'lat': 40.2, 'lon': -82.65})
+    tolerance = pycovid19geo.tolerance_for_zoom(zoom)
+    # Only the full resolution borders, for the extent, and those drawn at the zoom level were loaded
+    assert loaded == [0.0, tolerance] and tolerance != pycovid19geo.TOLERANCES[-1]
+    assert [feature['id'] for feature in geo_data['features']] == ['39001', '39003']
+
+    pycovid19geo.state_map('Ohio', 1300, 700)
+    assert loaded == [0.0, tolerance]
+
+
+def test_state_map_unknown_state(loaded):
+    geo_data, center, zoom = pycovid19geo.state_map('Atlantis', 1300, 700)
+
+    assert geo_data['features'] == []
+    assert (center, zoom) == ({'lat': 37.0902, 'lon': -95.7129}, 3.5)
@@ -0,0 +1,68 @@
+"""Tests of the snapshots of pycovid19ingest, from a local Global CSV"""
+import os
+import pyarrow.parquet as pq
+import pytest
+import pycovid19cache
+import pycovid19ingest
+
+CSV = ('Province/State,Country/Region,Lat,Long,1/22/20,1/23/20,1/24/20\n'
+       ',Italy,41.9,12.6,1,2,4\n'
+       'Hubei,China,30.9,112.2,5,,9\n'
+       ',Spain,40.4,-3.7,0,0,1\n'
+      )
+
+
+@pytest.fixture
+def raw(tmp_path, monkeypatch):
+    path = tmp_path / 'upstream.csv'
+    path.write_text(CSV)
+    monkeypatch.setattr(pycovid19cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(pycovid19cache, 'fetch', lambda url, **kwargs: str(path))
+    return path
+
+
+def test_snapshot_dir_follows_cache_dir(raw, tmp_path, monkeypatch):
+    path = pycovid19ingest.ingest('Global', 'Deaths')
+    assert os.path.dirname(path) == str(tmp_path / 'cache' / 'snapshots')
+
+    monkeypatch.setattr(pycovid19cache, 'CACHE_DIR', str(tmp_path / 'elsewhere'))
+    path = pycovid19ingest.ingest('Global', 'Deaths')
+    assert os.path.dirname(path) == str(tmp_path / 'elsewhere' / 'snapshots')
+    assert pycovid19ingest.read_entities('Global') == ['Italy', 'China', 'Spain']
+
+
+def test_snapshot_is_typed_and_versioned(raw):
+    path = pycovid19ingest.ingest('Global', 'Deaths')
+
+    assert pycovid19ingest.snapshot_format(path) == pycovid19ingest.SNAPSHOT_FORMAT
+    frame = pycovid19ingest.load('Global', 'Deaths')
+    assert frame['Country/Region'].dtype == 'category'
+    assert frame['1/23/20'].tolist() == [2, 0, 0]
+    assert str(frame['1/23/20'].dtype) == 'int32'
+
+
+def test_current_snapshot_is_reused(raw):
+    path = pycovid19ingest.ingest('Global', 'Deaths')
+    written = os.stat(path).st_mtime_ns
+
+    assert pycovid19ingest.ingest('Global', 'Deaths') == path
+    assert os.stat(path).st_mtime_ns == written
+
+
+@pytest.mark.parametrize('metadata', [None, {pycovid19ingest.FORMAT_KEY: b'0-old'}])
+def test_snapshot_of_another_format_is_ingested_again(raw, metadata):
+    path = pycovid19ingest.ingest('Global', 'Deaths')
+    # An older snapshot, newer than the CSV but without the current format
+    pq.write_table(pq.read_table(path).replace_schema_metadata(metadata), path)
+    assert pycovid19ingest.snapshot_format(path) != pycovid19ingest.SNAPSHOT_FORMAT
+
+    pycovid19ingest.ingest('Global', 'Deaths')
+
+    assert pycovid19ingest.snapshot_format(path) == pycovid19ingest.SNAPSHOT_FORMAT
+
+
+def test_unreadable_snapshot_has_no_format(tmp_path):
+    path = tmp_path / 'broken.parquet'
+    path.write_bytes(b'not parquet')
+
+    assert pycovid19ingest.snapshot_format(str(path)) is None
@@ -0,0 +1,37 @@
+"""Tests of pycovid19metrics"""
+import panel.io.document
+from bokeh.protocol.message import Message
+import pytest
+import pycovid19metrics
+
+
+@pytest.fixture
+def unpatched(monkeypatch):
+    # Restores the functions _record_messages replaces
+    monkeypatch.setattr(Message, 'send', Message.send)
+    monkeypatch.setattr(panel.io.document, 'dispatch_tornado', panel.io.document.dispatch_tornado)
+
+
+def test_recordable():
+    # Fails once Bokeh or Panel no longer send the messages through the functions that are wrapped, see
+    # the pins in requirements.txt
+    assert hasattr(Message, 'send')
+    assert hasattr(panel.io.document, 'dispatch_tornado')
+    assert pycovid19metrics.recordable()
+
+
+def test_messages_recorded(unpatched):
+    send, dispatch = Message.send, panel.io.document.dispatch_tornado
+    pycovid19metrics._record_messages()
+
+    assert Message.send.__wrapped__ is send
+    assert panel.io.document.dispatch_tornado.__wrapped__ is dispatch
+
+
+def test_served_without_message_metrics(unpatched, monkeypatch, caplog):
+    monkeypatch.delattr(panel.io.document, 'dispatch_tornado')
+    send = Message.send
+    pycovid19metrics._record_messages()
+
+    assert Message.send is send
+    assert 'Not recording the websocket messages' in caplog.text
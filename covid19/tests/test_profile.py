@@ -0,0 +1,70 @@
+"""Tests of the /admin/profiles routes of pycovid19profile"""
+from types import SimpleNamespace
+import json
+import logging
+import pytest
+import pycovid19profile
+
+TOKEN = 's3cret'
+
+
+def test_no_routes_without_token(monkeypatch, caplog):
+    monkeypatch.setattr(pycovid19profile, 'ENABLED', True)
+    monkeypatch.setattr(pycovid19profile, 'TOKEN', '')
+
+    with caplog.at_level(logging.ERROR):
+        assert pycovid19profile.routes() == []
+    assert 'COVID19_ADMIN_TOKEN' in caplog.text
+
+
+def test_no_routes_when_disabled(monkeypatch):
+    monkeypatch.setattr(pycovid19profile, 'ENABLED', False)
+    monkeypatch.setattr(pycovid19profile, 'TOKEN', TOKEN)
+
+    assert pycovid19profile.routes() == []
+
+
+def test_session_is_hashed(monkeypatch):
+    session_context = SimpleNamespace(id='A6pDvX0ZqK2fJ0qD9nHwq3sZ1bT9uYc4eR5wQ7xM')
+    monkeypatch.setattr(pycovid19profile.pn, 'state', SimpleNamespace(curdoc=SimpleNamespace(session_context=session_context)))
+    session = pycovid19profile._session()
+
+    assert len(session) == pycovid19profile.SESSION_DIGITS
+    assert session_context.id not in pycovid19profile.Interaction('callback', session, {}).name
+    assert session == pycovid19profile._session()
+
+
+@pytest.fixture
+def admin(monkeypatch, serve):
+    # The routes of a process in profiling mode, with one profile recorded
+    monkeypatch.setattr(pycovid19profile, 'ENABLED', True)
+    monkeypatch.setattr(pycovid19profile, 'TOKEN', TOKEN)
+    monkeypatch.setattr(pycovid19profile, 'slowest', [])
+    interaction = pycovid19profile.Interaction('Covid19ViewerUS.plotlyChoropleth', '5f2a9c1e0b7d', {'ylog': 'linear'})
+    interaction.profiler.runcall(sorted, range(1000))
+    pycovid19profile.slowest.append((0.5, 0, interaction, interaction.dump()))
+    return SimpleNamespace(name=interaction.name, fetch=serve(pycovid19profile.routes()))
+
+
+@pytest.mark.parametrize('query', ['', '?token=wrong'])
+@pytest.mark.parametrize('path', ['/admin/profiles', '/admin/profiles/{name}'])
+def test_token_required(admin, path, query):
+    assert admin.fetch(path.format(name=admin.name) + query).code == 403
+
+
+def test_list(admin):
+    response = admin.fetch(f'/admin/profiles?token={TOKEN}')
+
+    assert response.code == 200
+    assert [profile['name'] for profile in json.loads(response.body)] == [admin.name]
+
+
+def test_download(admin):
+    response = admin.fetch(f'/admin/profiles/{admin.name}', headers={'Authorization': f'Bearer {TOKEN}'})
+
+    assert response.code == 200
+    assert response.body == pycovid19profile.slowest[0][3]
+
+
+def test_wrong_bearer_token(admin):
+    assert admin.fetch(f'/admin/profiles/{admin.name}', headers={'Authorization': 'Bearer wrong'}).code == 403
@@ -0,0 +1,39 @@
+"""Tests of the followers of pycovid19refresh, which attach the versions another process publishes"""
+import numpy as np
+import pytest
+import pycovid19refresh
+import pycovid19render
+import pycovid19shared
+import pycovid19store
+
+
+@pytest.fixture
+def shared(tmp_path, monkeypatch):
+    monkeypatch.setattr(pycovid19shared, 'DIRECTORY', str(tmp_path))
+    monkeypatch.setattr(pycovid19store, 'store', pycovid19store.DatasetStore())
+    monkeypatch.setattr(pycovid19render, 'renders', pycovid19store.DatasetStore())
+    monkeypatch.setattr(pycovid19render, 'version', 0)
+    monkeypatch.setattr(pycovid19refresh, 'version', 0)
+    monkeypatch.setattr(pycovid19refresh, '_subscribers', [])
+    return tmp_path
+
+
+def test_follow(shared):
+    notified = []
+
+    def callback():
+        notified.append(pycovid19refresh.version)
+
+    pycovid19refresh.subscribe(callback)
+    assert not pycovid19refresh.follow()
+
+    pycovid19shared.publish({('US', 'Confirmed Cases', 'cube'): np.arange(3)}, ('fingerprint', 1))
+    assert pycovid19refresh.follow()
+    assert pycovid19refresh.version == 1
+    assert pycovid19store.store.get(('US', 'Confirmed Cases', 'cube'), list).tolist() == [0, 1, 2]
+    assert pycovid19render.version == 1
+    assert notified == [1]
+
+    # Nothing new published
+    assert not pycovid19refresh.follow()
+    assert notified == [1]
@@ -0,0 +1,41 @@
+"""Tests of the shared outputs of pycovid19render"""
+from types import SimpleNamespace
+import pytest
+import pycovid19endpoint
+import pycovid19render
+import pycovid19store
+
+
+class Chart:
+    """ Stands in for an Altair chart, with its data inline """
+
+    def to_dict(self):
+        return {'mark': 'line', 'encoding': {'y': {'field': 'Qty', 'type': 'quantitative'}},
+                'datasets': {'data-1': [{'Qty': 1}, {'Qty': 2}]}}
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    monkeypatch.setattr(pycovid19render, 'renders', pycovid19store.DatasetStore())
+    monkeypatch.setattr(pycovid19endpoint, 'enabled', False)
+    calls = []
+
+    def render():
+        calls.append(1)
+        return None, Chart()
+
+    return SimpleNamespace(render=render, calls=calls)
+
+
+def test_vega_spec_copies_are_independent(renders):
+    owner = SimpleNamespace(state_province=['Ohio'])
+    first = pycovid19render.vega_spec('View', owner, ['state_province'], renders.render)
+    # As the Vega pane does with the datasets, and a session might with anything else
+    first.pop('datasets')
+    first['encoding']['y']['type'] = 'log'
+
+    second = pycovid19render.vega_spec('View', owner, ['state_province'], renders.render)
+
+    assert len(renders.calls) == 1
+    assert second == Chart().to_dict()
+    assert second['encoding'] is not first['encoding']
@@ -0,0 +1,151 @@
+"""Tests of pycovid19store"""
+from types import SimpleNamespace
+import pickle
+import pytest
+import pycovid19store
+
+
+def test_failed_load_is_retried():
+    store = pycovid19store.DatasetStore()
+
+    def failing():
+        raise RuntimeError('upstream down')
+
+    with pytest.raises(RuntimeError):
+        store.get('key', failing)
+    assert store._loading == {}
+    assert store.get('key', lambda: 'value') == 'value'
+    assert store._loading == {}
+
+
+def test_sized_dict_is_sized_once():
+    geo_data = {'type': 'FeatureCollection', 'features': [{'id': '39001', 'coordinates': [[0.5, 1.5]] * 100}]}
+    sized = pycovid19store.SizedDict(geo_data)
+    size = sized.nbytes
+
+    assert size >= pycovid19store.sizeof(geo_data)
+    sized['features'] = []
+    assert pycovid19store.sizeof(sized) == size
+    # Also once attached from a shared block, see pycovid19shared
+    assert pickle.loads(pickle.dumps(sized, protocol=5)).nbytes == sized.nbytes
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # The store's monotonic clock, only moving when told to
+    now = [1000.0]
+    monkeypatch.setattr(pycovid19store, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def loader(value):
+    # A loader counting its calls
+    def load():
+        load.calls += 1
+        return value
+    load.calls = 0
+    return load
+
+
+def test_stored_none_is_a_hit():
+    store = pycovid19store.DatasetStore()
+    load = loader(None)
+
+    assert store.get('key', load) is None
+    assert store.get('key', load) is None
+    assert load.calls == 1
+    assert (store.hits, store.misses) == (1, 1)
+
+
+def test_ttl_expiry(clock):
+    store = pycovid19store.DatasetStore(ttl=60)
+    load = loader('value')
+    store.get('key', load)
+    clock[0] += 59
+
+    assert 'key' in store
+    store.get('key', load)
+    assert load.calls == 1
+    clock[0] += 2
+    assert 'key' not in store
+    store.get('key', load)
+    assert load.calls == 2
+
+
+def test_ttl_of_one_entry(clock):
+    store = pycovid19store.DatasetStore(ttl=60)
+    store.get('short', loader('value'), ttl=5)
+    store.get('long', loader('value'))
+    clock[0] += 10
+
+    assert 'short' not in store
+    assert 'long' in store
+
+
+def test_lru_eviction_by_size():
+    size = pycovid19store.sizeof(b'x' * 1000)
+    store = pycovid19store.DatasetStore(max_bytes=3 * size)
+    for key in 'abc':
+        store.put(key, b'x' * 1000)
+    # a is now the most recently used, b the least
+    store.get('a', loader(None))
+    store.put('d', b'x' * 1000)
+
+    assert [key for key in 'abcd' if key in store] == ['a', 'c', 'd']
+    assert store.evictions == 1
+    assert store.nbytes == 3 * size
+
+
+def test_entry_over_the_ceiling_is_kept_alone():
+    store = pycovid19store.DatasetStore(max_bytes=100)
+    store.put('small', b'x')
+    store.put('large', b'x' * 1000)
+
+    assert 'large' in store
+    assert 'small' not in store
+    assert len(store) == 1
+
+
+def test_counters():
+    store = pycovid19store.DatasetStore()
+    for key in ('a', 'a', 'a', 'b'):
+        store.get(key, loader(key))
+    stats = store.stats()
+
+    assert (stats['hits'], stats['misses'], stats['entries']) == (2, 2, 2)
+    assert stats['hit_rate'] == 0.5
+
+
+def test_swap():
+    store = pycovid19store.DatasetStore()
+    store.put('old', 'value')
+    generation = store.generation
+    store.swap({'a': 1, 'b': 2})
+
+    assert store.generation == generation + 1
+    assert 'old' not in store
+    assert store.get('a', loader(None)) == 1
+    assert store.nbytes == pycovid19store.sizeof(1) + pycovid19store.sizeof(2)
+
+
+def test_value_loaded_across_a_swap_is_not_stored():
+    store = pycovid19store.DatasetStore()
+
+    def load():
+        # Loaded from the previous data, while a refresh swaps in the new one
+        store.swap({'other': 1})
+        return 'stale'
+
+    assert store.get('key', load) == 'stale'
+    assert 'key' not in store
+    assert 'other' in store
+
+
+def test_invalidate():
+    store = pycovid19store.DatasetStore()
+    store.swap({'a': 1, 'b': 2})
+    store.invalidate('a')
+
+    assert ('a' in store, 'b' in store) == (False, True)
+    store.invalidate()
+    assert (len(store), store.nbytes) == (0, 0)